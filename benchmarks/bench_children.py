@@ -0,0 +1,44 @@
+"""Makes the child descriptors that crawling a large listing makes.
+
+Run from the repository root:
+
+    python benchmarks/bench_children.py --count 1000000
+
+Compares joinpath(), which parses and quotes the whole URI again for every child, with child(), which only quotes the
+new name.
+"""
+import argparse
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+import universalio.descriptors as desc  # noqa: E402
+
+
+def timed(label, make, names):
+    start = time.perf_counter()
+    for name in names:
+        make(name)
+    elapsed = time.perf_counter() - start
+    print("{:<20} {:>8.2f}s {:>10.0f} children/s".format(label, elapsed, len(names) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000000)
+    args = parser.parse_args()
+    names = ["file {}.txt".format(i) for i in range(0, args.count)]
+    parents = [
+        ("http", desc.HttpDescriptor("https://example.com/data/project/dir/")),
+        ("sftp", desc.SFTPDescriptor("sftp://sftp.example.com/data/project/dir", "user", None)),
+        ("azure", desc.AzureBlobDescriptor("https://account.blob.core.windows.net/container/dir", "https://account.blob.core.windows.net")),
+    ]
+    for label, parent in parents:
+        timed(label + " joinpath", parent.joinpath, names)
+        timed(label + " child", parent.child, names)
+
+
+if __name__ == "__main__":
+    main()
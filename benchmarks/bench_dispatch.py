@@ -0,0 +1,119 @@
+"""Resolves a mix of locations through FileManager.get_descriptor().
+
+Run from the repository root:
+
+    python benchmarks/bench_dispatch.py --count 1000000 --unique 10000 --plugins 20 --repeat 5
+
+Matching is timed on its own first, comparing every registered class in weight order (what get_descriptor() used to
+do) with the scheme index, with a number of plugin classes registered alongside the built in ones. Resolving then adds
+making the descriptors, with and without interning. Making a descriptor costs far more than matching, so the variants
+take turns and the best of several runs is reported; a single run of each mostly measures the order they ran in.
+"""
+import argparse
+import gc
+import pathlib
+import sys
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+from universalio.fileman import FileManager  # noqa: E402
+from universalio.descriptors import LocalDescriptor  # noqa: E402
+
+
+def make_plugin(i):
+    # Stands in for a descriptor class installed through an entry point, each with its own scheme
+    prefix = "plugin{}://".format(i)
+
+    class _Plugin(LocalDescriptor):
+
+        schemes = ("plugin{}".format(i),)
+
+        @staticmethod
+        def match_location(location):
+            return location.startswith(prefix)
+
+    _Plugin.__name__ = "Plugin{}".format(i)
+    return _Plugin
+
+
+def make_locations(count, unique):
+    templates = [
+        "/data/project/file{}.txt",
+        "https://example.com/files/file{}.csv",
+        "https://account.blob.core.windows.net/container/file{}.nc",
+        "sftp://user@sftp.example.com/home/user/file{}.dat",
+    ]
+    return [templates[i % len(templates)].format(i % unique) for i in range(0, count)]
+
+
+def linear_match(fm, location):
+    if fm.registry_order is None:
+        fm._build_index()
+    for key in fm.registry_order:
+        cls = fm.registry[key][0]
+        if cls.match_location(location):
+            return cls
+    raise ValueError(location)
+
+
+def linear_dispatch(fm, location):
+    return linear_match(fm, location).create_from_location(location)
+
+
+def timed(func, locations):
+    # Callers hang on to the descriptors they use, which is what keeps interned ones alive
+    held = {}
+    gc.collect()
+    start = time.perf_counter()
+    for location in locations:
+        held[location] = func(location)
+    return time.perf_counter() - start
+
+
+def best_of(variants, locations, repeat):
+    best = {label: None for label, _ in variants}
+    for _ in range(0, repeat):
+        for label, func in variants:
+            elapsed = timed(func, locations)
+            if best[label] is None or elapsed < best[label]:
+                best[label] = elapsed
+    for label, elapsed in best.items():
+        print("{:<28} {:>8.2f}s {:>10.0f} locations/s".format(label, elapsed, len(locations) / elapsed))
+    return [best[label] for label, _ in variants]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument("--unique", type=int, default=10000)
+    parser.add_argument("--plugins", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    locations = make_locations(args.count, args.unique)
+
+    fm = FileManager(False, intern_descriptors=False)
+    interned = FileManager(False, intern_descriptors=True)
+    for i in range(0, args.plugins):
+        fm.register_descriptor_class(make_plugin(i), 50)
+        interned.register_descriptor_class(make_plugin(i), 50)
+    # Loads the lazily registered backends so no variant pays for the imports
+    for location in locations[:4]:
+        fm.get_descriptor(location)
+        interned.get_descriptor(location)
+    linear, index = best_of([
+        ("match, linear", lambda loc: linear_match(fm, loc)),
+        ("match, scheme index", fm._find_class),
+    ], locations, args.repeat)
+    print("  scheme index: {:.2f}x".format(linear / index))
+
+    linear, index, intern = best_of([
+        ("resolve, linear", lambda loc: linear_dispatch(fm, loc)),
+        ("resolve, scheme index", fm.get_descriptor),
+        ("resolve, index + intern", interned.get_descriptor),
+    ], locations, args.repeat)
+    print("  scheme index: {:.2f}x, interning on top: {:.1f}x".format(linear / index, index / intern))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Times a cold "import universalio" in fresh interpreters.
+
+Run from the repository root:
+
+    python benchmarks/bench_import.py --runs 10
+
+Also lists which optional backend SDKs got imported along the way, there shouldn't be any.
+"""
+import argparse
+import pathlib
+import statistics
+import subprocess
+import sys
+
+SOURCE_PATH = str(pathlib.Path(__file__).parent.parent / "src")
+
+_SCRIPT = """
+import sys, time
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import universalio
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("aiohttp", "asyncssh", "azure.storage.blob") if m in sys.modules]
+print(elapsed, ",".join(heavy))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    times = []
+    heavy = ""
+    for _ in range(0, args.runs):
+        out = subprocess.run([sys.executable, "-c", _SCRIPT.format(path=SOURCE_PATH)], capture_output=True, text=True, check=True)
+        elapsed, _, heavy = out.stdout.strip().partition(" ")
+        times.append(float(elapsed))
+    print("import universalio: median {:.1f}ms, min {:.1f}ms over {} runs".format(
+        statistics.median(times) * 1000, min(times) * 1000, args.runs
+    ))
+    print("backend SDKs imported: {}".format(heavy or "none"))
+
+
+if __name__ == "__main__":
+    main()
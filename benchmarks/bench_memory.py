@@ -0,0 +1,49 @@
+"""Measures the memory held per descriptor, for descriptors made the way directory listings make them.
+
+Run from the repository root:
+
+    python benchmarks/bench_memory.py --count 100000
+"""
+import argparse
+import gc
+import pathlib
+import sys
+import tracemalloc
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+import universalio.descriptors as desc  # noqa: E402
+
+
+def measure(make, count):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [make(i) for i in range(0, count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return (after - before) / count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=100000)
+    args = parser.parse_args()
+    cases = [("local", lambda i: desc.LocalDescriptor("/data/project/dir/file{}.txt".format(i)))]
+    if hasattr(desc, "HttpDescriptor"):
+        http_dir = desc.HttpDescriptor("https://example.com/data/project/dir/")
+        cases.append(("http", lambda i: http_dir.child("file{}.txt".format(i))))
+    if hasattr(desc, "SFTPDescriptor"):
+        sftp_dir = desc.SFTPDescriptor("sftp://sftp.example.com/data/project/dir", "user", None)
+        cases.append(("sftp", lambda i: sftp_dir.child("file{}.txt".format(i))))
+    if hasattr(desc, "AzureBlobDescriptor"):
+        blob_dir = desc.AzureBlobDescriptor("https://account.blob.core.windows.net/container/dir", "https://account.blob.core.windows.net")
+        cases.append(("azure", lambda i: blob_dir.child("file{}.txt".format(i))))
+    for label, make in cases:
+        make(0)
+        print("{:<8} {:>8.0f} bytes/descriptor".format(label, measure(make, args.count)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,618 @@
+import asyncio
+import bz2
+import logging
+import lzma
+import struct
+import tarfile
+import time
+import zipfile
+import zlib
+from universalio.descriptors.base import UNIOError, DEFAULT_CHUNK_SIZE
+
+
+TAR = "tar"
+ZIP = "zip"
+
+# Chunks of the next file read while the last ones are written out, this (times the chunk size) bounds the memory used
+READ_AHEAD_CHUNKS = 2
+
+_SUFFIXES = [
+    (".tar.gz", TAR, "gz"),
+    (".tgz", TAR, "gz"),
+    (".tar.bz2", TAR, "bz2"),
+    (".tbz2", TAR, "bz2"),
+    (".tar.xz", TAR, "xz"),
+    (".txz", TAR, "xz"),
+    (".tar", TAR, None),
+    (".zip", ZIP, None),
+]
+
+_ZIP_METHODS = {
+    None: zipfile.ZIP_DEFLATED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bz2": zipfile.ZIP_BZIP2,
+}
+
+_ZIP_LOCAL_HEADER = b"PK\x03\x04"
+_ZIP_EMPTY_ARCHIVE = b"PK\x05\x06"
+_ZIP_DATA_DESCRIPTOR = b"PK\x07\x08"
+
+_TAR_FILE_TYPES = (tarfile.REGTYPE, tarfile.AREGTYPE, tarfile.CONTTYPE)
+_TAR_PAX_TYPES = (tarfile.XHDTYPE, tarfile.XGLTYPE, tarfile.SOLARIS_XHDTYPE)
+
+
+def guess_format(name):
+    name = name.rstrip("/").lower()
+    for suffix, archive_format, compression in _SUFFIXES:
+        if name.endswith(suffix):
+            return archive_format, compression
+    return None, None
+
+
+def _compressor(compression):
+    if compression is None:
+        return None
+    if compression == "gz":
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 31)
+    if compression == "bz2":
+        return bz2.BZ2Compressor()
+    if compression == "xz":
+        return lzma.LZMACompressor()
+    raise ValueError("Unknown compression for a tar archive: {}".format(compression))
+
+
+def _decompress_all(decompressor, data, max_length):
+    # Decompresses in pieces of at most max_length, so a small chunk of very compressible data can't fill memory
+    if hasattr(decompressor, "unconsumed_tail"):
+        yield decompressor.decompress(data, max_length)
+        while decompressor.unconsumed_tail and not decompressor.eof:
+            yield decompressor.decompress(decompressor.unconsumed_tail, max_length)
+    else:
+        yield decompressor.decompress(data, max_length)
+        while not (decompressor.eof or decompressor.needs_input):
+            yield decompressor.decompress(b"", max_length)
+
+
+def _zip_date_time(mtime):
+    # Zip can't store anything before 1980
+    if mtime is None:
+        return time.localtime()[:6]
+    return max(time.localtime(mtime.timestamp())[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def _safe_parts(name):
+    parts = [p for p in name.replace("\\", "/").split("/") if p not in ("", ".")]
+    if not parts or ".." in parts or ":" in parts[0]:
+        return None
+    return parts
+
+
+class _ArchivePath:
+
+    # Stands in for the mirror resource of crawl_async(), building the name each resource gets in the archive
+
+    def __init__(self, name=""):
+        self.name = name
+
+    def child(self, name):
+        name = name.rstrip("/")
+        return _ArchivePath("{}/{}".format(self.name, name) if self.name else name)
+
+
+class _ArchiveOutput:
+
+    def __init__(self, writer, compressor=None, chunk_size=None):
+        self.writer = writer
+        self.compressor = compressor
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        # Uncompressed bytes, which is what tar pads to
+        self.position = 0
+        self._buffer = bytearray()
+
+    async def write(self, data):
+        self.position += len(data)
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            await self._drain()
+
+    async def close(self):
+        if self.compressor is not None:
+            self._buffer += self.compressor.flush()
+        await self._drain()
+
+    async def _drain(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            await self.writer.write(data)
+
+
+class _ZipSink:
+
+    # ZipFile only writes synchronously, so it writes here and the pieces are handed on to the output afterwards. Having
+    # no seek() or tell() makes it write data descriptors instead of going back to fill in the sizes.
+
+    def __init__(self):
+        self._pieces = []
+
+    def write(self, data):
+        self._pieces.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    async def drain(self, output):
+        pieces, self._pieces = self._pieces, []
+        for piece in pieces:
+            await output.write(piece)
+
+
+class _ArchiveInput:
+
+    def __init__(self, chunks, decompressor=None, chunk_size=None):
+        self._chunks = chunks
+        self._decompressor = decompressor
+        self._decoded = None
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        self._buffer = bytearray()
+        self._pos = 0
+
+    async def read(self, n):
+        # Returns up to n bytes, only an empty result means the end of the archive
+        if self._pos >= len(self._buffer):
+            piece = await self._more()
+            if piece is None:
+                return b""
+            self._buffer = bytearray(piece)
+            self._pos = 0
+        data = bytes(self._buffer[self._pos:self._pos + n])
+        self._pos += len(data)
+        return data
+
+    async def read_exact(self, n, allow_eof=False):
+        data = await self.read(n)
+        if not data and allow_eof:
+            return data
+        while len(data) < n:
+            more = await self.read(n - len(data))
+            if not more:
+                raise UNIOError("Archive ended unexpectedly")
+            data += more
+        return data
+
+    async def skip(self, n):
+        while n > 0:
+            n -= len(await self.read_exact(min(n, self.chunk_size)))
+
+    def unread(self, data):
+        if data:
+            self._buffer = bytearray(data) + self._buffer[self._pos:]
+            self._pos = 0
+
+    async def _more(self):
+        while True:
+            if self._decoded is not None:
+                piece = next(self._decoded, None)
+                if piece:
+                    return piece
+                if piece is not None:
+                    continue
+                self._decoded = None
+            try:
+                raw = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                return None
+            if self._decompressor is None:
+                return raw
+            if self._decompressor.eof:
+                # Anything after the end of the compressed stream isn't part of the archive
+                continue
+            self._decoded = _decompress_all(self._decompressor, raw, self.chunk_size)
+
+
+class _ReadAhead:
+
+    # Reads the next chunks of a file while the last ones are being written, holding at most READ_AHEAD_CHUNKS of them
+
+    def __init__(self, resource, chunk_size):
+        self.resource = resource
+        self.chunk_size = chunk_size
+        self._chunks = asyncio.Queue(READ_AHEAD_CHUNKS)
+        self._producer = None
+
+    async def __aenter__(self):
+        self._producer = asyncio.ensure_future(self._produce())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._producer.cancel()
+        await asyncio.gather(self._producer, return_exceptions=True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._chunks.get()
+        if chunk is None:
+            raise StopAsyncIteration
+        if isinstance(chunk, Exception):
+            raise chunk
+        return chunk
+
+    async def _produce(self):
+        try:
+            async for chunk in self.resource._read_resumable(self.chunk_size):
+                await self._chunks.put(chunk)
+        except Exception as ex:
+            await self._chunks.put(ex)
+        else:
+            await self._chunks.put(None)
+
+
+async def _walk(source, prefix=None):
+    root = _ArchivePath(prefix.strip("/") if prefix else "")
+    if not await source.is_dir_async():
+        yield source, root.child(source.basename())
+        return
+    if root.name:
+        yield source, root
+    async for resource, path in source.crawl_async(root, True, True):
+        yield resource, path
+
+
+async def _write_tar_entry(output, resource, name, chunk_size):
+    info = tarfile.TarInfo(name)
+    mtime = await resource.mtime_async()
+    info.mtime = mtime.timestamp() if mtime else time.time()
+    if await resource.is_dir_async():
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+        await output.write(info.tobuf(tarfile.PAX_FORMAT))
+        return False
+    size = await resource.size_async()
+    if size is None:
+        raise UNIOError("Size of {} is unknown, it can't be added to a tar archive".format(resource))
+    info.size = size
+    info.mode = 0o644
+    await output.write(info.tobuf(tarfile.PAX_FORMAT))
+    written = 0
+    async with _ReadAhead(resource, chunk_size) as chunks:
+        async for chunk in chunks:
+            written += len(chunk)
+            if written > size:
+                break
+            await output.write(chunk)
+    if written != size:
+        raise UNIOError("{} changed size while it was being archived".format(resource))
+    if size % tarfile.BLOCKSIZE:
+        await output.write(tarfile.NUL * (tarfile.BLOCKSIZE - size % tarfile.BLOCKSIZE))
+    return True
+
+
+async def _write_tar(source, output, prefix, chunk_size):
+    count = 0
+    async for resource, path in _walk(source, prefix):
+        if await _write_tar_entry(output, resource, path.name, chunk_size):
+            count += 1
+    await output.write(tarfile.NUL * (2 * tarfile.BLOCKSIZE))
+    if output.position % tarfile.RECORDSIZE:
+        await output.write(tarfile.NUL * (tarfile.RECORDSIZE - output.position % tarfile.RECORDSIZE))
+    return count
+
+
+async def _write_zip(source, output, prefix, method, chunk_size):
+    sink = _ZipSink()
+    count = 0
+    with zipfile.ZipFile(sink, "w", method) as archive:
+        async for resource, path in _walk(source, prefix):
+            info = zipfile.ZipInfo(path.name, _zip_date_time(await resource.mtime_async()))
+            if await resource.is_dir_async():
+                info.filename += "/"
+                info.external_attr = (0o40755 << 16) | 0x10
+                archive.writestr(info, b"")
+                continue
+            size = await resource.size_async()
+            info.compress_type = method
+            info.external_attr = 0o644 << 16
+            info.file_size = size or 0
+            # zipfile only picks zip64 for sizes it knows about up front
+            with archive.open(info, "w", force_zip64=size is None) as handle:
+                await sink.drain(output)
+                async with _ReadAhead(resource, chunk_size) as chunks:
+                    async for chunk in chunks:
+                        handle.write(chunk)
+                        await sink.drain(output)
+            await sink.drain(output)
+            count += 1
+    await sink.drain(output)
+    return count
+
+
+async def _write_archive(source, target, archive_format, compression, compressor, prefix, chunk_size):
+    async with target.writer() as writer:
+        output = _ArchiveOutput(writer, compressor, chunk_size)
+        if archive_format == TAR:
+            count = await _write_tar(source, output, prefix, chunk_size)
+        else:
+            count = await _write_zip(source, output, prefix, _ZIP_METHODS[compression], chunk_size)
+        await output.close()
+    return count
+
+
+async def create_archive_async(source, target, archive_format=None, compression=None, prefix=None, chunk_size=None,
+                               use_partial_file=True):
+    # Streams source (a file, or a directory and everything under it) into target as it is read, nothing is staged
+    # locally. The format and compression are guessed from the target name unless given.
+    if archive_format is None:
+        archive_format, guessed = guess_format(target.basename())
+        if compression is None:
+            compression = guessed
+    if archive_format == TAR:
+        compressor = _compressor(compression)
+    elif archive_format == ZIP:
+        if compression not in _ZIP_METHODS:
+            raise ValueError("Unknown compression for a zip archive: {}".format(compression))
+        compressor = None
+    else:
+        raise ValueError("Unknown archive format for {}: {}".format(target, archive_format))
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    # An archive cut short can still look complete, so where the target can be renamed cheaply it is only put in
+    # place once everything is written, as copies do
+    if use_partial_file and await target._supports_fast_rename_async():
+        partial_file = await target._partial_file_async()
+        try:
+            count = await _write_archive(source, partial_file, archive_format, compression, compressor, prefix,
+                                         chunk_size)
+            await partial_file.move_async(target, allow_overwrite=True)
+        finally:
+            if await partial_file.exists_async():
+                await partial_file.remove_async()
+    else:
+        count = await _write_archive(source, target, archive_format, compression, compressor, prefix, chunk_size)
+    target.clear_cache()
+    logging.getLogger(__name__).debug("Archived {} entries from {} into {}".format(count, source, target))
+    return count
+
+
+def create_archive(source, target, **kwargs):
+    return source.loop.run(create_archive_async(source, target, **kwargs))
+
+
+class _Extractor:
+
+    def __init__(self, target_dir, chunk_size):
+        self.target_dir = target_dir
+        self.chunk_size = chunk_size
+        self.count = 0
+        self._made = set()
+
+    def resolve(self, name):
+        parts = _safe_parts(name)
+        if parts is None:
+            logging.getLogger(__name__).warning("Skipping archive entry {}, it points outside the target".format(name))
+        return parts
+
+    async def make_dir(self, parts):
+        key = tuple(parts)
+        if key in self._made:
+            return
+        target = self.target_dir
+        for part in parts:
+            target = target.child(part)
+        await target.mkdir_async(True)
+        for i in range(0, len(parts) + 1):
+            self._made.add(key[:i])
+
+    async def write_file(self, parts, chunks):
+        await self.make_dir(parts[:-1])
+        target = self.target_dir
+        for part in parts:
+            target = target.child(part)
+        async with target.writer() as writer:
+            async for chunk in chunks:
+                await writer.write(chunk)
+        target.clear_cache()
+        self.count += 1
+
+
+async def _exact_chunks(stream, size, chunk_size):
+    while size > 0:
+        chunk = await stream.read(min(size, chunk_size))
+        if not chunk:
+            raise UNIOError("Archive ended unexpectedly")
+        size -= len(chunk)
+        yield chunk
+
+
+def _pax_records(data):
+    records = {}
+    pos = 0
+    while pos < len(data) and data[pos:pos + 1] != tarfile.NUL:
+        space = data.index(b" ", pos)
+        length = int(data[pos:space])
+        key, value = data[space + 1:pos + length - 1].split(b"=", 1)
+        records[key.decode("utf-8")] = value.decode("utf-8", "surrogateescape")
+        pos += length
+    return records
+
+
+async def _extract_tar(stream, extractor):
+    global_pax = {}
+    pax = {}
+    long_name = None
+    while True:
+        header = await stream.read_exact(tarfile.BLOCKSIZE, True)
+        if not header or header == tarfile.NUL * tarfile.BLOCKSIZE:
+            break
+        try:
+            info = tarfile.TarInfo.frombuf(header, "utf-8", "surrogateescape")
+        except tarfile.HeaderError as ex:
+            raise UNIOError("Invalid tar header") from ex
+        size = info.size
+        padding = -size % tarfile.BLOCKSIZE
+        if info.type in _TAR_PAX_TYPES or info.type in (tarfile.GNUTYPE_LONGNAME, tarfile.GNUTYPE_LONGLINK):
+            data = await stream.read_exact(size)
+            await stream.skip(padding)
+            if info.type == tarfile.XGLTYPE:
+                global_pax.update(_pax_records(data))
+            elif info.type in _TAR_PAX_TYPES:
+                pax = _pax_records(data)
+            elif info.type == tarfile.GNUTYPE_LONGNAME:
+                long_name = data.rstrip(tarfile.NUL).decode("utf-8", "surrogateescape")
+            continue
+        records = dict(global_pax, **pax)
+        name = records.get("path", long_name or info.name)
+        if "size" in records:
+            size = int(records["size"])
+            padding = -size % tarfile.BLOCKSIZE
+        pax = {}
+        long_name = None
+        parts = extractor.resolve(name)
+        if parts is not None and info.type == tarfile.DIRTYPE:
+            await extractor.make_dir(parts)
+        elif parts is not None and info.type in _TAR_FILE_TYPES:
+            await extractor.write_file(parts, _exact_chunks(stream, size, extractor.chunk_size))
+            size = 0
+        elif parts is not None:
+            logging.getLogger(__name__).warning("Skipping archive entry {}, only files and directories are extracted".format(name))
+        await stream.skip(size + padding)
+
+
+def _zip64_sizes(extra, file_size, compress_size):
+    # The local header has both sizes in its zip64 field, each only where the 32 bit field overflowed
+    pos = 0
+    while pos + 4 <= len(extra):
+        field, length = struct.unpack("<HH", extra[pos:pos + 4])
+        if field == 1:
+            values = extra[pos + 4:pos + 4 + length]
+            if file_size == 0xFFFFFFFF and len(values) >= 8:
+                file_size = struct.unpack("<Q", values[:8])[0]
+                values = values[8:]
+            if compress_size == 0xFFFFFFFF and len(values) >= 8:
+                compress_size = struct.unpack("<Q", values[:8])[0]
+            return file_size, compress_size, True
+        pos += 4 + length
+    return file_size, compress_size, False
+
+
+async def _zip_entry_chunks(stream, info, known_size, chunk_size):
+    crc = 0
+    if info.compress_type == zipfile.ZIP_STORED:
+        async for chunk in _exact_chunks(stream, info.compress_size, chunk_size):
+            crc = zlib.crc32(chunk, crc)
+            yield chunk
+    else:
+        if info.compress_type == zipfile.ZIP_DEFLATED:
+            decompressor = zlib.decompressobj(-15)
+        else:
+            decompressor = bz2.BZ2Decompressor()
+        remaining = info.compress_size if known_size else None
+        while not decompressor.eof:
+            data = await stream.read(chunk_size if remaining is None else min(remaining, chunk_size))
+            if not data:
+                raise UNIOError("Archive ended unexpectedly")
+            if remaining is not None:
+                remaining -= len(data)
+            for chunk in _decompress_all(decompressor, data, chunk_size):
+                if chunk:
+                    crc = zlib.crc32(chunk, crc)
+                    yield chunk
+        # The compressed stream ends on its own, what was read past it belongs to the next entry
+        stream.unread(decompressor.unused_data)
+    info.CRC = crc
+
+
+async def _extract_zip(stream, extractor):
+    while True:
+        signature = await stream.read_exact(4, True)
+        if signature != _ZIP_LOCAL_HEADER:
+            # The central directory follows the last entry, everything in it has been seen already
+            break
+        (_, flags, method, _, _, crc, compress_size, file_size, name_length, extra_length) = struct.unpack(
+            "<HHHHHLLLHH", await stream.read_exact(26)
+        )
+        raw_name = await stream.read_exact(name_length)
+        name = raw_name.decode("utf-8" if flags & 0x800 else "cp437")
+        extra = await stream.read_exact(extra_length)
+        file_size, compress_size, zip64 = _zip64_sizes(extra, file_size, compress_size)
+        has_descriptor = bool(flags & 0x08)
+        if flags & 0x01:
+            raise UNIOError("Encrypted zip entries are not supported: {}".format(name))
+        if method not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2):
+            raise UNIOError("Unsupported compression method {} for zip entry {}".format(method, name))
+        if method == zipfile.ZIP_STORED and has_descriptor and name.endswith("/"):
+            # Directories hold nothing, but ZipFile still flags the sizes of each as coming afterwards
+            compress_size = 0
+        elif method == zipfile.ZIP_STORED and has_descriptor:
+            raise UNIOError("Zip entry {} is stored with a data descriptor, it can't be read as a stream".format(name))
+        info = zipfile.ZipInfo(name)
+        info.compress_type = method
+        info.compress_size = compress_size
+        parts = extractor.resolve(name)
+        chunks = _zip_entry_chunks(stream, info, not has_descriptor, extractor.chunk_size)
+        if parts is not None and name.endswith("/"):
+            await extractor.make_dir(parts)
+            async for _ in chunks:
+                pass
+        elif parts is not None:
+            await extractor.write_file(parts, chunks)
+        else:
+            async for _ in chunks:
+                pass
+        if has_descriptor:
+            descriptor = await stream.read_exact(4)
+            if descriptor == _ZIP_DATA_DESCRIPTOR:
+                descriptor = await stream.read_exact(4)
+            await stream.skip(16 if zip64 else 8)
+            crc = struct.unpack("<L", descriptor)[0]
+        if info.CRC != crc:
+            raise UNIOError("Bad CRC for zip entry {}".format(name))
+
+
+async def extract_archive_async(source, target_dir, chunk_size=None):
+    # Streams the archive in source into target_dir, memory use stays around a few chunks whatever the archive holds.
+    # The format and compression are detected from the content.
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    chunks = source._read_resumable(chunk_size)
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= 6:
+            break
+
+    async def _all_chunks():
+        if head:
+            yield head
+        async for more in chunks:
+            yield more
+
+    decompressor = None
+    if head.startswith(b"\x1f\x8b"):
+        decompressor = zlib.decompressobj(47)
+    elif head.startswith(b"BZh"):
+        decompressor = bz2.BZ2Decompressor()
+    elif head.startswith(b"\xfd7zXZ\x00"):
+        decompressor = lzma.LZMADecompressor()
+    all_chunks = _all_chunks()
+    stream = _ArchiveInput(all_chunks, decompressor, chunk_size)
+    extractor = _Extractor(target_dir, chunk_size)
+    await target_dir.mkdir_async(True)
+    try:
+        if head.startswith(_ZIP_LOCAL_HEADER) or head.startswith(_ZIP_EMPTY_ARCHIVE):
+            await _extract_zip(stream, extractor)
+        else:
+            await _extract_tar(stream, extractor)
+    finally:
+        # Archives can end before the source does (zip's central directory, tar's padding), stop reading there
+        await all_chunks.aclose()
+        await chunks.aclose()
+    target_dir.clear_cache()
+    logging.getLogger(__name__).debug("Extracted {} files from {} into {}".format(extractor.count, source, target_dir))
+    return extractor.count
+
+
+def extract_archive(source, target_dir, **kwargs):
+    return source.loop.run(extract_archive_async(source, target_dir, **kwargs))
@@ -0,0 +1,146 @@
+from autoinject import injector
+import zirconium as zr
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from universalio.retry import is_overload_error
+
+
+MIN_LATENCY_SAMPLE_BYTES = 1024 * 1024
+
+
+class _AdaptiveSlot:
+
+    def __init__(self, limiter, priority=0):
+        self.limiter = limiter
+        self.priority = priority
+        self.bytes = None
+        self._start = None
+
+    def record_bytes(self, n):
+        self.bytes = n
+
+    async def __aenter__(self):
+        await self.limiter.acquire(self.priority)
+        self._start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.monotonic() - self._start
+        if exc_val is None:
+            self.limiter.release_success(elapsed, self.bytes)
+        else:
+            self.limiter.release_failure(exc_val)
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, name, initial_limit=4, min_limit=1, max_limit=64, latency_tolerance=2.0, decrease_factor=0.5):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        # (-priority, arrival, future), so urgent transfers don't queue behind a backlog of bulk ones
+        self._waiters = []
+        self._arrivals = itertools.count()
+        self._baseline = None
+        self._recent = None
+        self._last_decrease = 0
+
+    def slot(self, priority=0):
+        return _AdaptiveSlot(self, priority)
+
+    async def acquire(self, priority=0):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        entry = (-priority, next(self._arrivals), fut)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await fut
+        except asyncio.CancelledError as ex:
+            if fut.done() and not fut.cancelled():
+                self._release()
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise ex
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():
+                continue
+            self.in_flight += 1
+            fut.set_result(True)
+
+    def release_success(self, elapsed, n_bytes=None):
+        # Latency is only comparable between transfers when normalized by their size, and small files are
+        # dominated by per-request overhead
+        cost = elapsed / n_bytes if n_bytes and n_bytes >= MIN_LATENCY_SAMPLE_BYTES else None
+        if cost is not None:
+            self._recent = cost if self._recent is None else (0.8 * self._recent) + (0.2 * cost)
+            if self._baseline is None or cost < self._baseline:
+                self._baseline = cost
+            else:
+                # Let the baseline drift up slowly so it tracks long-term changes in the link
+                self._baseline += (cost - self._baseline) * 0.01
+        if self._recent is not None and self._recent > self._baseline * self.latency_tolerance:
+            self._decrease(elapsed, "latency increased")
+        elif self.in_flight >= int(self.limit) or self._waiters:
+            # Additive increase, roughly one extra slot per window of completed transfers. Only while every slot is
+            # in use, otherwise the host hasn't shown it copes with the current limit yet.
+            self.limit = min(self.max_limit, self.limit + (1.0 / self.limit))
+        self._release()
+
+    def release_failure(self, ex):
+        if is_overload_error(ex):
+            self._decrease(None, "overload error {}".format(type(ex).__name__))
+        self._release()
+
+    def _decrease(self, elapsed, reason):
+        now = time.monotonic()
+        # Only back off once per round of in-flight transfers, several failing together is one signal
+        window = elapsed if elapsed else 1.0
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        old = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        if self._recent is not None:
+            self._recent = self._baseline
+        logging.getLogger(__name__).debug("Reducing concurrency for {} from {} to {} ({})".format(
+            self.name, int(old), int(self.limit), reason
+        ))
+
+
+@injector.injectable
+class AdaptiveConcurrencyController:
+
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self):
+        self.initial_limit = self.config.as_int(("universalio", "adaptive", "initial_limit"), default=4)
+        self.min_limit = self.config.as_int(("universalio", "adaptive", "min_limit"), default=1)
+        self.max_limit = self.config.as_int(("universalio", "adaptive", "max_limit"), default=64)
+        self._limiters = {}
+
+    def limiter(self, descriptor):
+        host_key = descriptor.host_key()
+        if host_key not in self._limiters:
+            self._limiters[host_key] = AdaptiveLimiter(host_key, self.initial_limit, self.min_limit, self.max_limit)
+        return self._limiters[host_key]
+
+    def slot(self, descriptor, priority=0):
+        return self.limiter(descriptor).slot(priority)
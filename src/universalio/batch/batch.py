@@ -1,78 +1,159 @@
 from threading import Thread
-import queue
+import collections
+import concurrent.futures
+import functools
+import threading
 from universalio.global_loop import GlobalLoopContext
 from universalio.fileman import FileManager
+from universalio.descriptors.base import UNIOError
+from universalio.concurrency import BoundedTaskGroup
+from .scheduler import FairShareScheduler
+from .adaptive import AdaptiveConcurrencyController
 from autoinject import injector
 import asyncio
-import time
 import logging
 
 
+class JobFuture(concurrent.futures.Future):
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+    def __str__(self):
+        return str(self.name)
+
+
 class AsynchronousThread(Thread):
 
     loop: GlobalLoopContext = None
 
+    # Results of this many finished jobs are kept for is_completed() and result(), older ones are forgotten
+    completed_history = 10000
+
     @injector.construct
     def __init__(self, on_complete=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._on_complete = on_complete
-        self._q = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = []
+        self._event_loop = None
+        self._halt = None
+        self._halt_requested = False
         self._tasks = set()
-        self._completed = {}
-        self._exit_set = False
+        # Jobs handed to the loop whose start callback hasn't run yet
+        self._starting = set()
+        self._futures = {}
+        self._completed = collections.OrderedDict()
         self.daemon = True
 
     def run_coro(self, job_name, coro_func, *args, **kwargs):
-        self._q.put((coro_func, args, kwargs, job_name))
+        future = JobFuture(job_name)
+        with self._lock:
+            if self._halt_requested and self._event_loop is None:
+                future.cancel()
+                return future
+            self._futures[job_name] = future
+            if self._event_loop is None:
+                # Started once the thread's loop is up
+                self._pending.append((job_name, future, coro_func, args, kwargs))
+            else:
+                self._starting.add(future)
+                self._event_loop.call_soon_threadsafe(self._start_job, job_name, future, coro_func, args, kwargs)
+        return future
 
     def wait_join(self):
-        self._q.put("halt")
+        with self._lock:
+            self._halt_requested = True
+            if self._event_loop is not None:
+                self._event_loop.call_soon_threadsafe(self._halt.set)
         while self.is_alive():
             self.join(0.1)
 
     def run(self):
-        self._exit_set = False
         self.loop.run(self.process_queue())
 
+    def future(self, job_name):
+        if isinstance(job_name, concurrent.futures.Future):
+            return job_name
+        future = self._futures.get(job_name, None)
+        if future is not None:
+            return future
+        # Only unfinished jobs keep their future around
+        if str(job_name) in self._completed:
+            future = JobFuture(job_name)
+            future.set_result(self._completed[str(job_name)])
+            return future
+        raise ValueError("Unknown job {}".format(job_name))
+
+    def wait(self, job_name, timeout=None):
+        concurrent.futures.wait([self.future(job_name)], timeout)
+        return self.is_completed(job_name)
+
     def is_completed(self, job_name):
-        return job_name in self._completed
+        return str(job_name) in self._completed
 
     def result(self, job_name):
+        job_name = str(job_name)
         if job_name in self._completed:
             return self._completed[job_name]
         return None
 
+    def _record(self, job_name, future, result):
+        # Recorded before the future is dropped so wait() always finds one or the other
+        self._completed[str(job_name)] = result
+        self._completed.move_to_end(str(job_name))
+        if self._futures.get(job_name, None) is future:
+            del self._futures[job_name]
+        while len(self._completed) > self.completed_history:
+            self._completed.popitem(last=False)
+
+    def _start_job(self, job_name, future, coro_func, args, kwargs):
+        logging.getLogger(__name__).debug("Queuing new task")
+        self._starting.discard(future)
+        if not future.set_running_or_notify_cancel():
+            self._record(job_name, future, False)
+            return
+        tsk = asyncio.get_running_loop().create_task(coro_func(*args, **kwargs))
+        tsk.name = job_name
+        self._tasks.add(tsk)
+        tsk.add_done_callback(functools.partial(self._job_done, future))
+
+    def _job_done(self, future, task):
+        self._tasks.discard(task)
+        logging.getLogger(__name__).debug("Task {} completed".format(task.name))
+        try:
+            result = task.result()
+            self._record(task.name, future, result)
+            future.set_result(result)
+        except (SystemExit, KeyboardInterrupt) as ex:
+            future.set_exception(ex)
+            raise ex
+        except BaseException as ex:
+            if not isinstance(ex, asyncio.CancelledError):
+                logging.getLogger(__name__).exception(ex)
+            self._record(task.name, future, False)
+            future.set_exception(ex)
+
     async def process_queue(self):
-        while True:
-            if self._q.empty():
-                if self._tasks:
-                    done, pending = await asyncio.wait(self._tasks, timeout=0.1, return_when=asyncio.FIRST_COMPLETED)
-                    if done:
-                        logging.getLogger(__name__).debug("{} tasks completed".format(done))
-                    for task in done:
-                        try:
-                            self._completed[str(task.name)] = task.result()
-                        except SystemExit as ex:
-                            raise ex
-                        except KeyboardInterrupt as ex:
-                            raise ex
-                        except Exception as ex:
-                            logging.getLogger(__name__).exception(ex)
-                            self._completed[str(task.name)] = False
-                    self._tasks = pending
-                else:
-                    await asyncio.sleep(1)
+        self._halt = asyncio.Event()
+        with self._lock:
+            self._event_loop = asyncio.get_running_loop()
+            for item in self._pending:
+                self._start_job(*item)
+            self._pending = []
+            if self._halt_requested:
+                self._halt.set()
+        await self._halt.wait()
+        logging.getLogger(__name__).debug("Halt requested, no more queue items will be processed")
+        with self._lock:
+            self._event_loop = None
+        # Jobs submitted just before the halt may still have their start callbacks waiting on the loop
+        while self._tasks or self._starting:
+            if self._tasks:
+                await asyncio.wait(set(self._tasks))
             else:
-                item = self._q.get()
-                if isinstance(item, str) and item == "halt":
-                    logging.getLogger(__name__).debug("Halt requested, no more queue items will be processed")
-                    break
-                else:
-                    logging.getLogger(__name__).debug("Queuing new task")
-                    tsk = asyncio.create_task(item[0](*item[1], **item[2]))
-                    tsk.name = item[3]
-                    self._tasks.add(tsk)
-        await asyncio.gather(*self._tasks)
+                await asyncio.sleep(0)
         logging.getLogger(__name__).debug("All tasks completed")
         if self._on_complete:
             self._on_complete()
@@ -81,35 +162,76 @@ class AsynchronousThread(Thread):
 class BatchFileCopy:
 
     files: FileManager = None
+    adaptive: AdaptiveConcurrencyController = None
 
     @injector.construct
-    def __init__(self):
+    def __init__(self, max_concurrency=None, max_pending_files=100):
         self.t = AsynchronousThread()
         self.t.start()
-        self.sem = asyncio.Semaphore(5)
+        # Per-host concurrency is left to the adaptive limits, so by default the overall cap only stops one host's
+        # limit from growing as far as it is allowed to
+        self.scheduler = FairShareScheduler(max_concurrency or self.adaptive.max_limit)
+        self.max_pending_files = max_pending_files
 
-    def queue_copy(self, src, dst, name=None, **kwargs):
+    def queue_copy(self, src, dst, name=None, priority=0, tenant=None, **kwargs):
         if name is None:
             name = "copy_{}_to_{}".format(src, dst)
-        self.t.run_coro(name, self._do_copy, src, dst, **kwargs)
-        return name
+        return self.t.run_coro(name, self._do_copy, src, dst, priority, tenant, **kwargs)
 
     def result(self, job_name):
         return self.t.result(job_name)
 
     def wait_for_job(self, op_name):
-        while True:
-            if self.t.is_completed(op_name):
-                return True
-            time.sleep(0.05)
+        return self.t.wait(op_name)
 
     def wait_for_all(self):
         self.t.wait_join()
 
-    async def _do_copy(self, src, dst, **kwargs):
+    async def _do_copy(self, src, dst, priority=0, tenant=None, **kwargs):
         src = self.files.get_descriptor(src)
         dst = self.files.get_descriptor(dst)
-        async with self.sem:
-            await src.copy_async(dst, **kwargs)
-
-
+        # Share by destination unless the caller groups jobs themselves
+        if tenant is None:
+            tenant = dst.host_key()
+        if await src.is_dir_async():
+            await self._do_copy_dir(src, dst, priority, tenant, **kwargs)
+        else:
+            await self._copy_one(src, dst, priority, tenant, src.copy_async, dst, **kwargs)
+
+    async def _do_copy_dir(self, src, dst, priority, tenant, require_not_exists=True, recursive=True,
+                           preliminary_check=False, make_stub_dirs=False, **kwargs):
+        if await src.is_local_to_async(dst):
+            # shutil.copytree() or a server-side copy moves the whole tree faster than scheduling it file by file
+            await self._copy_one(src, dst, priority, tenant, src.copy_async, dst, require_not_exists=require_not_exists,
+                                 recursive=recursive, preliminary_check=preliminary_check,
+                                 make_stub_dirs=make_stub_dirs, **kwargs)
+            return
+        if await dst.is_file_async():
+            raise UNIOError("Cannot copy directory {} to file {}".format(src, dst))
+        if require_not_exists and await dst.exists_async():
+            raise UNIOError("Target directory {} already exists".format(dst))
+        if preliminary_check and not kwargs.get("allow_overwrite", False):
+            async for file, target in src.crawl_async(dst, recursive=recursive):
+                if await target.exists_async():
+                    raise UNIOError("Resource {} already exists".format(target))
+        await dst.mkdir_async(True)
+        # Each file is scheduled on its own so large directories interleave with other jobs
+        tasks = BoundedTaskGroup(self.max_pending_files)
+        async for file, target in src.crawl_async(dst, recursive or make_stub_dirs, recursive):
+            if await file.is_dir_async():
+                await target.mkdir_async(True)
+                continue
+            await tasks.spawn(self._copy_one(
+                file, target, priority, tenant, file._copy_file_async, target, _skip_dir_check=True, **kwargs
+            ))
+        await tasks.join()
+
+    async def _copy_one(self, src, dst, priority, tenant, copy_func, *args, **kwargs):
+        # Looked up before waiting for a slot, crawls and listings usually leave it cached
+        n_bytes = await src.size_async()
+        # The per-destination limit is taken first so a slow host doesn't hold scheduler slots other hosts could use,
+        # it hands out its slots by priority as well so urgent copies don't wait behind that host's bulk backlog
+        async with self.adaptive.slot(dst, priority) as host_slot:
+            async with self.scheduler.slot(priority, tenant):
+                host_slot.record_bytes(n_bytes)
+                await copy_func(*args, **kwargs)
@@ -0,0 +1,101 @@
+import asyncio
+import collections
+
+
+ADDED = "added"
+CHANGED = "changed"
+DELETED = "deleted"
+UNCHANGED = "unchanged"
+UNKNOWN = "unknown"
+
+
+class DiffEntry:
+
+    def __init__(self, status, rel_path, source=None, target=None, is_dir=False, conflict=False):
+        self.status = status
+        self.rel_path = rel_path
+        self.source = source
+        self.target = target
+        self.is_dir = is_dir
+        # Set when a target entry is deleted because the source has the other type (file vs directory) there
+        self.conflict = conflict
+
+    def __repr__(self):
+        return "<DiffEntry {} {}>".format(self.status, self.rel_path)
+
+
+async def _list_children(directory, known_missing=False):
+    children = {}
+    if known_missing or not await directory.exists_async():
+        return children
+    async for child in directory.list_async():
+        # Backends where trailing slashes matter name directories "sub/", so both sides are keyed without it
+        children[child.basename().rstrip("/")] = (child, await child.is_dir_async())
+    return children
+
+
+async def _list_pair(src_dir, dst_dir, dst_missing):
+    return await asyncio.gather(_list_children(src_dir), _list_children(dst_dir, dst_missing))
+
+
+async def compare_files(src_file, dst_file, last_fingerprint=None):
+    # Sizes and times normally come from the listing cache, so this rarely costs a round trip
+    src_size, dst_size = await asyncio.gather(src_file.size_async(), dst_file.size_async())
+    if src_size is None or dst_size is None:
+        return UNKNOWN
+    if src_size != dst_size:
+        return CHANGED
+    src_mtime, dst_mtime = await asyncio.gather(src_file.mtime_async(), dst_file.mtime_async())
+    if src_mtime is None or dst_mtime is None:
+        return UNKNOWN
+    # Copies don't preserve the modification time, so the target is only stale if the source is newer
+    if src_mtime.timestamp() > dst_mtime.timestamp():
+        return CHANGED
+    # The clocks on two hosts can disagree enough to hide a same-size edit, the fingerprint recorded when the file
+    # was last copied can't be fooled that way
+    if last_fingerprint is not None:
+        last_print = await last_fingerprint(src_file)
+        if last_print is not None and last_print != await src_file.fingerprint_async():
+            return CHANGED
+    return UNCHANGED
+
+
+async def diff_trees(source, target, prefetch=8, last_fingerprint=None):
+    # Both trees are walked one directory at a time with each side listed concurrently, so memory use is bounded
+    # by the directory size. Directories only found in the target are reported once rather than descended into.
+    pending = collections.deque([(source, target, "", False)])
+    listings = collections.deque()
+    try:
+        while pending or listings:
+            # Keep a few directories listing ahead of the one being compared
+            while pending and len(listings) < prefetch:
+                src_dir, dst_dir, prefix, dst_missing = pending.popleft()
+                tsk = asyncio.ensure_future(_list_pair(src_dir, dst_dir, dst_missing))
+                listings.append((dst_dir, prefix, tsk))
+            dst_dir, prefix, tsk = listings.popleft()
+            src_children, dst_children = await tsk
+            for name in sorted(set(src_children) | set(dst_children)):
+                rel_path = prefix + name
+                src_child, src_is_dir = src_children.get(name, (None, False))
+                dst_child, dst_is_dir = dst_children.get(name, (None, False))
+                if src_child is None:
+                    yield DiffEntry(DELETED, rel_path, None, dst_child, dst_is_dir)
+                    continue
+                if dst_child is None:
+                    dst_child = dst_dir.child(name + "/" if src_is_dir else name)
+                elif src_is_dir != dst_is_dir:
+                    yield DiffEntry(DELETED, rel_path, src_child, dst_child, dst_is_dir, True)
+                    dst_child = dst_dir.child(name + "/" if src_is_dir else name)
+                    dst_children.pop(name)
+                if src_is_dir:
+                    if name not in dst_children:
+                        yield DiffEntry(ADDED, rel_path, src_child, dst_child, True)
+                    pending.append((src_child, dst_child, rel_path + "/", name not in dst_children))
+                elif name not in dst_children:
+                    yield DiffEntry(ADDED, rel_path, src_child, dst_child)
+                else:
+                    status = await compare_files(src_child, dst_child, last_fingerprint)
+                    yield DiffEntry(status, rel_path, src_child, dst_child)
+    finally:
+        for _, _, tsk in listings:
+            tsk.cancel()
@@ -0,0 +1,92 @@
+import asyncio
+import collections
+
+
+class _SchedulerSlot:
+
+    def __init__(self, scheduler, priority, tenant):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.tenant = tenant
+
+    async def __aenter__(self):
+        await self.scheduler.acquire(self.priority, self.tenant)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.scheduler.release(self.tenant)
+
+
+class FairShareScheduler:
+
+    def __init__(self, max_concurrency=5):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.active_by_tenant = collections.Counter()
+        # priority => tenant => waiting futures, tenants kept in round-robin order
+        self._waiting = {}
+
+    def slot(self, priority=0, tenant=None):
+        return _SchedulerSlot(self, priority, tenant)
+
+    def waiting(self):
+        return sum(len(q) for tenants in self._waiting.values() for q in tenants.values())
+
+    async def acquire(self, priority=0, tenant=None):
+        if self.active < self.max_concurrency and not self._waiting:
+            self._grant(tenant)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        tenants = self._waiting.setdefault(priority, collections.OrderedDict())
+        tenants.setdefault(tenant, collections.deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError as ex:
+            if fut.done() and not fut.cancelled():
+                # Granted just before we were cancelled, give it back
+                self.release(tenant)
+            else:
+                self._remove_waiter(priority, tenant, fut)
+            raise ex
+
+    def release(self, tenant=None):
+        self.active -= 1
+        self.active_by_tenant[tenant] -= 1
+        if self.active_by_tenant[tenant] <= 0:
+            del self.active_by_tenant[tenant]
+        self._dispatch()
+
+    def _grant(self, tenant):
+        self.active += 1
+        self.active_by_tenant[tenant] += 1
+
+    def _remove_waiter(self, priority, tenant, fut):
+        tenants = self._waiting.get(priority, None)
+        if tenants is None or tenant not in tenants:
+            return
+        try:
+            tenants[tenant].remove(fut)
+        except ValueError:
+            pass
+        self._prune(priority, tenant)
+
+    def _prune(self, priority, tenant):
+        tenants = self._waiting[priority]
+        if not tenants[tenant]:
+            del tenants[tenant]
+        if not tenants:
+            del self._waiting[priority]
+
+    def _dispatch(self):
+        while self.active < self.max_concurrency and self._waiting:
+            # Highest priority first, then the tenant with the fewest running jobs (round-robin on ties)
+            priority = max(self._waiting)
+            tenants = self._waiting[priority]
+            tenant = min(tenants, key=lambda t: self.active_by_tenant[t])
+            fut = tenants[tenant].popleft()
+            tenants.move_to_end(tenant)
+            self._prune(priority, tenant)
+            if fut.done():
+                continue
+            self._grant(tenant)
+            fut.set_result(True)
@@ -1,14 +1,39 @@
 from universalio.fileman import FileManager
 from autoinject import injector
 import asyncio
-import time
+import collections
+import functools
 import zirconium as zr
 import sqlite3
+import queue
+import threading
+import time
+import os
 from .batch import AsynchronousThread
-from universalio import GlobalLoopContext
+from .adaptive import AdaptiveConcurrencyController
+from .diff import diff_trees, DiffEntry, ADDED, CHANGED, DELETED, UNCHANGED
+from .watch import create_watcher, RESCAN
+from universalio.concurrency import BoundedTaskGroup
+from universalio.descriptors.base import UNIOError
+from universalio.descriptors.local import LocalDescriptor
+from universalio.delta import delta_copy_async, MIN_DELTA_FILE_SIZE
+from universalio.retry import RetryManager
 import logging
 
 
+_END_OF_STAGE = object()
+
+
+def _outermost_paths(rel_paths):
+    # A new directory is synced whole, so syncing the paths inside it as well would copy them twice at once
+    outermost = []
+    for rel_path in sorted(rel_paths, key=lambda p: p.replace(os.sep, "/")):
+        if outermost and rel_path.replace(os.sep, "/").startswith(outermost[-1].replace(os.sep, "/") + "/"):
+            continue
+        outermost.append(rel_path)
+    return outermost
+
+
 class DirectorySync:
 
     files: FileManager = None
@@ -21,17 +46,31 @@ class DirectorySync:
         self.sem = None
         self.in_memory_checker = in_memory_checker
         self.checker = None
+        self._watches = {}
+        self._close_error = None
 
     def _complete(self):
+        # Runs on the loop thread as it shuts down, so a failure to close is kept for wait_for_all() to raise
         if self.checker:
-            self.checker.close()
+            try:
+                self.checker.close()
+            except UNIOError as ex:
+                self._close_error = ex
             self.checker = None
 
-    def sync_dir(self, src, dst, name=None):
+    def sync_dir(self, src, dst, name=None, two_sided=False, mirror=False, incremental=False):
         if name is None:
             name = "sync_{}_to_{}".format(src, dst)
-        self.t.run_coro(name, self._do_sync, src, dst)
-        return name
+        return self.t.run_coro(name, self._do_sync, src, dst, two_sided, mirror, incremental)
+
+    def watch_dir(self, src, dst, name=None, mirror=False, debounce=2.0, reconcile_interval=3600):
+        if name is None:
+            name = "watch_{}_to_{}".format(src, dst)
+        self._watches[name] = threading.Event()
+        return self.t.run_coro(name, self._do_watch, src, dst, self._watches[name], mirror, debounce, reconcile_interval)
+
+    def stop_watch(self, name):
+        self._watches[str(name)].set()
 
     def is_completed(self, job_name):
         return self.t.is_completed(job_name)
@@ -40,117 +79,635 @@ class DirectorySync:
         return self.t.result(job_name)
 
     def wait_for_job(self, op_name):
-        while True:
-            if self.t.is_completed(op_name):
-                return True
-            time.sleep(0.05)
+        return self.t.wait(op_name)
 
     def wait_for_all(self):
+        # Watches only end when asked to
+        for stop in self._watches.values():
+            stop.set()
         self.t.wait_join()
+        ex, self._close_error = self._close_error, None
+        if ex is not None:
+            raise ex
 
-    async def _do_sync(self, src, dst):
-        if self.sem is None:
-            self.sem = asyncio.Semaphore(5)
+    def _init_sync(self):
         if self.checker is None:
             if self.in_memory_checker:
                 self.checker = InMemoryChecker()
             else:
                 db = self.config.as_path(("universalio", "sync_db"), default=r".\.sync.db")
                 self.checker = SqliteSyncManager(db)
-        synchronizer = DirectorySynchronizer(src, dst, self.checker, self.sem)
-        await synchronizer.sync_all()
+
+    async def _do_sync(self, src, dst, two_sided=False, mirror=False, incremental=False):
+        self._init_sync()
+        synchronizer = DirectorySynchronizer(src, dst, self.checker, self.sem, two_sided=two_sided, mirror=mirror)
+        if incremental:
+            await synchronizer.sync_incremental()
+        else:
+            await synchronizer.sync_all()
+        return synchronizer.file_updates
+
+    async def _do_watch(self, src, dst, stop_event, mirror, debounce, reconcile_interval):
+        self._init_sync()
+        synchronizer = DirectorySynchronizer(src, dst, self.checker, self.sem, mirror=mirror)
+        await synchronizer.watch(stop_event, debounce, reconcile_interval)
         return synchronizer.file_updates
 
 
 class DirectorySynchronizer:
 
-    loop: GlobalLoopContext = None
     files: FileManager = None
+    adaptive: AdaptiveConcurrencyController = None
+    retries: RetryManager = None
 
     @injector.construct
-    def __init__(self, src, dst, sync_checker, sem):
+    def __init__(self, src, dst, sync_checker, sem, compare_workers=16, transfer_workers=32, queue_size=1000,
+                 two_sided=False, mirror=False, delta=True):
         self.source = self.files.get_descriptor(src)
         self.target = self.files.get_descriptor(dst)
         self.checker = sync_checker
-        self.sem = sem
+        # Transfers per host are governed by the adaptive limits, an overall cap is only applied if one is given
+        self.sem = sem if sem is not None else asyncio.Semaphore(transfer_workers)
+        # Mirroring needs to know what is in the target, so it always diffs both sides
+        self.two_sided = two_sided or mirror
+        self.mirror = mirror
+        self.delta = delta
+        self.compare_workers = compare_workers
+        self.transfer_workers = transfer_workers
+        self.queue_size = queue_size
         self.file_updates = 0
+        self.file_deletes = 0
+        self.source_root = str(self.source)
+        self.target_root = str(self.target)
+        self._seen = set()
+        self._deletions = []
 
     async def sync_all(self):
-        work = []
         logging.getLogger(__name__).info("Synchronizing directory {}".format(self.source))
-        async for src_file, dst_file in self.source.crawl(self.target):
-            src_print = await src_file.fingerprint_async()
-            logging.getLogger(__name__).debug("Checking file {}".format(src_file))
-            if await self._check_sync(src_file, dst_file, src_print):
-                tsk = self.loop.create_task(self._do_file_copy(src_file, dst_file, src_print))
-                work.append(tsk)
-                self.file_updates += 1
-        await asyncio.gather(*work)
-
-    async def _do_file_copy(self, src_file, dst_file, src_print):
-        async with self.sem:
+        self._seen = set()
+        await self.checker.preload(self.source_root, self.target_root)
+        try:
+            await self._run_pipeline(self._diff_stage if self.two_sided else self._crawl_stage)
+            # Only a complete crawl tells us which files are gone
+            await self.checker.prune(self.source_root, self.target_root, self._seen)
+            await self.checker.flush()
+        finally:
+            # The scope is only worth keeping in memory while a full pass is reading it
+            await self.checker.release(self.source_root, self.target_root)
+
+    async def sync_paths(self, rel_paths):
+        await self.sync_changes([(rel_path, self.source.child(rel_path)) for rel_path in rel_paths])
+
+    async def sync_changes(self, changes):
+        await self._run_pipeline(functools.partial(self._changes_stage, changes))
+        await self.checker.flush()
+
+    async def sync_incremental(self):
+        # Backends that can list what changed since a checkpoint only need a full pass the first time
+        checkpoint = await self.checker.get_checkpoint(self.source_root, self.target_root)
+        changes, next_checkpoint = await self.source.list_changes_async(checkpoint)
+        if changes is None:
+            next_checkpoint = await self.source.changes_checkpoint_async()
+            await self.sync_all()
+        else:
+            logging.getLogger(__name__).info("Synchronizing {} changes from {}".format(len(changes), self.source))
+            await self.sync_changes(changes)
+        if next_checkpoint is not None:
+            await self.checker.save_checkpoint(self.source_root, self.target_root, next_checkpoint)
+            await self.checker.flush()
+
+    async def watch(self, stop_event, debounce=2.0, reconcile_interval=3600, poll_interval=5.0, use_inotify=None):
+        if not isinstance(self.source, LocalDescriptor):
+            raise UNIOError("Watching for changes is only supported for local directories, not {}".format(self.source))
+        # Changed paths wait until they have been quiet for the debounce time, so a file being written in many
+        # small pieces is only copied once
+        changed = {}
+        rescan = False
+
+        def _on_change(rel_path):
+            nonlocal rescan
+            if rel_path is RESCAN:
+                rescan = True
+            else:
+                changed[rel_path] = time.monotonic()
+
+        watcher = create_watcher(self.source.path, _on_change, poll_interval, use_inotify)
+        await watcher.start()
+        try:
+            # Changes made before the watch started are picked up by a full pass
+            await self.sync_all()
+            last_reconcile = time.monotonic()
+            while not stop_event.is_set():
+                await asyncio.sleep(min(0.5, debounce))
+                now = time.monotonic()
+                if rescan or (reconcile_interval and now - last_reconcile >= reconcile_interval):
+                    rescan = False
+                    changed.clear()
+                    await self.sync_all()
+                    last_reconcile = time.monotonic()
+                    continue
+                ready = [rel_path for rel_path, last_event in changed.items() if now - last_event >= debounce]
+                if ready:
+                    for rel_path in ready:
+                        del changed[rel_path]
+                    await self.sync_paths(_outermost_paths(ready))
+        finally:
+            await watcher.stop()
+
+    async def _run_pipeline(self, first_stage):
+        # crawl -> compare -> transfer -> commit, each stage feeding the next through a bounded queue so a
+        # fast crawl can't run away from the transfers
+        to_compare = asyncio.Queue(self.queue_size)
+        to_transfer = asyncio.Queue(self.queue_size)
+        to_commit = asyncio.Queue(self.queue_size)
+        stages = [
+            asyncio.ensure_future(first_stage(to_compare)),
+            asyncio.ensure_future(self._run_stage(to_compare, to_transfer, self._compare_file, self.compare_workers)),
+            asyncio.ensure_future(self._run_stage(to_transfer, to_commit, self._do_file_copy, self.transfer_workers)),
+            asyncio.ensure_future(self._run_stage(to_commit, None, self._commit_file, 1)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        except BaseException as ex:
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+            raise ex
+        # Deletions wait until everything is copied, so a failed sync never leaves the target with less than before
+        if self._deletions:
+            deletions = self._deletions
+            self._deletions = []
+            logging.getLogger(__name__).debug("Removing {} entries from {}".format(len(deletions), self.target))
+            # Files go in the backend's batch deletes, directories are removed recursively alongside them
+            files = [entry.target for entry in deletions if not entry.is_dir]
+            tasks = BoundedTaskGroup(self.target.concurrency.limit(self.target))
+            for entry in deletions:
+                if entry.is_dir:
+                    await tasks.spawn(self._remove_target(entry))
+            await tasks.spawn(self.target.remove_many_async(files))
+            await tasks.join()
+            self.file_deletes += len(files)
+
+    async def _crawl_stage(self, out_queue):
+        async for src_file, dst_file in self.source.crawl_async(self.target, True):
+            if await src_file.is_dir_async():
+                await dst_file.mkdir_async(True)
+                continue
+            rel_path = self._relative_path(src_file)
+            self._seen.add(rel_path)
+            await out_queue.put((src_file, dst_file, rel_path, None))
+        await out_queue.put(_END_OF_STAGE)
+
+    async def _diff_stage(self, out_queue):
+        async for entry in diff_trees(self.source, self.target, last_fingerprint=self._last_fingerprint):
+            if entry.status == DELETED:
+                if not self.mirror:
+                    continue
+                if entry.conflict:
+                    # The source puts something of the other type here, so it has to go first
+                    await self._remove_target(entry)
+                else:
+                    self._deletions.append(entry)
+            elif entry.is_dir:
+                await entry.target.mkdir_async(True)
+            else:
+                rel_path = self._relative_path(entry.source)
+                self._seen.add(rel_path)
+                if entry.status != UNCHANGED:
+                    await out_queue.put((entry.source, entry.target, rel_path, entry.status))
+        await out_queue.put(_END_OF_STAGE)
+
+    async def _changes_stage(self, changes, out_queue):
+        for rel_path, src_file in changes:
+            dst_file = self.target.child(rel_path)
+            if src_file is None or not await src_file.exists_async():
+                if self.mirror and await dst_file.exists_async():
+                    self._deletions.append(DiffEntry(DELETED, rel_path, None, dst_file, await dst_file.is_dir_async()))
+            elif await src_file.is_dir_async():
+                # A new or moved directory, everything in it is new to us
+                await dst_file.mkdir_async(True)
+                async for sub_file, sub_target in src_file.crawl_async(dst_file, True):
+                    if await sub_file.is_dir_async():
+                        await sub_target.mkdir_async(True)
+                    else:
+                        await out_queue.put((sub_file, sub_target, self._relative_path(sub_file), None))
+            else:
+                await dst_file.parent().mkdir_async(True)
+                await out_queue.put((src_file, dst_file, self._relative_path(src_file), None))
+        await out_queue.put(_END_OF_STAGE)
+
+    async def _remove_target(self, entry):
+        logging.getLogger(__name__).debug("Removing {} from target".format(entry.target))
+        if entry.is_dir:
+            await entry.target.rmdir_async(True)
+        else:
+            await entry.target.remove_async()
+        self.file_deletes += 1
+
+    async def _run_stage(self, in_queue, out_queue, func, workers):
+
+        async def _worker():
+            while True:
+                item = await in_queue.get()
+                if item is _END_OF_STAGE:
+                    # Pass it along so the other workers stop too
+                    await in_queue.put(item)
+                    return
+                result = await func(*item)
+                if result is not None and out_queue is not None:
+                    await out_queue.put(result)
+
+        await asyncio.gather(*[_worker() for _ in range(0, workers)])
+        if out_queue is not None:
+            await out_queue.put(_END_OF_STAGE)
+
+    async def _compare_file(self, src_file, dst_file, rel_path, target_state):
+        logging.getLogger(__name__).debug("Checking file {}".format(src_file))
+        src_print = await src_file.fingerprint_async()
+        if target_state is None:
+            target_exists = await dst_file.exists_async()
+        else:
+            target_exists = target_state != ADDED
+        if not await self._check_sync(rel_path, src_print, target_state, target_exists):
+            return None
+        self.file_updates += 1
+        return src_file, dst_file, rel_path, src_print, target_exists
+
+    def _relative_path(self, src_file):
+        return str(src_file)[len(self.source_root):].lstrip("/\\")
+
+    async def _do_file_copy(self, src_file, dst_file, rel_path, src_print, target_exists):
+        signatures = None
+        if target_exists and await self._use_delta(src_file, dst_file):
+            signatures = await self.checker.get_signatures(self.source_root, self.target_root, rel_path)
+            # Retried outside the slots so a file waiting out its backoff doesn't hold up other transfers
+            result = await self.retries.call(
+                (dst_file, src_file), self._delta_file_once, src_file, dst_file, signatures
+            )
+            signatures = result.signatures
+        else:
+            await self.retries.call((dst_file, src_file), self._copy_file_once, src_file, dst_file)
+        mtime = await src_file.mtime_async()
+        return rel_path, src_print, await src_file.size_async(), mtime.timestamp() if mtime else None, signatures
+
+    async def _use_delta(self, src_file, dst_file):
+        if not self.delta:
+            return False
+        if not await dst_file._supports_range_write_async():
+            return False
+        return (await src_file.size_async() or 0) >= MIN_DELTA_FILE_SIZE
+
+    async def _commit_file(self, rel_path, src_print, size, mtime, signatures=None):
+        logging.getLogger(__name__).debug("Saving fingerprint for {}".format(rel_path))
+        await self.checker.save_fingerprint(
+            self.source_root, self.target_root, rel_path, src_print, size, mtime, signatures
+        )
+
+    async def _copy_file_once(self, src_file, dst_file):
+        async with self.adaptive.slot(dst_file) as host_slot, self.sem:
             logging.getLogger(__name__).debug("Copying file {}".format(src_file))
+            host_slot.record_bytes(await src_file.size_async())
             await src_file.copy_async(dst_file, _skip_dir_check=True, allow_overwrite=True, use_partial_file=True)
-            logging.getLogger(__name__).trace("Saving fingerprint for {}".format(src_file))
-            await self.checker.save_fingerprint(str(src_file), src_print)
 
-    async def _check_sync(self, src_file, dst_file, src_print):
+    async def _delta_file_once(self, src_file, dst_file, signatures):
+        async with self.adaptive.slot(dst_file) as host_slot, self.sem:
+            logging.getLogger(__name__).debug("Updating changed blocks of {}".format(dst_file))
+            result = await delta_copy_async(src_file, dst_file, signatures)
+            host_slot.record_bytes(result.bytes_written)
+            return result
+
+    async def _last_fingerprint(self, src_file):
+        rel_path = self._relative_path(src_file)
+        return await self.checker.get_last_fingerprint(self.source_root, self.target_root, rel_path)
+
+    async def _check_sync(self, rel_path, src_print, target_state, target_exists):
+        # The listing diff already showed the target is missing or different
+        if target_state in (ADDED, CHANGED):
+            return True
         # A fingerprint of None means we can't really tell if it changed or not
         if src_print is None:
             return True
         # Destination file doesn't exist, we need to make it
-        if not await dst_file.exists_async():
+        if not target_exists:
             return True
         # Check if fingerprint has changed since last sync
-        last_print = await self.checker.get_last_fingerprint(str(src_file))
+        last_print = await self.checker.get_last_fingerprint(self.source_root, self.target_root, rel_path)
         return last_print != src_print
 
 
 class SqliteSyncManager:
 
-    def __init__(self, db):
+    def __init__(self, db, batch_size=1000, flush_interval=1.0):
         self.db = db
-        self.db_lock = asyncio.Lock()
-        self.conn = sqlite3.connect(self.db)
-        ddl = "CREATE TABLE IF NOT EXISTS fingerprint_records (filepath text UNIQUE, fingerprint text)"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(self.db, check_same_thread=False)
+        self._read_lock = threading.Lock()
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._preloaded = {}
+        # Passes using each preloaded scope, it is dropped when the last one ends
+        self._preload_users = collections.Counter()
         cursor = self.conn.cursor()
-        cursor.execute(ddl)
+        # WAL lets lookups proceed while the writer thread is committing
+        cursor.execute("PRAGMA journal_mode=WAL")
+        # State is kept per source/target pair, so one source can be synced to several targets
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_state (
+                source_root text NOT NULL,
+                target_root text NOT NULL,
+                rel_path text NOT NULL,
+                fingerprint text,
+                size integer,
+                mtime real,
+                synced_at real NOT NULL,
+                signatures blob,
+                PRIMARY KEY (source_root, target_root, rel_path)
+            ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sync_checkpoints (
+                source_root text NOT NULL,
+                target_root text NOT NULL,
+                checkpoint text,
+                updated_at real NOT NULL,
+                PRIMARY KEY (source_root, target_root)
+            )
+        """)
+        # Databases from before state was kept per pair have a fingerprint_records table keyed by the source file
+        self._has_legacy_records = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fingerprint_records'"
+        ).fetchone() is not None
+        self._adopted = set()
+        cursor.execute("CREATE INDEX IF NOT EXISTS sync_state_synced_at ON sync_state (source_root, target_root, synced_at)")
         self.conn.commit()
         cursor.close()
+        self._queue = queue.Queue()
+        # Set by the writer thread when a batch couldn't be saved, raised from the next flush() or close()
+        self._write_error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
 
     def close(self):
+        if self._writer is not None:
+            self._queue.put(("stop", None))
+            self._writer.join()
+            self._writer = None
         self.conn.close()
-
-    async def get_last_fingerprint(self, file):
-        q = "SELECT fingerprint FROM fingerprint_records WHERE filepath = ?"
-        cursor = self.conn.cursor()
-        fp = cursor.execute(q, [file]).fetchone()
+        self._raise_write_error()
+
+    def _raise_write_error(self):
+        ex, self._write_error = self._write_error, None
+        if ex is not None:
+            raise UNIOError("Failed to save sync state to {}".format(self.db)) from ex
+
+    async def get_last_fingerprint(self, source_root, target_root, rel_path):
+        with self._pending_lock:
+            if (source_root, target_root, rel_path) in self._pending:
+                return self._pending[(source_root, target_root, rel_path)]
+        scope = self._preloaded.get((source_root, target_root), None)
+        if scope is not None:
+            return scope.get(rel_path, None)
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._select_fingerprint, source_root, target_root, rel_path
+        )
+
+    def _select_fingerprint(self, source_root, target_root, rel_path):
+        q = "SELECT fingerprint FROM sync_state WHERE source_root = ? AND target_root = ? AND rel_path = ?"
+        with self._read_lock:
+            self._adopt_legacy_records(source_root, target_root)
+            fp = self.conn.execute(q, [source_root, target_root, rel_path]).fetchone()
         return fp[0] if fp else None
 
-    async def save_fingerprint(self, file, fingerprint):
-        async with self.db_lock:
-            q = "REPLACE INTO fingerprint_records (filepath, fingerprint) VALUES (?, ?)"
-            cursor = self.conn.cursor()
-            cursor.execute(q, [file, fingerprint])
-            self.conn.commit()
+    async def get_checkpoint(self, source_root, target_root):
+        return await asyncio.get_running_loop().run_in_executor(None, self._select_checkpoint, source_root, target_root)
+
+    def _select_checkpoint(self, source_root, target_root):
+        q = "SELECT checkpoint FROM sync_checkpoints WHERE source_root = ? AND target_root = ?"
+        with self._read_lock:
+            row = self.conn.execute(q, [source_root, target_root]).fetchone()
+        return row[0] if row else None
+
+    async def save_checkpoint(self, source_root, target_root, checkpoint):
+        # Queued behind the file records, so it is never committed ahead of the state it describes
+        self._queue.put(("checkpoint", (source_root, target_root, checkpoint, time.time())))
+
+    async def get_signatures(self, source_root, target_root, rel_path):
+        with self._pending_lock:
+            # Not committed yet, the caller can read the target instead
+            if (source_root, target_root, rel_path) in self._pending:
+                return None
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self._select_signatures, source_root, target_root, rel_path
+        )
+
+    def _select_signatures(self, source_root, target_root, rel_path):
+        q = "SELECT signatures FROM sync_state WHERE source_root = ? AND target_root = ? AND rel_path = ?"
+        with self._read_lock:
+            self._adopt_legacy_records(source_root, target_root)
+            row = self.conn.execute(q, [source_root, target_root, rel_path]).fetchone()
+        return row[0] if row else None
+
+    async def preload(self, source_root, target_root):
+        # One scan of the primary key instead of a query per file
+        self._preload_users[(source_root, target_root)] += 1
+        scope = await asyncio.get_running_loop().run_in_executor(None, self._select_scope, source_root, target_root)
+        with self._pending_lock:
+            self._preloaded[(source_root, target_root)] = scope
+
+    async def release(self, source_root, target_root):
+        self._preload_users[(source_root, target_root)] -= 1
+        if self._preload_users[(source_root, target_root)] <= 0:
+            del self._preload_users[(source_root, target_root)]
+            with self._pending_lock:
+                self._preloaded.pop((source_root, target_root), None)
+
+    def _select_scope(self, source_root, target_root):
+        q = "SELECT rel_path, fingerprint FROM sync_state WHERE source_root = ? AND target_root = ?"
+        with self._read_lock:
+            self._adopt_legacy_records(source_root, target_root)
+            return dict(self.conn.execute(q, [source_root, target_root]).fetchall())
+
+    def _adopt_legacy_records(self, source_root, target_root):
+        # Old records only name the source file, they move to the first pair synced from that source so upgrading
+        # doesn't mean copying every tree again. Called with the read lock held; the writer thread does the move so
+        # its connection is the only one writing.
+        if not self._has_legacy_records or (source_root, target_root) in self._adopted:
+            return
+        self._adopted.add((source_root, target_root))
+        done = threading.Event()
+        self._queue.put(("adopt", (source_root, target_root, done)))
+        done.wait()
+
+    def _move_legacy_records(self, conn, source_root, target_root):
+        prefix = source_root.rstrip("/\\")
+        try:
+            rows = conn.execute(
+                "SELECT filepath, fingerprint FROM fingerprint_records WHERE substr(filepath, 1, ?) = ?",
+                [len(prefix), prefix]
+            ).fetchall()
+            # Relative paths as _relative_path() makes them, skipping other directories that share the prefix
+            rows = [(path, fp) for path, fp in rows if path[len(prefix):len(prefix) + 1] in ("/", "\\")]
+            if not rows:
+                return
+            now = time.time()
+            conn.executemany(
+                "INSERT OR IGNORE INTO sync_state (source_root, target_root, rel_path, fingerprint, synced_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(source_root, target_root, path[len(prefix):].lstrip("/\\"), fp, now) for path, fp in rows]
+            )
+            conn.executemany("DELETE FROM fingerprint_records WHERE filepath = ?", [(path,) for path, _ in rows])
+            conn.commit()
+        except sqlite3.Error as ex:
+            logging.getLogger(__name__).exception("Failed to move sync records for {}".format(source_root))
+            conn.rollback()
+            if self._write_error is None:
+                self._write_error = ex
+            return
+        logging.getLogger(__name__).info("Moved {} sync records for {} to {}".format(len(rows), source_root, target_root))
+
+    async def save_fingerprint(self, source_root, target_root, rel_path, fingerprint, size=None, mtime=None,
+                               signatures=None):
+        key = (source_root, target_root, rel_path)
+        with self._pending_lock:
+            self._pending[key] = fingerprint
+            scope = self._preloaded.get((source_root, target_root), None)
+            if scope is not None:
+                scope[rel_path] = fingerprint
+        self._queue.put(("save", (key, (fingerprint, size, mtime, time.time(), signatures))))
+
+    async def prune(self, source_root, target_root, seen):
+        scope = self._preloaded.get((source_root, target_root), None)
+        if scope is None:
+            scope = await asyncio.get_running_loop().run_in_executor(None, self._select_scope, source_root, target_root)
+        removed = [rel_path for rel_path in scope if rel_path not in seen]
+        for rel_path in removed:
+            scope.pop(rel_path, None)
+        if removed:
+            logging.getLogger(__name__).debug("Pruning {} deleted files from sync state".format(len(removed)))
+            self._queue.put(("delete", [(source_root, target_root, rel_path) for rel_path in removed]))
+
+    async def flush(self):
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        await asyncio.get_running_loop().run_in_executor(None, done.wait)
+        self._raise_write_error()
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.db)
+        # Durable across application crashes; only an OS crash can lose the last few batches
+        conn.execute("PRAGMA synchronous=NORMAL")
+        batch = {}
+        deletes = []
+        checkpoints = {}
+        waiting = []
+        stop = False
+        last_commit = time.monotonic()
+        while not stop:
+            timeout = None
+            if batch or deletes or checkpoints:
+                timeout = max(0, self.flush_interval - (time.monotonic() - last_commit))
+            try:
+                op, arg = self._queue.get(timeout=timeout)
+                if op == "save":
+                    batch[arg[0]] = arg[1]
+                elif op == "delete":
+                    deletes.extend(arg)
+                elif op == "checkpoint":
+                    checkpoints[(arg[0], arg[1])] = arg
+                elif op == "flush":
+                    waiting.append(arg)
+                elif op == "adopt":
+                    self._move_legacy_records(conn, arg[0], arg[1])
+                    arg[2].set()
+                elif op == "stop":
+                    stop = True
+            except queue.Empty:
+                pass
+            if stop or waiting or len(batch) >= self.batch_size or (time.monotonic() - last_commit) >= self.flush_interval:
+                if batch or deletes or checkpoints:
+                    self._commit_batch(conn, batch, deletes, list(checkpoints.values()))
+                    batch = {}
+                    deletes = []
+                    checkpoints = {}
+                last_commit = time.monotonic()
+                for evt in waiting:
+                    evt.set()
+                waiting = []
+        conn.close()
+
+    def _commit_batch(self, conn, batch, deletes, checkpoints=None):
+        saved = True
+        try:
+            conn.executemany(
+                "REPLACE INTO sync_state (source_root, target_root, rel_path, fingerprint, size, mtime, synced_at, "
+                "signatures) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*key, *values) for key, values in batch.items()]
+            )
+            conn.executemany(
+                "DELETE FROM sync_state WHERE source_root = ? AND target_root = ? AND rel_path = ?",
+                deletes
+            )
+            if checkpoints:
+                conn.executemany(
+                    "REPLACE INTO sync_checkpoints (source_root, target_root, checkpoint, updated_at) VALUES (?, ?, ?, ?)",
+                    checkpoints
+                )
+            conn.commit()
+        except sqlite3.Error as ex:
+            logging.getLogger(__name__).exception("Failed to save {} sync records".format(len(batch)))
+            conn.rollback()
+            saved = False
+            if self._write_error is None:
+                self._write_error = ex
+        with self._pending_lock:
+            for key, values in batch.items():
+                if self._pending.get(key, None) == values[0]:
+                    del self._pending[key]
+                    # The file is copied again next time rather than trusting a fingerprint that was never stored
+                    scope = self._preloaded.get((key[0], key[1]), None)
+                    if not saved and scope is not None and scope.get(key[2], None) == values[0]:
+                        del scope[key[2]]
 
 
 class InMemoryChecker:
 
     def __init__(self):
-        self._lock = asyncio.Lock()
         self._mem = {}
+        self._signatures = {}
+        self._checkpoints = {}
 
     def close(self):
         pass
 
-    async def get_last_fingerprint(self, file):
-        if file in self._mem:
-            return self._mem[file]
-        return None
+    async def preload(self, source_root, target_root):
+        pass
+
+    async def release(self, source_root, target_root):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def get_last_fingerprint(self, source_root, target_root, rel_path):
+        return self._mem.get((source_root, target_root, rel_path), None)
+
+    async def get_signatures(self, source_root, target_root, rel_path):
+        return self._signatures.get((source_root, target_root, rel_path), None)
+
+    async def get_checkpoint(self, source_root, target_root):
+        return self._checkpoints.get((source_root, target_root), None)
 
-    async def save_fingerprint(self, file, fingerprint):
-        async with self._lock:
-            self._mem[file] = fingerprint
+    async def save_checkpoint(self, source_root, target_root, checkpoint):
+        self._checkpoints[(source_root, target_root)] = checkpoint
 
+    async def save_fingerprint(self, source_root, target_root, rel_path, fingerprint, size=None, mtime=None,
+                               signatures=None):
+        self._mem[(source_root, target_root, rel_path)] = fingerprint
+        self._signatures[(source_root, target_root, rel_path)] = signatures
 
+    async def prune(self, source_root, target_root, seen):
+        for key in list(self._mem.keys()):
+            if key[0] == source_root and key[1] == target_root and key[2] not in seen:
+                del self._mem[key]
+                self._signatures.pop(key, None)
@@ -0,0 +1,190 @@
+import asyncio
+import ctypes
+import ctypes.util
+import functools
+import logging
+import os
+import struct
+import sys
+
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+_WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | \
+    IN_DELETE_SELF | IN_MOVE_SELF
+_EVENT_HEADER = struct.Struct("iIII")
+
+# Passed to the callback instead of a path when events were lost and the whole tree needs checking
+RESCAN = None
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+class _InotifyWatcher:
+
+    def __init__(self, root, callback, libc):
+        self.root = str(root)
+        self.callback = callback
+        self.libc = libc
+        self._fd = None
+        self._watches = {}
+        self._loop = None
+        # Walks of newly created directories still running in the executor
+        self._walks = set()
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._record_watches(await self._loop.run_in_executor(None, self._watch_tree, self.root))
+        self._loop.add_reader(self._fd, self._read_events)
+
+    async def stop(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            # The walks add their watches through the descriptor, so it stays open until they are done
+            await asyncio.gather(*self._walks, return_exceptions=True)
+            os.close(self._fd)
+            self._fd = None
+            self._watches = {}
+
+    def _watch_tree(self, path):
+        # Runs in the executor, the watches are recorded back on the loop by _record_watches()
+        watches = [self._add_watch(path)]
+        for dirpath, dirnames, _ in os.walk(path):
+            for dirname in dirnames:
+                watches.append(self._add_watch(os.path.join(dirpath, dirname)))
+        return watches
+
+    def _add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self._fd, os.fsencode(path), _WATCH_MASK)
+        if wd < 0:
+            logging.getLogger(__name__).warning("Could not watch {}: {}".format(path, os.strerror(ctypes.get_errno())))
+        return wd, path
+
+    def _record_watches(self, watches):
+        rescan = False
+        for wd, path in watches:
+            if wd < 0:
+                # Usually the directory vanished already or we hit max_user_watches, the next rescan catches it up
+                rescan = True
+            else:
+                self._watches[wd] = path
+        if rescan:
+            self.callback(RESCAN)
+
+    def _walk_done(self, rel_path, walk):
+        self._walks.discard(walk)
+        if self._fd is None or walk.cancelled():
+            return
+        if walk.exception() is not None:
+            logging.getLogger(__name__).warning("Could not watch {}: {}".format(rel_path, walk.exception()))
+            self.callback(RESCAN)
+            return
+        self._record_watches(walk.result())
+        self.callback(rel_path)
+
+    def _read_events(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += _EVENT_HEADER.size + length
+            self._handle_event(wd, mask, os.fsdecode(name))
+
+    def _handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            self.callback(RESCAN)
+            return
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return
+        directory = self._watches.get(wd, None)
+        if directory is None:
+            return
+        path = os.path.join(directory, name) if name else directory
+        rel_path = os.path.relpath(path, self.root)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            # Files can land in a new directory before we watch it, so the callback gets the directory once the walk
+            # is done; walking a large tree here would hold up the loop
+            walk = asyncio.ensure_future(self._loop.run_in_executor(None, self._watch_tree, path))
+            self._walks.add(walk)
+            walk.add_done_callback(functools.partial(self._walk_done, rel_path))
+            return
+        self.callback(RESCAN if rel_path == "." else rel_path)
+
+
+class _PollingWatcher:
+
+    def __init__(self, root, callback, interval=5.0):
+        self.root = str(root)
+        self.callback = callback
+        self.interval = interval
+        self._task = None
+        self._snapshot = None
+
+    async def start(self):
+        self._snapshot = await asyncio.get_running_loop().run_in_executor(None, self._scan)
+        self._task = asyncio.ensure_future(self._poll())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _scan(self):
+        snapshot = {}
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, self.root)] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            snapshot = await asyncio.get_running_loop().run_in_executor(None, self._scan)
+            for rel_path in set(snapshot) | set(self._snapshot):
+                if snapshot.get(rel_path, None) != self._snapshot.get(rel_path, None):
+                    self.callback(rel_path)
+            self._snapshot = snapshot
+
+
+def create_watcher(root, callback, poll_interval=5.0, use_inotify=None):
+    libc = _load_libc() if use_inotify is not False else None
+    if libc is not None:
+        return _InotifyWatcher(root, callback, libc)
+    if use_inotify:
+        raise OSError("inotify is not available on this platform")
+    return _PollingWatcher(root, callback, poll_interval)
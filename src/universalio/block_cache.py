@@ -0,0 +1,123 @@
+from autoinject import injector
+import zirconium as zr
+import hashlib
+import logging
+import os
+import pathlib
+import tempfile
+import threading
+from .global_loop import GlobalLoopContext
+
+
+DEFAULT_BLOCK_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+@injector.injectable
+class DiskBlockCache:
+
+    config: zr.ApplicationConfig = None
+    loop: GlobalLoopContext = None
+
+    @injector.construct
+    def __init__(self):
+        self.path = self.config.as_path(("universalio", "block_cache", "path"), default=None)
+        # Only used by default when a cache directory has been configured
+        self.enabled = self.path is not None
+        if self.path is None:
+            self.path = pathlib.Path(tempfile.gettempdir()) / "universalio_block_cache"
+        self.max_size = self.config.as_int(("universalio", "block_cache", "max_size"), default=DEFAULT_BLOCK_CACHE_SIZE)
+        self._lock = threading.Lock()
+        self._current_size = None
+
+    @staticmethod
+    def make_key(location, fingerprint, block_size):
+        return hashlib.sha256("{}|{}|{}".format(location, fingerprint, block_size).encode("utf-8")).hexdigest()
+
+    def _block_path(self, key, block_no):
+        return self.path / key[0:2] / "{}.{}".format(key, block_no)
+
+    def get(self, key, block_no):
+        p = self._block_path(key, block_no)
+        try:
+            with open(p, "rb") as h:
+                data = h.read()
+            # Mark as recently used for the LRU eviction, shared with other processes through the file system
+            os.utime(p)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as ex:
+            logging.getLogger(__name__).warning("Error reading block cache file {}: {}".format(p, ex))
+            return None
+
+    def put(self, key, block_no, data):
+        p = self._block_path(key, block_no)
+        try:
+            p.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=p.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as h:
+                h.write(data)
+            os.replace(tmp, p)
+        except OSError as ex:
+            logging.getLogger(__name__).warning("Error writing block cache file {}: {}".format(p, ex))
+            return
+        with self._lock:
+            if self._current_size is None:
+                self._current_size = self._scan_size()
+            else:
+                self._current_size += len(data)
+            if self._current_size > self.max_size:
+                self._current_size = self._evict()
+
+    async def get_async(self, key, block_no):
+        return await self.loop.execute(self.get, key, block_no)
+
+    async def put_async(self, key, block_no, data):
+        return await self.loop.execute(self.put, key, block_no, data)
+
+    def _entries(self):
+        if not self.path.exists():
+            return
+        for sub in os.scandir(self.path):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                if f.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = f.stat()
+                    yield f.path, st.st_size, st.st_mtime
+                except FileNotFoundError:
+                    # Removed by another process
+                    pass
+
+    def _scan_size(self):
+        return sum(x[1] for x in self._entries())
+
+    def _evict(self):
+        # Other processes share the directory, so the real size is recalculated from disk
+        entries = list(self._entries())
+        total = sum(x[1] for x in entries)
+        target = int(self.max_size * 0.9)
+        entries.sort(key=lambda x: x[2])
+        for path, size, mtime in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as ex:
+                logging.getLogger(__name__).warning("Error evicting block cache file {}: {}".format(path, ex))
+                continue
+            total -= size
+        return total
+
+    def clear(self):
+        with self._lock:
+            for path, size, mtime in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._current_size = 0
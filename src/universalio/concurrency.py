@@ -0,0 +1,167 @@
+from autoinject import injector
+import zirconium as zr
+import asyncio
+import contextvars
+import functools
+
+
+DEFAULT_FAN_OUT = 32
+
+# Hosts the current task already holds a slot for, so nested calls (e.g. a copy on the same server) don't deadlock.
+# Tasks copy the context they are created in, so the owning task is kept alongside and anything else starts empty.
+_held_hosts = contextvars.ContextVar("universalio_held_hosts", default=(None, frozenset()))
+
+
+def _current_held():
+    owner, held = _held_hosts.get()
+    return held if owner is asyncio.current_task() else frozenset()
+
+
+class _HostSlot:
+
+    def __init__(self, governor, host_key, limit):
+        self.governor = governor
+        self.host_key = host_key
+        self.limit = limit
+        self._sem = None
+        self._token = None
+
+    async def __aenter__(self):
+        held = _current_held()
+        if self.limit is None or self.host_key in held:
+            return self
+        self._sem = self.governor._semaphore(self.host_key, self.limit)
+        await self._sem.acquire()
+        self._token = _held_hosts.set((asyncio.current_task(), held | {self.host_key}))
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._sem is not None:
+            try:
+                _held_hosts.reset(self._token)
+            except ValueError:
+                # Exited from a different context, e.g. an async generator closed elsewhere
+                _held_hosts.set((asyncio.current_task(), _current_held() - {self.host_key}))
+            self._sem.release()
+            self._sem = None
+            self._token = None
+
+
+class _HostLimitedContextManager:
+
+    def __init__(self, slot, context_manager):
+        self.slot = slot
+        self.context_manager = context_manager
+
+    async def __aenter__(self):
+        await self.slot.__aenter__()
+        try:
+            return await self.context_manager.__aenter__()
+        except BaseException as ex:
+            await self.slot.__aexit__(type(ex), ex, ex.__traceback__)
+            raise ex
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            return await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
+        finally:
+            await self.slot.__aexit__(exc_type, exc_val, exc_tb)
+
+
+@injector.injectable
+class HostConcurrencyGovernor:
+
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self):
+        self._semaphores = {}
+        self._limits = {}
+
+    def limit(self, descriptor):
+        host_key = descriptor.host_key()
+        if host_key not in self._limits:
+            limit = self.config.get(("universalio", "concurrency", "hosts", host_key), None)
+            if limit is None:
+                limit = self.config.get(("universalio", "concurrency", descriptor.__class__.__name__), None)
+            if limit is None:
+                limit = descriptor.max_host_concurrency
+            self._limits[host_key] = int(limit) if limit else None
+        return self._limits[host_key]
+
+    def set_limit(self, host_key, limit):
+        self._limits[host_key] = limit
+        self._semaphores.pop(host_key, None)
+
+    def slot(self, descriptor):
+        return _HostSlot(self, descriptor.host_key(), self.limit(descriptor))
+
+    def wrap(self, descriptor, context_manager):
+        return _HostLimitedContextManager(self.slot(descriptor), context_manager)
+
+    def _semaphore(self, host_key, limit):
+        loop = asyncio.get_running_loop()
+        entry = self._semaphores.get(host_key, None)
+        # Semaphores are bound to a loop, so recreate it if the global loop was recreated
+        if entry is None or entry[0] is not loop:
+            entry = (loop, asyncio.Semaphore(limit))
+            self._semaphores[host_key] = entry
+        return entry[1]
+
+
+def host_limited(func):
+
+    @functools.wraps(func)
+    async def _wrapped(self, *args, **kwargs):
+        async with self.concurrency.slot(self):
+            return await func(self, *args, **kwargs)
+
+    return _wrapped
+
+
+async def bounded_as_completed(coros, limit=None):
+    # Yields results in completion order, only pulling the next coroutine when one of at most limit finishes
+    coros = iter(coros)
+    limit = limit or DEFAULT_FAN_OUT
+    pending = set()
+    try:
+        while True:
+            for coro in coros:
+                pending.add(asyncio.ensure_future(coro))
+                if len(pending) >= limit:
+                    break
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for tsk in done:
+                yield tsk.result()
+    finally:
+        for tsk in pending:
+            tsk.cancel()
+
+
+class BoundedTaskGroup:
+
+    def __init__(self, max_pending=None):
+        self._pending = asyncio.Semaphore(max_pending or DEFAULT_FAN_OUT)
+        self._tasks = set()
+        self._errors = []
+
+    async def spawn(self, coro):
+        await self._pending.acquire()
+        tsk = asyncio.create_task(coro)
+        self._tasks.add(tsk)
+        tsk.add_done_callback(self._task_done)
+        return tsk
+
+    def _task_done(self, tsk):
+        self._tasks.discard(tsk)
+        self._pending.release()
+        if not tsk.cancelled() and tsk.exception() is not None:
+            self._errors.append(tsk.exception())
+
+    async def join(self):
+        while self._tasks:
+            await asyncio.wait(set(self._tasks))
+        if self._errors:
+            raise self._errors[0]
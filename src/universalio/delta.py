@@ -0,0 +1,117 @@
+import hashlib
+import logging
+import struct
+
+
+DEFAULT_DELTA_BLOCK_SIZE = 1024 * 1024
+MIN_DELTA_FILE_SIZE = 16 * 1024 * 1024
+
+
+def block_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# Marks signatures that also record the state of the target they describe, no block size starts with this byte
+_STAMPED = b"\xff"
+
+
+def pack_signatures(block_size, digests, target_stamp=b""):
+    return _STAMPED + struct.pack(">IH", block_size, len(target_stamp)) + target_stamp + b"".join(digests)
+
+
+def unpack_signatures(blob):
+    block_size, digests, _ = _unpack(blob)
+    return block_size, digests
+
+
+def _unpack(blob):
+    if not blob or len(blob) < 4:
+        return None, [], None
+    if not blob.startswith(_STAMPED):
+        # Written before the target was recorded alongside, nothing says the target still matches
+        block_size = struct.unpack(">I", blob[:4])[0]
+        return block_size, [blob[i:i + 16] for i in range(4, len(blob), 16)], None
+    block_size, stamp_length = struct.unpack(">IH", blob[1:7])
+    start = 7 + stamp_length
+    return block_size, [blob[i:i + 16] for i in range(start, len(blob), 16)], blob[7:start]
+
+
+async def target_stamp(target):
+    # Whatever the backend can tell us about the target that changes when it is written to by someone else
+    metadata = await target.metadata_async()
+    if metadata is None or (metadata.mtime is None and not metadata.etag):
+        return b""
+    mtime = metadata.mtime.isoformat() if metadata.mtime else ""
+    return "{}|{}|{}".format(metadata.size, mtime, metadata.etag or "").encode("utf-8")
+
+
+class DeltaResult:
+
+    def __init__(self, mode, bytes_written, size, signatures):
+        self.mode = mode
+        self.bytes_written = bytes_written
+        self.size = size
+        self.signatures = signatures
+
+
+class _BlockComparer:
+
+    def __init__(self, src, dst, digests, dst_size, block_size):
+        self.src = src
+        self.dst = dst
+        self.digests = digests
+        self.dst_size = dst_size
+        self.block_size = block_size
+
+    async def unchanged(self, offset, data):
+        if offset + len(data) > self.dst_size:
+            return False
+        if self.digests:
+            # Digests from the last sync describe the target without having to read it back
+            return self.digests[offset // self.block_size] == block_digest(data)
+        return (await self.dst.read_range(offset, len(data))) == data
+
+
+
+async def delta_copy_async(source, target, signatures=None, block_size=None):
+    # Updates target in place, only writing the blocks that differ from source. Pass the signatures returned by the
+    # previous call to avoid reading the target back.
+    target.clear_cache()
+    src_size = await source.size_async()
+    dst_size = await target.size_async()
+    sig_block_size, digests, stamp = _unpack(signatures)
+    if sig_block_size is None or (block_size is not None and block_size != sig_block_size):
+        digests = []
+        block_size = block_size or DEFAULT_DELTA_BLOCK_SIZE
+    else:
+        block_size = sig_block_size
+    # Stored digests are only trusted while the target is exactly as the last sync left it, one changed elsewhere
+    # (even to the same size) is read back instead
+    if digests and (len(digests) != -(-dst_size // block_size) or not stamp or stamp != await target_stamp(target)):
+        digests = []
+    written = 0
+    # Like rsync --append-verify, a grown file only counts as appended to if every block of the old content still
+    # matches. Checking that reads the old part of the source anyway, so it happens in the same pass as the delta.
+    appended = 0 < dst_size < src_size
+    async with source._range_reader() as src, target._range_reader() as dst, target._range_writer() as out:
+        comparer = _BlockComparer(src, dst, digests, dst_size, block_size)
+        offset = 0
+        new_digests = []
+        while offset < src_size:
+            data = await src.read_range(offset, min(block_size, src_size - offset))
+            if not data:
+                break
+            if not await comparer.unchanged(offset, data):
+                await out.write_range(offset, data)
+                written += len(data)
+                if offset + len(data) <= dst_size:
+                    appended = False
+            new_digests.append(block_digest(data))
+            offset += len(data)
+        if dst_size > src_size:
+            await out.truncate(src_size)
+    target.clear_cache()
+    mode = "append" if appended else "delta"
+    logging.getLogger(__name__).debug("Updated {} ({}), wrote {} of {} bytes".format(target, mode, written, src_size))
+    signatures = pack_signatures(block_size, new_digests, await target_stamp(target))
+    return DeltaResult(mode, written, src_size, signatures)
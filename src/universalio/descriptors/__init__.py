@@ -1,12 +1,23 @@
-from importlib.util import find_spec as _find_spec
+import importlib as _importlib
 
 from .local import LocalDescriptor
 
-if _find_spec("aiohttp"):
-    from .http import HttpDescriptor
+# The other backends pull in aiohttp, asyncssh or the Azure SDK, so they are only imported when first used
+_LAZY_DESCRIPTORS = {
+    "HttpDescriptor": ".http",
+    "SFTPDescriptor": ".sftp",
+    "AzureBlobDescriptor": ".azure_blob",
+}
 
-if _find_spec("asyncssh"):
-    from .sftp import SFTPDescriptor
 
-if _find_spec("azure.storage.blob.aio"):
-    from .azure_blob import AzureBlobDescriptor
+def __getattr__(name):
+    if name not in _LAZY_DESCRIPTORS:
+        raise AttributeError("module {} has no attribute {}".format(__name__, name))
+    try:
+        module = _importlib.import_module(_LAZY_DESCRIPTORS[name], __name__)
+    except ImportError as ex:
+        # Keeps hasattr() working as a check for whether the backend is installed
+        raise AttributeError("{} is not available: {}".format(name, ex)) from ex
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
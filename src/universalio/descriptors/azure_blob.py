@@ -1,14 +1,25 @@
 import hashlib
-from .base import FileWriter, FileReader, UriResourceDescriptor, AsynchronousDescriptor, ConnectionRegistry
+from .base import FileWriter, FileReader, UriResourceDescriptor, AsynchronousDescriptor, ConnectionRegistry, UNIOError
 from universalio import GlobalLoopContext
+from universalio.concurrency import host_limited
+from universalio.retry import retryable, is_transient_error
+from universalio.fingerprint import FileMetadata, encoded_checksum
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError, HttpResponseError
 from autoinject import injector
 from urllib.parse import urlparse
 import asyncio
+import datetime
+import json
 from zirconium import ApplicationConfig
 
 
 
 AZURE_BLOB_UPLOAD_BUFFER = 5 * 1024 * 1024
+CHANGE_FEED_PAGE_SIZE = 1000
+# Stats for at least this many blobs under one prefix are answered from a listing of the prefix
+STAT_LISTING_THRESHOLD = 8
+# Last-modified times come from the service clock, so leave room for drift from ours
+CHANGE_WATERMARK_SKEW = datetime.timedelta(minutes=5)
 
 
 class _AzureBlobWriterContextManager:
@@ -101,6 +112,35 @@ class _AzureBlobReaderContextManager:
         self._stream = None
 
 
+class _AzureBlobRangeReaderContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, blob_client):
+            self.handle = blob_client
+
+        async def read_range(self, offset, length):
+            try:
+                stream = await self.handle.download_blob(offset=offset, length=length)
+            except HttpResponseError as ex:
+                # Reading from exactly the end of the blob, same as a short read at the end of a file
+                if ex.status_code == 416 or ex.error_code == "InvalidRange":
+                    return b""
+                raise ex
+            return await stream.readall()
+
+    def __init__(self, blob_client):
+        if blob_client is None:
+            raise ValueError("Cannot read from a directory")
+        self.client = blob_client
+
+    async def __aenter__(self):
+        return _AzureBlobRangeReaderContextManager.RangeHandle(await self.client)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 @injector.injectable
 class _AzureBlobHostRegistry(ConnectionRegistry):
 
@@ -125,42 +165,89 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     host_manager: _AzureBlobHostRegistry = None
     loop: GlobalLoopContext = None
 
+    schemes = ("https",)
+    host_suffixes = (".blob.core.windows.net",)
+    fast_children = True
+    max_host_concurrency = 32
+    metadata_ttl = 30
+    # The most sub-requests a blob batch request can hold
+    remove_batch_size = 256
+    # The etag changes on every upload, use "checksum" to ignore uploads of identical content
+    fingerprint_strategies = ("etag", "checksum", "mtime_size")
+    metadata_negative_ttl = 5
+
     @injector.construct
-    def __init__(self, uri, connect_str: str = None, use_default_credentials: bool = True, credentials=None):
+    def __init__(self, uri, connect_str: str = None, use_default_credentials: bool = True, credentials=None,
+                 use_change_feed: bool = False):
         UriResourceDescriptor.__init__(self, uri, True)
         self.connect_str = connect_str
         self._use_credentials = use_default_credentials
         self._credentials = credentials
+        self.use_change_feed = use_change_feed
 
     async def _connect(self):
         return await self.host_manager.connect(self.connect_str, self._use_credentials, self._credentials)
 
+    def _is_retryable_error(self, ex):
+        # HttpResponseError carries status_code and error_code, which is_transient_error() checks
+        if isinstance(ex, (ServiceRequestError, ServiceResponseError)):
+            return True
+        return is_transient_error(ex)
+
     async def _get_container_client(self):
         conn = await self._connect()
         return conn.get_container_client(self.container)
 
     async def _get_blob_client(self):
         conn = await self._connect()
-        path = str(self.path)[1:]
+        path = self._path_str()[1:]
         if path == "":
             return None
         return conn.get_blob_client(self.container, path)
 
+    @host_limited
     async def remove_async(self):
         blob = await self._get_blob_client()
         if blob is None:
             raise ValueError("Cannot remove container")
-        return await blob.delete_blob("include")
+        res = await blob.delete_blob("include")
+        self.clear_cache()
+        return res
+
+    async def _remove_batch_async(self, resources):
+        by_container = {}
+        for r in resources:
+            by_container.setdefault(r.container, []).append(r)
+        for group in by_container.values():
+            await group[0]._delete_blob_batch([r._path_str()[1:] for r in group])
+            for r in group:
+                r.clear_cache()
+
+    @retryable
+    @host_limited
+    async def _delete_blob_batch(self, names):
+        container = await self._get_container_client()
+        responses = await container.delete_blobs(*names, delete_snapshots="include", raise_on_any_failure=False)
+        statuses = [response.status_code async for response in responses]
+        # A 404 means the blob is already gone, e.g. when a retry follows a partly applied batch
+        failed = [name for name, status in zip(names, statuses) if status >= 300 and status != 404]
+        if failed:
+            raise UNIOError("Could not remove {} blobs from {}, including {}".format(len(failed), self.container, failed[0]))
 
     async def is_dir_async(self):
         blob = await self._get_blob_client()
         if blob is None:
             return True
-        if await blob.exists():
+        if await self.is_file_async():
             return False
         return await self.exists_async()
 
     async def is_file_async(self):
+        return await self._cached_async("is_file", self._is_file_call)
+
+    @retryable
+    @host_limited
+    async def _is_file_call(self):
         blob = await self._get_blob_client()
         if blob is None:
             return False
@@ -169,12 +256,12 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     async def list_async(self):
         if not await self.is_file_async():
             container = await self._get_container_client()
-            found = []
+            found = set()
             skip = 0
             kwargs = {}
-            if not str(self.path) == "/":
-                skip = len(str(self.path))
-                kwargs["name_starts_with"] = str(self.path)[1:] + "/"
+            if not self._path_str() == "/":
+                skip = len(self._path_str())
+                kwargs["name_starts_with"] = self._path_str()[1:] + "/"
             else:
                 skip = 0
             async for item in container.list_blobs(**kwargs):
@@ -183,27 +270,119 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
                     n = n[:n.find("/")]
                     if n in found:
                         continue
-                    found.append(n)
-                yield self.child(n)
+                    found.add(n)
+                    child = self.child(n)
+                    child._set_cache("is_file", False)
+                    child._set_cache("exists", True)
+                    yield child
+                else:
+                    # list_blobs() returns the same BlobProperties that get_blob_properties() would
+                    child = self.child(n)
+                    child._set_cache("is_file", True)
+                    child._set_cache("exists", True)
+                    child._set_cache("properties", item)
+                    yield child
 
     async def _do_rename_async(self, target):
         pass
 
     async def exists_async(self):
+        return await self._cached_async("exists", self._exists_call)
+
+    @retryable
+    @host_limited
+    async def _exists_call(self):
         container = await self._get_container_client()
-        async for item in container.list_blobs(name_starts_with=str(self.path)[1:]):
+        async for item in container.list_blobs(name_starts_with=self._path_str()[1:]):
             return True
         return False
 
     def _create_descriptor(self, *args, **kwargs):
-        return AzureBlobDescriptor(*args, connect_str=self.connect_str, **kwargs)
+        return AzureBlobDescriptor(
+            *args,
+            connect_str=self.connect_str,
+            use_default_credentials=self._use_credentials,
+            credentials=self._credentials,
+            use_change_feed=self.use_change_feed,
+            **kwargs
+        )
+
+    def _blob_prefix(self):
+        path = self._path_str()[1:]
+        return path + "/" if path else ""
+
+    async def changes_checkpoint_async(self):
+        # Taken before a full sync starts, anything modified while it runs is seen again next time
+        return json.dumps({"watermark": (datetime.datetime.now(datetime.timezone.utc) - CHANGE_WATERMARK_SKEW).isoformat()})
+
+    async def list_changes_async(self, checkpoint):
+        if not checkpoint:
+            return None, None
+        state = json.loads(checkpoint)
+        next_checkpoint = json.loads(await self.changes_checkpoint_async())
+        if self.use_change_feed:
+            events, next_checkpoint["change_feed"] = await self.loop.execute(self._read_change_feed, state)
+            changes = []
+            for rel_path, event_type in events.items():
+                changes.append((rel_path, None if event_type == "BlobDeleted" else self.child(rel_path)))
+            return changes, json.dumps(next_checkpoint)
+        return await self._list_modified_since(state), json.dumps(next_checkpoint)
+
+    async def _list_modified_since(self, state):
+        # The service can't filter by date, but skipping unmodified blobs here saves comparing each of them
+        watermark = datetime.datetime.fromisoformat(state["watermark"])
+        prefix = self._blob_prefix()
+        container = await self._get_container_client()
+        changes = []
+        async for item in container.list_blobs(name_starts_with=prefix or None):
+            if item.last_modified is None or item.last_modified > watermark:
+                child = self.child(item.name[len(prefix):])
+                child._set_cache("is_file", True)
+                child._set_cache("exists", True)
+                child._set_cache("properties", item)
+                changes.append((item.name[len(prefix):], child))
+        return changes
+
+    def _change_feed_client(self):
+        from azure.storage.blob.changefeed import ChangeFeedClient
+        if not self._use_credentials:
+            return ChangeFeedClient.from_connection_string(self.connect_str)
+        if self._credentials is not None:
+            return ChangeFeedClient(self.connect_str, credential=self._credentials)
+        from azure.identity import DefaultAzureCredential
+        return ChangeFeedClient(self.connect_str, credential=DefaultAzureCredential())
+
+    def _read_change_feed(self, state):
+        # The change feed SDK is synchronous only, so this runs in the executor
+        client = self._change_feed_client()
+        if state.get("change_feed"):
+            pager = client.list_changes(results_per_page=CHANGE_FEED_PAGE_SIZE).by_page(
+                continuation_token=state["change_feed"]
+            )
+        else:
+            pager = client.list_changes(
+                start_time=datetime.datetime.fromisoformat(state["watermark"]),
+                results_per_page=CHANGE_FEED_PAGE_SIZE
+            ).by_page()
+        subject_prefix = "/blobServices/default/containers/{}/blobs/{}".format(self.container, self._blob_prefix())
+        events = {}
+        for page in pager:
+            for event in page:
+                subject = event.get("subject", "")
+                if subject.startswith(subject_prefix):
+                    # Later events for the same blob replace earlier ones
+                    events[subject[len(subject_prefix):]] = event.get("eventType", "")
+        return events, pager.continuation_token
 
     def reader(self, chunk_size=None):
-        return _AzureBlobReaderContextManager(self._get_blob_client(), chunk_size)
+        return self.concurrency.wrap(self, _AzureBlobReaderContextManager(self._get_blob_client(), chunk_size))
 
     def writer(self):
         self.clear_cache()
-        return _AzureBlobWriterContextManager(self._get_blob_client())
+        return self.concurrency.wrap(self, _AzureBlobWriterContextManager(self._get_blob_client()))
+
+    def _range_reader(self):
+        return self.concurrency.wrap(self, _AzureBlobRangeReaderContextManager(self._get_blob_client()))
 
     async def _do_rmdir_async(self):
         pass
@@ -220,6 +399,8 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     async def _properties(self):
         return await self._cached_async("properties", self._get_properties)
 
+    @retryable
+    @host_limited
     async def _get_properties(self):
         blob = await self._get_blob_client()
         if blob is None:
@@ -244,11 +425,63 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
             return None
         return props.creation_time
 
-    async def fingerprint_async(self):
+    async def metadata_async(self):
         props = await self._properties()
         if props is None:
             return None
-        return props.etag
+        return self._properties_metadata(props)
+
+    @staticmethod
+    def _properties_metadata(props):
+        md5 = props.content_settings.content_md5 if props.content_settings else None
+        return FileMetadata(props.size, props.last_modified, props.etag, encoded_checksum("md5", md5))
+
+    def _stat_batches(self, resources):
+        # Blobs are grouped by their virtual directory, so a crowded one is listed once instead of asked about blob by
+        # blob
+        by_prefix = {}
+        for r in resources:
+            if r._path_str() == "/":
+                # The container itself
+                yield [r]
+            else:
+                by_prefix.setdefault((r.container, r._blob_prefix_of_parent()), []).append(r)
+        for group in by_prefix.values():
+            if len(group) >= STAT_LISTING_THRESHOLD:
+                yield group
+            else:
+                yield from ([r] for r in group)
+
+    def _blob_prefix_of_parent(self):
+        name = self._path_str()[1:]
+        return name[:name.rfind("/") + 1]
+
+    async def _stat_batch_async(self, resources):
+        if len(resources) < STAT_LISTING_THRESHOLD:
+            return await super()._stat_batch_async(resources)
+        return await resources[0]._stat_by_listing(resources)
+
+    @retryable
+    @host_limited
+    async def _stat_by_listing(self, resources):
+        wanted = {r._path_str()[1:]: r for r in resources}
+        found = {}
+        container = await self._get_container_client()
+        async for item in container.walk_blobs(name_starts_with=self._blob_prefix_of_parent() or None, delimiter="/"):
+            if item.name.endswith("/"):
+                # A BlobPrefix, i.e. a virtual directory
+                r = wanted.get(item.name[:-1], None)
+                if r is not None:
+                    r._set_cache("is_file", False)
+                    r._set_cache("exists", True)
+                    found[item.name[:-1]] = FileMetadata(is_dir=True)
+            elif item.name in wanted:
+                r = wanted[item.name]
+                r._set_cache("is_file", True)
+                r._set_cache("exists", True)
+                r._set_cache("properties", item)
+                found[item.name] = self._properties_metadata(item)
+        return [(r, found.get(r._path_str()[1:], None)) for r in resources]
 
     async def size_async(self):
         props = await self._properties()
@@ -269,11 +502,13 @@ class AzureBlobDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     def create_from_location(location: str, config: ApplicationConfig):
         pieces = urlparse(location)
         storage_account = pieces.hostname.split(".")[0]
-        auth_config = config.get(("universalio", "azure"))
+        auth_config = config.get(("universalio", "azure"), default=None) or {}
         connect_str = f"https://{pieces.hostname}"
         use_credentials = True
+        use_change_feed = False
         if storage_account in auth_config:
             if "connect_str" in auth_config[storage_account] and auth_config[storage_account]["connect_str"]:
                 connect_str = auth_config[storage_account]["connect_str"]
                 use_credentials = False
-        return AzureBlobDescriptor(location, connect_str, use_credentials)
+            use_change_feed = bool(auth_config[storage_account].get("change_feed", False))
+        return AzureBlobDescriptor(location, connect_str, use_credentials, use_change_feed=use_change_feed)
@@ -1,14 +1,36 @@
 import abc
+import collections
+import io
 import pathlib
+import sys
+import time
 from urllib.parse import urlsplit, quote_plus
 import asyncio
 from autoinject import injector
 import atexit
 from universalio import GlobalLoopContext
+from universalio.block_cache import DiskBlockCache
+from universalio.metadata_cache import MetadataCache
+from universalio.concurrency import HostConcurrencyGovernor, BoundedTaskGroup, bounded_as_completed
+from universalio.retry import RetryManager, is_transient_error
+from universalio.fingerprint import FingerprintManager, FileMetadata
 import hashlib
 import datetime
 
 DEFAULT_CHUNK_SIZE = 5 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_MAX_BLOCKS = 16
+
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 class UNIOError(OSError):
@@ -30,6 +52,16 @@ class ConnectionRegistry(abc.ABC):
             self.host_cache[key] = await self._create_connection(*args, **kwargs)
         return self.host_cache[key]
 
+    async def discard(self, *args, **kwargs):
+        key = self._construct_key(*args, **kwargs)
+        conn = self.host_cache.pop(key, None)
+        if conn is not None:
+            try:
+                await self._close_connection(conn)
+            except Exception:
+                # The connection is usually already broken when it is being discarded
+                pass
+
     def exit(self):
         self.loop.run(self.exit_async())
 
@@ -76,36 +108,329 @@ class FileWriter:
         await self.handle.write(chunk)
 
 
+class RandomAccessReader:
+
+    def __init__(self, handle, size=None, block_size=None, max_blocks=None):
+        self.handle = handle
+        self.size = size
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.max_blocks = max(max_blocks or DEFAULT_MAX_BLOCKS, 1)
+        self._blocks = collections.OrderedDict()
+        self._pos = 0
+        self._last_block = None
+        self._readahead = 1
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            if self.size is None:
+                raise UNIOError("Cannot seek relative to the end of a resource of unknown size")
+            pos = self.size + offset
+        else:
+            raise ValueError("Invalid whence value {}".format(whence))
+        if pos < 0:
+            raise ValueError("Negative seek position {}".format(pos))
+        self._pos = pos
+        return pos
+
+    async def read(self, n=-1):
+        remaining = sys.maxsize if n is None or n < 0 else n
+        pieces = []
+        while remaining > 0:
+            block_no = self._pos // self.block_size
+            block = await self._block(block_no)
+            start = self._pos - (block_no * self.block_size)
+            piece = block[start:start + remaining]
+            if not piece:
+                break
+            pieces.append(piece)
+            self._pos += len(piece)
+            remaining -= len(piece)
+            # A short block means we hit the end of the resource
+            if len(block) < self.block_size and start + len(piece) >= len(block):
+                break
+        return b"".join(pieces)
+
+    async def _block(self, block_no):
+        if block_no in self._blocks:
+            self._blocks.move_to_end(block_no)
+            self._last_block = block_no
+            return self._blocks[block_no]
+        offset = block_no * self.block_size
+        if self.size is not None and offset >= self.size:
+            return b""
+        # Grow the read-ahead window while access is sequential, reset it on random access
+        if self._last_block is not None and block_no == self._last_block + 1:
+            self._readahead = min(self._readahead * 2, max(self.max_blocks // 2, 1))
+        else:
+            self._readahead = 1
+        count = 1
+        while count < self._readahead and (block_no + count) not in self._blocks:
+            count += 1
+        length = count * self.block_size
+        if self.size is not None:
+            length = min(length, self.size - offset)
+        data = await self.handle.read_range(offset, length)
+        for i in range(0, count):
+            self._blocks[block_no + i] = data[i * self.block_size:(i + 1) * self.block_size]
+        while len(self._blocks) > self.max_blocks:
+            self._blocks.popitem(last=False)
+        self._last_block = block_no
+        return data[0:self.block_size]
+
+
+class RandomAccessFile(io.RawIOBase):
+
+    def __init__(self, loop, context_manager):
+        super().__init__()
+        self._loop = loop
+        self._cm = context_manager
+        self._reader = self._loop.run(self._cm.__aenter__())
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._reader.seek(offset, whence)
+
+    def tell(self):
+        return self._reader.tell()
+
+    def read(self, size=-1):
+        return self._loop.run(self._reader.read(size))
+
+    def readall(self):
+        return self.read(-1)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        memoryview(buffer).cast("B")[0:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._loop.run(self._cm.__aexit__(None, None, None))
+        super().close()
+
+
+class _StreamingRangeHandle:
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+
+    async def read_range(self, offset, length):
+        # Fallback for backends that can't read from an offset, stream and skip to the range
+        pieces = []
+        pos = 0
+        async with self.descriptor.reader() as h:
+            async for chunk in h.read():
+                end = pos + len(chunk)
+                if end > offset:
+                    pieces.append(chunk[max(offset - pos, 0):offset + length - pos])
+                pos = end
+                if pos >= offset + length:
+                    break
+        return b"".join(pieces)
+
+
+class _StreamingRangeContextManager:
+
+    def __init__(self, descriptor):
+        self.descriptor = descriptor
+
+    async def __aenter__(self):
+        return _StreamingRangeHandle(self.descriptor)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _CachedRangeHandle:
+
+    def __init__(self, handle, cache, key, block_size):
+        self.handle = handle
+        self.cache = cache
+        self.key = key
+        self.block_size = block_size
+
+    async def read_range(self, offset, length):
+        # Offsets are always block-aligned by the RandomAccessReader
+        first = offset // self.block_size
+        count = max((length + self.block_size - 1) // self.block_size, 1)
+        blocks = [await self.cache.get_async(self.key, first + i) for i in range(0, count)]
+        i = 0
+        while i < count:
+            if blocks[i] is not None:
+                i += 1
+                continue
+            # Fetch each run of missing blocks with a single ranged read
+            j = i
+            while j < count and blocks[j] is None:
+                j += 1
+            start = (first + i) * self.block_size
+            end = min((first + j) * self.block_size, offset + length)
+            data = await self.handle.read_range(start, end - start)
+            for k in range(i, j):
+                block = data[(k - i) * self.block_size:(k - i + 1) * self.block_size]
+                blocks[k] = block
+                # Only full blocks or the final block of the file are safe to keep
+                if len(block) == self.block_size or (first + k + 1) * self.block_size >= offset + length:
+                    await self.cache.put_async(self.key, first + k, block)
+            i = j
+        return b"".join(blocks)[0:length]
+
+
+class _RandomAccessContextManager:
+
+    block_cache: DiskBlockCache = None
+
+    @injector.construct
+    def __init__(self, descriptor, block_size=None, max_blocks=None, use_cache=None):
+        self.descriptor = descriptor
+        self.block_size = block_size or DEFAULT_BLOCK_SIZE
+        self.max_blocks = max_blocks
+        self.use_cache = use_cache
+        self._range_cm = None
+
+    async def __aenter__(self):
+        self._range_cm = self.descriptor._range_reader()
+        handle = await self._range_cm.__aenter__()
+        try:
+            size = await self.descriptor.size_async()
+            use_cache = self.use_cache
+            if use_cache is None:
+                use_cache = self.block_cache.enabled and await self.descriptor._supports_block_cache_async()
+            if use_cache:
+                fingerprint = await self.descriptor.fingerprint_async()
+                if fingerprint is not None:
+                    # A new fingerprint means a new key, so blocks for old versions are never read again
+                    key = self.block_cache.make_key(str(self.descriptor), fingerprint, self.block_size)
+                    handle = _CachedRangeHandle(handle, self.block_cache, key, self.block_size)
+        except Exception as ex:
+            await self._range_cm.__aexit__(type(ex), ex, ex.__traceback__)
+            raise ex
+        return RandomAccessReader(handle, size, self.block_size, self.max_blocks)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._range_cm.__aexit__(exc_type, exc_val, exc_tb)
+        self._range_cm = None
+
+
 class ResourceDescriptor(abc.ABC):
 
     loop: GlobalLoopContext = None
+    metadata_cache: MetadataCache = None
+    concurrency: HostConcurrencyGovernor = None
+    retries: RetryManager = None
+    fingerprints: FingerprintManager = None
+
+    # Maximum concurrent operations against one host, None for no limit
+    max_host_concurrency = None
+
+    # Seconds that metadata is shared between descriptors of the same location, None to only cache per instance
+    metadata_ttl = None
+    metadata_negative_ttl = None
+
+    # Files removed together by remove_many_async() and recursive rmdir, for backends with batch deletes
+    remove_batch_size = 1
+
+    # URL schemes this class handles (None stands for plain paths) and, optionally, the host name suffixes it is
+    # limited to. FileManager only asks match_location() about locations that fit these; None means always ask.
+    schemes = None
+    host_suffixes = None
+
+    # Resources looked up together by stat_many_async()
+    stat_batch_size = 1
+
+    # Tried in order until one gives a fingerprint, see universalio.fingerprint
+    fingerprint_strategies = ("mtime_size", "content_hash")
+
+    # Made on first use, most descriptors from a large crawl are never asked anything that needs one
+    _cache = None
 
     @injector.construct
     def __init__(self):
-        self._cache = {}
+        pass
 
     def clear_cache(self, cache_key=None):
         if cache_key is None:
-            self._cache = {}
-        elif cache_key in self._cache:
+            self._cache = None
+        elif self._cache is not None and cache_key in self._cache:
+            del self._cache[cache_key]
+        if self._shares_metadata():
+            self.metadata_cache.invalidate(str(self), cache_key, cache_key is None)
+
+    def _shares_metadata(self):
+        return self.metadata_ttl is not None and self.metadata_cache.enabled
+
+    def _get_cache(self, cache_key):
+        if not self._shares_metadata():
+            if self._cache is None or cache_key not in self._cache:
+                return False, None
+            if self.metadata_ttl is None:
+                return True, self._cache[cache_key]
+            # Backends with a TTL trust what they were told for that long even when the cache isn't shared, so a
+            # long-lived descriptor still notices changes made elsewhere
+            value, expires = self._cache[cache_key]
+            if expires > time.monotonic():
+                return True, value
             del self._cache[cache_key]
+            return False, None
+        return self.metadata_cache.get(str(self), cache_key)
 
     def _set_cache(self, cache_key, value):
-        self._cache[cache_key] = value
+        ttl = None
+        if self.metadata_ttl is not None:
+            ttl = self.metadata_cache.ttl(self.__class__, self._is_negative_cache_value(cache_key, value))
+        if self._shares_metadata():
+            self.metadata_cache.put(str(self), cache_key, value, ttl)
+        elif self.metadata_ttl is None:
+            if self._cache is None:
+                self._cache = {}
+            self._cache[cache_key] = value
+        elif not ttl or ttl <= 0:
+            if self._cache is not None:
+                self._cache.pop(cache_key, None)
+        else:
+            if self._cache is None:
+                self._cache = {}
+            self._cache[cache_key] = (value, time.monotonic() + ttl)
+
+    def _is_negative_cache_value(self, cache_key, value):
+        return value is None or value is False
 
     def _cached(self, cache_key, cb, *args, **kwargs):
-        if cache_key not in self._cache:
-            self._cache[cache_key] = cb(*args, **kwargs)
-        return self._cache[cache_key]
+        found, value = self._get_cache(cache_key)
+        if not found:
+            value = cb(*args, **kwargs)
+            self._set_cache(cache_key, value)
+        return value
 
     async def _cached_async(self, cache_key, coro_func, *args, **kwargs):
-        if cache_key not in self._cache:
-            self._cache[cache_key] = await coro_func(*args, **kwargs)
-        return self._cache[cache_key]
+        found, value = self._get_cache(cache_key)
+        if not found:
+            value = await coro_func(*args, **kwargs)
+            self._set_cache(cache_key, value)
+        return value
 
     async def _supports_fast_rename_async(self):
         return False
 
+    def _is_retryable_error(self, ex):
+        return is_transient_error(ex)
+
+    async def _prepare_retry_async(self, ex):
+        pass
+
     @abc.abstractmethod
     def is_dir(self):
         pass
@@ -229,22 +554,48 @@ class ResourceDescriptor(abc.ABC):
         return self.loop.run(self.fingerprint_async())
 
     async def fingerprint_async(self):
-        mt = await self.mtime_async()
-        size = await self.size_async()
-        if mt and size:
-            return "{}_{}".format(mt.strftime("%Y%m%d%H%M%S"), size)
-        return await self.file_hash_async()
+        return await self.fingerprints.fingerprint(self)
+
+    def stat(self):
+        return self.loop.run(self.stat_async())
+
+    async def stat_async(self):
+        # None if there is nothing at this location
+        if not await self.exists_async():
+            return None
+        if await self.is_dir_async():
+            return FileMetadata(is_dir=True)
+        return await self.metadata_async()
+
+    async def stat_many_async(self, resources):
+        # Yields (resource, stat) pairs for resources on the same backend and host as this descriptor, in the order
+        # they complete
+        batches = self._stat_batches(resources)
+        limit = self.concurrency.limit(self)
+        async for results in bounded_as_completed((self._stat_batch_async(b) for b in batches), limit):
+            for result in results:
+                yield result
+
+    def _stat_batches(self, resources):
+        return batched(resources, self.stat_batch_size)
+
+    async def _stat_batch_async(self, resources):
+        return [(r, await r.stat_async()) for r in resources]
+
+    async def metadata_async(self):
+        # Backends override this to answer from a single stat or properties call, these usually hit the same cache
+        return FileMetadata(await self.size_async(), await self.mtime_async())
 
     def file_hash(self):
         return self.loop.run(self.file_hash_async())
 
     async def file_hash_async(self):
-        return self._cached_async("file_hash", self._calculate_file_hash_async)
+        return await self._cached_async("file_hash", self._calculate_file_hash_async)
 
     async def _calculate_file_hash_async(self):
         h = hashlib.sha256()
         async with self.reader() as reader:
-            for chunk in reader.read():
+            async for chunk in reader.read():
                 h.update(chunk)
         return h.hexdigest()
 
@@ -262,15 +613,39 @@ class ResourceDescriptor(abc.ABC):
         elif not await self.is_empty_async():
             raise UNIOError("Directory {} is not empty".format(self))
         await self._do_rmdir_async()
+        self.clear_cache()
 
     async def _do_recursive_rmdir(self):
-        tasks = []
+        tasks = BoundedTaskGroup(self.concurrency.limit(self))
+        batch = []
         async for x in self.list_async():
             if await x.is_dir_async():
-                tasks.append(asyncio.create_task(x.rmdir_async(True)))
+                await tasks.spawn(x.rmdir_async(True))
             else:
-                tasks.append(asyncio.create_task(x.remove()))
-        await asyncio.gather(*tasks)
+                batch.append(x)
+                if len(batch) >= self.remove_batch_size:
+                    await tasks.spawn(self._remove_batch_async(batch))
+                    batch = []
+        if batch:
+            await tasks.spawn(self._remove_batch_async(batch))
+        await tasks.join()
+
+    def remove_many(self, resources):
+        return self.loop.run(self.remove_many_async(resources))
+
+    async def remove_many_async(self, resources):
+        # Removes files from the same backend and host as this descriptor, as few requests as the backend allows
+        tasks = BoundedTaskGroup(self.concurrency.limit(self))
+        count = 0
+        for batch in batched(resources, self.remove_batch_size):
+            await tasks.spawn(self._remove_batch_async(batch))
+            count += len(batch)
+        await tasks.join()
+        return count
+
+    async def _remove_batch_async(self, resources):
+        for resource in resources:
+            await resource.remove_async()
 
     async def mkdir_async(self, recursive=False):
         if await self.exists_async():
@@ -281,6 +656,7 @@ class ResourceDescriptor(abc.ABC):
         elif not await parent.exists_async():
             raise UNIOError("Parent directory {} doesn't exist".format(parent))
         await self._do_mkdir_async()
+        self.clear_cache()
 
     def detect_encoding(self):
         return self.loop.run(self.detect_encoding_async())
@@ -301,16 +677,55 @@ class ResourceDescriptor(abc.ABC):
     async def write_async(self, data):
         async with self.writer() as h:
             await h.write(data)
+        self.clear_cache()
 
     async def read_async(self):
-        byts = None
+        chunks = []
+        async with self.reader() as h:
+            async for x in h.read():
+                chunks.append(x)
+        return b"".join(chunks)
+
+    def readinto(self, buffer):
+        return self.loop.run(self.readinto_async(buffer))
+
+    async def readinto_async(self, buffer):
+        view = memoryview(buffer).cast("B")
+        pos = 0
         async with self.reader() as h:
             async for x in h.read():
-                if byts is None:
-                    byts = x
-                else:
-                    byts += x
-        return byts
+                n = min(len(x), len(view) - pos)
+                view[pos:pos + n] = x[:n]
+                pos += n
+                if pos >= len(view):
+                    break
+        return pos
+
+    def random_reader(self, block_size=None, max_blocks=None, use_cache=None):
+        return _RandomAccessContextManager(self, block_size, max_blocks, use_cache)
+
+    def random_access_file(self, block_size=None, max_blocks=None, use_cache=None):
+        return RandomAccessFile(self.loop, self.random_reader(block_size, max_blocks, use_cache))
+
+    async def _supports_block_cache_async(self):
+        return True
+
+    def _range_reader(self):
+        return _StreamingRangeContextManager(self)
+
+    async def _supports_range_write_async(self):
+        return False
+
+    async def changes_checkpoint_async(self):
+        return None
+
+    async def list_changes_async(self, checkpoint):
+        # Backends that can enumerate recent changes return [(relative path, descriptor or None if deleted)]
+        # and the checkpoint to pass next time
+        return None, None
+
+    def _range_writer(self):
+        raise UNIOError("Random access writes are not supported for {}".format(self))
 
     def _create_descriptor(self, *args, **kwargs):
         return self.__class__(*args, **kwargs)
@@ -389,12 +804,7 @@ class ResourceDescriptor(abc.ABC):
             raise UNIOError("Resource {} already exists".format(target_resource))
 
         if use_partial_file and await target_resource._supports_fast_rename_async():
-            ext_no = 1
-            bn = target_resource.basename()
-            partial_file = target_resource.with_name("{}.partial{}".format(bn, ext_no))
-            while await partial_file.exists_async():
-                ext_no += 1
-                partial_file = target_resource.with_name("{}.partial{}".format(bn, ext_no))
+            partial_file = await target_resource._partial_file_async()
             try:
                 await self._do_copy_file(partial_file, **kwargs)
                 await partial_file.move_async(target_resource, allow_overwrite=allow_overwrite)
@@ -405,6 +815,16 @@ class ResourceDescriptor(abc.ABC):
             await self._do_copy_file(target_resource, **kwargs)
         target_resource.clear_cache()
 
+    async def _partial_file_async(self):
+        # An unused name next to this one, written first and then renamed into place
+        ext_no = 1
+        bn = self.basename()
+        partial_file = self.with_name("{}.partial{}".format(bn, ext_no))
+        while await partial_file.exists_async():
+            ext_no += 1
+            partial_file = self.with_name("{}.partial{}".format(bn, ext_no))
+        return partial_file
+
     async def _do_copy_file(self, target_resource, **kwargs):
         # Delegate copy to another method so we can override it as needed
         if await self.is_local_to_async(target_resource):
@@ -414,10 +834,40 @@ class ResourceDescriptor(abc.ABC):
         target_resource.clear_cache()
 
     async def _do_copy_async(self, target_resource, chunk_size=None, **kwargs):
-        async with self.reader() as reader:
-            async with target_resource.writer() as writer:
+        async with target_resource.writer() as writer:
+            async for chunk in self._read_resumable(chunk_size):
+                await writer.write(chunk)
+
+    async def _read_resumable(self, chunk_size=None):
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        offset = 0
+        attempt = 0
+        try:
+            async with self.reader() as reader:
                 async for chunk in reader.read(chunk_size):
-                    await writer.write(chunk)
+                    offset += len(chunk)
+                    yield chunk
+            return
+        except Exception as ex:
+            attempt += 1
+            if not await self.retries.backoff(attempt, ex, self):
+                raise ex
+        # Pick up from the last chunk we received instead of starting the file over
+        while True:
+            try:
+                async with self._range_reader() as handle:
+                    while True:
+                        chunk = await handle.read_range(offset, chunk_size)
+                        if not chunk:
+                            return
+                        offset += len(chunk)
+                        yield chunk
+                        if len(chunk) < chunk_size:
+                            return
+            except Exception as ex:
+                attempt += 1
+                if not await self.retries.backoff(attempt, ex, self):
+                    raise ex
 
     async def _local_copy_async(self, target_resource, chunk_size=None, **kwargs):
         await self._do_copy_async(target_resource, chunk_size, **kwargs)
@@ -440,19 +890,20 @@ class ResourceDescriptor(abc.ABC):
     async def _do_copy_dir_async(self, target_dir, recursive=True, preliminary_check=False, make_stub_dirs=False, **kwargs):
         if preliminary_check and not kwargs.get("allow_overwrite", False):
             async for file, target_file in self.crawl_async(target_dir, recursive=recursive):
-                if target_file.exists():
+                if await target_file.exists_async():
                     raise UNIOError("Resource {} already exists".format(target_file))
-        tasks = []
+        await target_dir.mkdir_async(True)
+        tasks = BoundedTaskGroup(self.concurrency.limit(target_dir))
         async for res, target_res in self.crawl_async(target_dir, recursive or make_stub_dirs, recursive):
             if await res.is_dir_async():
-                await res.mkdir_async()
+                await target_res.mkdir_async()
             else:
-                tasks.append(asyncio.create_task(res._copy_file_async(
+                await tasks.spawn(res._copy_file_async(
                     target_res,
                     _skip_dir_check=True,  # We know we already took the basename, so we can skip this check
                     **kwargs
-                )))
-        await asyncio.gather(*tasks)
+                ))
+        await tasks.join()
 
     async def _local_copy_dir_async(self, target_resource, recursive=True, **kwargs):
         await self._do_copy_dir_async(target_resource, recursive, **kwargs)
@@ -478,6 +929,9 @@ class ResourceDescriptor(abc.ABC):
                 if check_dir and recursive:
                     work.append((file, mirror_file))
 
+    def host_key(self):
+        return self.__class__.__name__
+
     def is_local_to(self, target_resource):
         return self.loop.run(self.is_local_to_async(target_resource))
 
@@ -515,6 +969,9 @@ class AsynchronousDescriptor(ResourceDescriptor, abc.ABC):
     def size(self):
         return self.loop.run(self.size_async())
 
+    def metadata(self):
+        return self.loop.run(self.metadata_async())
+
 
 class SynchronousDescriptor(ResourceDescriptor, abc.ABC):
 
@@ -546,18 +1003,47 @@ class SynchronousDescriptor(ResourceDescriptor, abc.ABC):
     async def size_async(self):
         return await self.loop.execute(self.size)
 
+    def metadata(self):
+        return FileMetadata(self.size(), self.mtime())
+
+    async def metadata_async(self):
+        return await self.loop.execute(self.metadata)
+
 
 class PathResourceDescriptor(ResourceDescriptor, abc.ABC):
 
+    # Paths may be given as strings, they are only turned into one of these when the path object is asked for
+    path_class = pathlib.PurePosixPath
+
+    # Every metadata cache lookup is keyed by str(self), so it is only built once
+    _str = None
+
     def __init__(self, path):
         ResourceDescriptor.__init__(self)
         self.path = path
 
+    @property
+    def path(self):
+        if isinstance(self._path, str):
+            self._path = self.path_class(self._path)
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+        self._str = None
+
+    def _path_str(self):
+        # The path as a string, without building the path object for it
+        return self._path if isinstance(self._path, str) else str(self._path)
+
     def __str__(self):
-        return str(self.path)
+        if self._str is None:
+            self._str = str(self.path)
+        return self._str
 
     def __repr__(self):
-        return str(self.path)
+        return str(self)
 
     def parent(self):
         return self._create_descriptor(self.path.parent)
@@ -577,6 +1063,11 @@ class PathResourceDescriptor(ResourceDescriptor, abc.ABC):
 
 class UriResourceDescriptor(PathResourceDescriptor, abc.ABC):
 
+    # When set, child() copies the parent's already resolved state rather than parsing a new URI, so subclasses must
+    # reset anything location specific in _derive_child()
+    fast_children = False
+    _child_prefix = None
+
     def __init__(self, uri, top_path_special=False, trailing_slashes_matter=False):
         super().__init__(None)
         self.uri = None
@@ -590,21 +1081,24 @@ class UriResourceDescriptor(PathResourceDescriptor, abc.ABC):
 
     def _set_uri(self, uri, top_path_special=False):
         self.uri = uri
+        self._child_prefix = None
         p = urlsplit(uri)
-        self.hostname = p.hostname
+        # Interned so that every descriptor on a host shares one copy of these
+        self.hostname = sys.intern(p.hostname) if p.hostname else p.hostname
         self.port = p.port
-        self.scheme = p.scheme
+        self.scheme = sys.intern(p.scheme)
         self.container = None
         if self.trailing_slashes_matter and p.path.endswith("/"):
             self._is_dir = True
-        pieces = [x for x in str(p.path).split("/") if x.strip() != ""]
+        pieces = [x for x in str(p.path).split("/") if x.strip() != "" and x != "."]
         if top_path_special:
-            self.container = pieces[0]
-            self.path = pathlib.PurePosixPath("/{}".format("/".join(pieces[1:])))
+            self.container = sys.intern(pieces[0])
+            self.path = "/{}".format("/".join(pieces[1:]))
         else:
-            self.path = pathlib.PurePosixPath("/{}".format("/".join(pieces)))
+            self.path = "/{}".format("/".join(pieces))
 
     def _path_to_uri(self, path):
+        # The path keeps its segments as they appear in the URI, only names added to it need quoting
         pieces = []
         if self.container:
             pieces.append(self.container)
@@ -613,15 +1107,22 @@ class UriResourceDescriptor(PathResourceDescriptor, abc.ABC):
         return "{}://{}/{}".format(
             self.scheme,
             self.hostname if self.port is None else "{}:{}".format(self.hostname, self.port),
-            "/".join([quote_plus(p) for p in pieces]) + ("/" if append_trailing else "")
+            "/".join(pieces) + ("/" if append_trailing else "")
         )
 
+    @staticmethod
+    def _quote_path(path):
+        return "/".join([quote_plus(x) for x in str(path).split("/")])
+
     def __str__(self):
         return str(self.uri)
 
     def __repr__(self):
         return str(self.uri)
 
+    def host_key(self):
+        return "{}://{}".format(self.scheme, self.hostname if self.port is None else "{}:{}".format(self.hostname, self.port))
+
     def basename(self):
         if self.trailing_slashes_matter and self._is_dir:
             return self.path.name + '/'
@@ -635,13 +1136,42 @@ class UriResourceDescriptor(PathResourceDescriptor, abc.ABC):
         return self._create_descriptor(self._path_to_uri(new_path))
 
     def with_name(self, name):
-        new_path = self.path.with_name(name)
+        new_path = self.path.with_name(quote_plus(name[:-1] if name.endswith("/") else name))
         if self.trailing_slashes_matter and name.endswith("/"):
             new_path = str(new_path) + "/"
         return self._create_descriptor(self._path_to_uri(new_path))
 
     def joinpath(self, *paths):
-        new_path = self.path.joinpath(*paths)
+        new_path = self.path.joinpath(*[self._quote_path(p) for p in paths])
         if self.trailing_slashes_matter and str(paths[-1]).endswith("/"):
             new_path = str(new_path) + "/"
         return self._create_descriptor(self._path_to_uri(new_path))
+
+    def child(self, child):
+        child = str(child)
+        name = child[:-1] if child.endswith("/") else child
+        is_dir = self.trailing_slashes_matter and name != child
+        if not self.fast_children or "/" in name or name in ("", ".", ".."):
+            return self.joinpath(child)
+        return self._derive_child(name, is_dir)
+
+    def _derive_child(self, name, is_dir):
+        # Only the new segment is quoted, the rest of the URI is the parent's as it already is
+        if self._child_prefix is None:
+            prefix = "{}://{}".format(
+                self.scheme,
+                self.hostname if self.port is None else "{}:{}".format(self.hostname, self.port)
+            )
+            if self.container:
+                prefix += "/" + self.container
+            self._child_prefix = prefix + self._path_str().rstrip("/")
+        segment = quote_plus(name)
+        child = self.__class__.__new__(self.__class__)
+        # Injected services, host details and credentials are the same as the parent's
+        child.__dict__.update(self.__dict__)
+        child.__dict__.pop("_cache", None)
+        child._child_prefix = None
+        child.uri = self._child_prefix + "/" + segment + ("/" if is_dir else "")
+        child._path = self._path_str().rstrip("/") + "/" + segment
+        child._is_dir = is_dir
+        return child
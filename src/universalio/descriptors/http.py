@@ -1,9 +1,13 @@
 import aiohttp
 import atexit
+import codecs
 from autoinject import injector
-import json
 import datetime
 from universalio import GlobalLoopContext
+from universalio.concurrency import host_limited
+from universalio.retry import retryable, is_transient_error
+from universalio.fingerprint import FileMetadata, encoded_checksum
+from universalio.util.listing import HtmlIndexParser, JsonArrayParser
 from .base import FileWriter, FileReader, UriResourceDescriptor, AsynchronousDescriptor, UNIOError, ConnectionRegistry
 
 
@@ -61,12 +65,49 @@ class HttpReaderContextManager:
         self._session = await self._session_coro
         self._get = await self._session.get(self.uri)
         self._handle = await self._get.__aenter__()
+        try:
+            # Otherwise an error page would be read as the file content
+            self._handle.raise_for_status()
+        except aiohttp.ClientResponseError as ex:
+            await self._get.__aexit__(type(ex), ex, ex.__traceback__)
+            raise ex
         return HttpReaderContextManager.Reader(self._handle)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self._get.__aexit__(exc_type, exc_val, exc_tb)
 
 
+class HttpRangeReaderContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, session, uri):
+            self.handle = session
+            self.uri = uri
+
+        async def read_range(self, offset, length):
+            headers = {"Range": "bytes={}-{}".format(offset, offset + length - 1)}
+            async with self.handle.get(self.uri, headers=headers) as resp:
+                if resp.status == 416:
+                    return b""
+                resp.raise_for_status()
+                data = await resp.read()
+                # Server ignored the Range header and sent the whole thing
+                if resp.status == 200:
+                    data = data[offset:offset + length]
+                return data
+
+    def __init__(self, uri, session):
+        self.uri = uri
+        self._session = session
+
+    async def __aenter__(self):
+        return HttpRangeReaderContextManager.RangeHandle(await self._session, self.uri)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
 @injector.injectable
 class HttpSessionRegistry(ConnectionRegistry):
 
@@ -85,11 +126,23 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     session: HttpSessionRegistry = None
     loop: GlobalLoopContext = None
 
+    schemes = ("http", "https")
+    fast_children = True
+    max_host_concurrency = 16
+    metadata_ttl = 60
+    fingerprint_strategies = ("etag", "mtime_size", "content_hash")
+    metadata_negative_ttl = 5
+
     @injector.construct
     def __init__(self, uri):
         super().__init__(uri, trailing_slashes_matter=True)
         self._is_canonical = None
 
+    def _derive_child(self, name, is_dir):
+        child = super()._derive_child(name, is_dir)
+        child._is_canonical = None
+        return child
+
     def _send_headers(self):
         return {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36",
@@ -106,6 +159,8 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
         await self.canonicalize()
         return await self._cached_async("options", self._options_call)
 
+    @retryable
+    @host_limited
     async def _options_call(self):
         headers = {}
         client = await self._client()
@@ -114,15 +169,31 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
                 headers = response.headers
         return headers
 
+    @retryable
+    @host_limited
     async def _head_call(self):
         headers, status = {}, None
         client = await self._client()
         async with client.head(self.uri, headers=self._send_headers()) as response:
             status = response.status
+            # Server errors say nothing about whether the resource exists, raise so they are retried and not cached
+            if status >= 500 or status == 429:
+                response.raise_for_status()
             if response.status == 200:
                 headers = response.headers
         return headers, status
 
+    def _is_retryable_error(self, ex):
+        # ServerDisconnectedError is a ClientConnectionError, and ClientResponseError carries its status
+        if isinstance(ex, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+            return True
+        return is_transient_error(ex)
+
+    def _is_negative_cache_value(self, cache_key, value):
+        if cache_key == "head":
+            return value[1] != 200
+        return super()._is_negative_cache_value(cache_key, value)
+
     async def _supports_http_method(self, method):
         headers = await self._options()
         if "Allow" not in headers:
@@ -167,49 +238,64 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
         # By convention
         return not self.uri.endswith("/")
 
-    async def fingerprint_async(self):
+    async def metadata_async(self):
         headers, status = await self._head()
         if status >= 300:
             return None
-        if "ETag" in headers:
-            return headers.get("ETag")
-        return await super().fingerprint_async()
+        # Size and time may already be known from the directory listing
+        return FileMetadata(
+            await self.size_async(),
+            await self.mtime_async(),
+            headers.get("ETag", None),
+            encoded_checksum("md5", headers.get("Content-MD5", None))
+        )
 
     async def exists_async(self):
         headers, status = await self._head()
         return status == 200
 
     async def list_async(self):
-        if self._supports_http_method("PROPFIND"):
-            #raise NotImplementedError("WebDAV listings not yet implemented")
+        if await self._supports_http_method("PROPFIND"):
+            # WebDAV listings not yet implemented
             return
-        head, stat = self._head()
+        head, stat = await self._head()
         if not stat == 200:
             return
-        content = await self.read_async()
-        txt = content.decode(await self.detect_encoding_async())
-        ctype = head.get("Content-Type", "text/html").lower()
-        if ";" in ctype:
-            ctype = ctype[:ctype.find(";")]
-        if ctype == "application/json":
-            json_list = json.loads(txt)
-            if not isinstance(json_list, list):
-                raise UNIOError("Invalid JSON response to GET on a directory")
-            for f in json_list:
-                yield self.child(f)
-        elif ctype in ("text/html", "application/xhtml+xml"):
-            #raise NotImplementedError("Direct HTML parsing for children not yet available")
-            return
-        elif ctype in ("text/xml", "application/xml"):
-            # Need to check if this is poor server support for text/html or application/xhtml+xml
-            #raise NotImplementedError("Direct XML parsing for children not yet available")
-            return
-        else:
-            return
+        async with self.reader() as reader:
+            headers = reader.handle.headers if reader.handle.headers else head
+            ctype = headers.get("Content-Type", "text/html").lower()
+            if ";" in ctype:
+                ctype = ctype[:ctype.find(";")]
+            if ctype == "application/json":
+                parser = JsonArrayParser()
+            elif ctype in ("text/html", "application/xhtml+xml"):
+                parser = HtmlIndexParser(self.uri)
+            else:
+                # XML (possibly poor server support for text/html) and other formats are not yet supported
+                return
+            encoding = reader.handle.charset or await self.detect_encoding_async()
+            decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+            try:
+                async for chunk in reader.read():
+                    for entry in parser.feed(decoder.decode(chunk)):
+                        yield self._listed_child(entry)
+                for entry in parser.feed(decoder.decode(b"", final=True)) + parser.close():
+                    yield self._listed_child(entry)
+            except ValueError as ex:
+                raise UNIOError("Invalid {} response to GET on a directory".format(ctype)) from ex
+
+    def _listed_child(self, entry):
+        child = self.child(entry.name)
+        if entry.size is not None:
+            child._set_cache("size", entry.size)
+        if entry.mtime is not None:
+            child._set_cache("mtime", entry.mtime)
+        return child
 
     async def _do_rmdir_async(self):
         await self.remove_async()
 
+    @host_limited
     async def _do_mkdir_async(self):
         if self._supports_http_method("MKCOL"):
             client = await self._client()
@@ -257,12 +343,14 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
         else:
             await super()._do_copy_async(target, chunk_size, **kwargs)
 
+    @host_limited
     async def remove_async(self):
         if not await self._supports_http_method("DELETE"):
             raise UNIOError("Delete not supported on this uri: {}".format(self.uri))
         client = await self._client()
         async with client.delete(self.uri) as response:
             response.raise_for_status()
+        self.clear_cache()
 
     def _parse_http_datetime(self, s):
         if s is None or s == "":
@@ -271,6 +359,9 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
             .replace(tzinfo=datetime.timezone.utc)
 
     async def mtime_async(self):
+        return await self._cached_async("mtime", self._head_mtime)
+
+    async def _head_mtime(self):
         head, stat = await self._head()
         return self._parse_http_datetime(head.get("Last-Modified", None))
 
@@ -283,15 +374,22 @@ class HttpDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
         return self._parse_http_datetime(head.get("Content-Created", None))
 
     async def size_async(self):
+        return await self._cached_async("size", self._head_size)
+
+    async def _head_size(self):
         head, stat = await self._head()
-        return self._parse_http_datetime(head.get("Content-Length", None))
+        size = head.get("Content-Length", None)
+        return int(size) if size is not None else None
 
     def reader(self):
-        return HttpReaderContextManager(self.uri, self._client())
+        return self.concurrency.wrap(self, HttpReaderContextManager(self.uri, self._client()))
 
     def writer(self):
         self.clear_cache()
-        return HttpWriterContextManager(self.uri, self._client())
+        return self.concurrency.wrap(self, HttpWriterContextManager(self.uri, self._client()))
+
+    def _range_reader(self):
+        return self.concurrency.wrap(self, HttpRangeReaderContextManager(self.uri, self._client()))
 
     def is_local_to_async(self, resource):
         if not isinstance(resource, HttpDescriptor):
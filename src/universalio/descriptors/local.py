@@ -1,3 +1,4 @@
+import asyncio
 import pathlib
 import aiofiles
 import aiofiles.os
@@ -5,9 +6,11 @@ import aiofiles.ospath
 import datetime
 import os
 import shutil
+import stat
 from .base import FileWriter, FileReader, PathResourceDescriptor, SynchronousDescriptor
 import sys
 from universalio import GlobalLoopContext
+from universalio.fingerprint import FileMetadata
 from autoinject import injector
 
 
@@ -40,13 +43,73 @@ class _LocalFileReaderContextManager:
         await self._handle.close()
 
 
+class _LocalRangeReaderContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, handle):
+            self.handle = handle
+            self._lock = asyncio.Lock()
+
+        async def read_range(self, offset, length):
+            async with self._lock:
+                await self.handle.seek(offset)
+                return await self.handle.read(length)
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    async def __aenter__(self):
+        self._handle = await aiofiles.open(self.path, "rb")
+        return _LocalRangeReaderContextManager.RangeHandle(self._handle)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._handle.close()
+
+
+class _LocalRangeWriterContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, handle):
+            self.handle = handle
+            self._lock = asyncio.Lock()
+
+        async def write_range(self, offset, data):
+            async with self._lock:
+                await self.handle.seek(offset)
+                await self.handle.write(data)
+
+        async def truncate(self, size):
+            async with self._lock:
+                await self.handle.truncate(size)
+
+    def __init__(self, path):
+        self.path = path
+        self._handle = None
+
+    async def __aenter__(self):
+        self._handle = await aiofiles.open(self.path, "r+b")
+        return _LocalRangeWriterContextManager.RangeHandle(self._handle)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._handle.close()
+
+
 class LocalDescriptor(PathResourceDescriptor, SynchronousDescriptor):
 
     loop: GlobalLoopContext = None
 
+    schemes = (None,)
+    path_class = pathlib.Path
+
+    # A whole batch of stats runs in one worker call
+    stat_batch_size = 256
+
     @injector.construct
     def __init__(self, path):
-        PathResourceDescriptor.__init__(self, pathlib.Path(path))
+        PathResourceDescriptor.__init__(self, path if isinstance(path, str) else pathlib.Path(path))
 
     def is_dir(self):
         return self._cached("is_dir", self.path.is_dir)
@@ -73,13 +136,42 @@ class LocalDescriptor(PathResourceDescriptor, SynchronousDescriptor):
     def size(self):
         return self._cached("stat", self.path.stat).st_size
 
+    async def _stat_batch_async(self, resources):
+        return await self.loop.execute(self._stat_batch, resources)
+
+    @staticmethod
+    def _stat_batch(resources):
+        results = []
+        for r in resources:
+            try:
+                st = r.path.stat()
+            except (FileNotFoundError, NotADirectoryError):
+                r._set_cache("exists", False)
+                results.append((r, None))
+                continue
+            r._set_cache("exists", True)
+            r._set_cache("stat", st)
+            if stat.S_ISDIR(st.st_mode):
+                results.append((r, FileMetadata(is_dir=True)))
+            else:
+                results.append((r, FileMetadata(st.st_size, datetime.datetime.fromtimestamp(st.st_mtime))))
+        return results
+
     def list(self):
         for f in os.scandir(self.path):
-            yield LocalDescriptor(f.path)
+            child = LocalDescriptor(f.path)
+            # The entry type comes with the listing on most platforms, so this saves a stat per child
+            child._set_cache("exists", True)
+            child._set_cache("is_dir", f.is_dir())
+            child._set_cache("is_file", f.is_file())
+            yield child
 
     async def _supports_fast_rename_async(self):
         return True
 
+    async def _supports_block_cache_async(self):
+        return False
+
     def reader(self, chunk_size=None):
         return _LocalFileReaderContextManager(self.path, chunk_size)
 
@@ -87,6 +179,16 @@ class LocalDescriptor(PathResourceDescriptor, SynchronousDescriptor):
         self.clear_cache()
         return _LocalFileWriterContextManager(self.path)
 
+    def _range_reader(self):
+        return _LocalRangeReaderContextManager(self.path)
+
+    async def _supports_range_write_async(self):
+        return True
+
+    def _range_writer(self):
+        self.clear_cache()
+        return _LocalRangeWriterContextManager(self.path)
+
     async def is_local_to_async(self, target_resource):
         return isinstance(target_resource, LocalDescriptor)
 
@@ -1,12 +1,20 @@
 import asyncssh
+import asyncio
+import datetime
 import hashlib
 from .base import FileWriter, FileReader, UriResourceDescriptor, AsynchronousDescriptor, ConnectionRegistry
 from universalio import GlobalLoopContext
+from universalio.concurrency import host_limited, bounded_as_completed
+from universalio.retry import retryable, is_transient_error
+from universalio.fingerprint import FileMetadata
 from autoinject import injector
 import zirconium as zr
 from urllib.parse import urlparse
 
 
+STAT_PIPELINE_DEPTH = 64
+
+
 class _SFTPWriterContextManager:
 
     def __init__(self, connection, path):
@@ -50,6 +58,67 @@ class _SFTPReaderContextManager:
         self._client.exit()
 
 
+class _SFTPRangeReaderContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, handle):
+            self.handle = handle
+
+        async def read_range(self, offset, length):
+            return await self.handle.read(length, offset)
+
+    def __init__(self, connection, path):
+        self.conn = connection
+        self.path = path
+        self._connection = None
+        self._client = None
+        self._handle = None
+
+    async def __aenter__(self):
+        self._connection = await self.conn
+        self._client = await self._connection.start_sftp_client()
+        self._cm = self._client.open(str(self.path), "rb")
+        self._handle = await self._cm.__aenter__()
+        return _SFTPRangeReaderContextManager.RangeHandle(self._handle)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._cm.__aexit__(exc_type, exc_val, exc_tb)
+        self._client.exit()
+
+
+class _SFTPRangeWriterContextManager:
+
+    class RangeHandle:
+
+        def __init__(self, handle):
+            self.handle = handle
+
+        async def write_range(self, offset, data):
+            await self.handle.write(data, offset)
+
+        async def truncate(self, size):
+            await self.handle.truncate(size)
+
+    def __init__(self, connection, path):
+        self.conn = connection
+        self.path = path
+        self._connection = None
+        self._client = None
+        self._handle = None
+
+    async def __aenter__(self):
+        self._connection = await self.conn
+        self._client = await self._connection.start_sftp_client()
+        self._cm = self._client.open(str(self.path), "r+b")
+        self._handle = await self._cm.__aenter__()
+        return _SFTPRangeWriterContextManager.RangeHandle(self._handle)
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._cm.__aexit__(exc_type, exc_val, exc_tb)
+        self._client.exit()
+
+
 @injector.injectable
 class _SFTPHostManager(ConnectionRegistry):
 
@@ -77,6 +146,13 @@ class SFTPDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     host_manager: _SFTPHostManager = None
     loop: GlobalLoopContext = None
 
+    schemes = ("sftp",)
+    fast_children = True
+    max_host_concurrency = 8
+    metadata_ttl = 30
+    remove_batch_size = 64
+    metadata_negative_ttl = 5
+
     @injector.construct
     def __init__(self, uri, username=None, password=None):
         UriResourceDescriptor.__init__(self, uri)
@@ -86,91 +162,201 @@ class SFTPDescriptor(UriResourceDescriptor, AsynchronousDescriptor):
     async def _connect(self):
         return await self.host_manager.connect(self.hostname, self.port, self.username, self.password, None)
 
+    def _is_retryable_error(self, ex):
+        # ConnectionLost is a DisconnectError
+        if isinstance(ex, (asyncssh.DisconnectError, asyncssh.ChannelOpenError)):
+            return True
+        if isinstance(ex, asyncssh.SFTPError):
+            return ex.code in (asyncssh.FX_CONNECTION_LOST, asyncssh.FX_NO_CONNECTION)
+        return is_transient_error(ex)
+
+    async def _prepare_retry_async(self, ex):
+        if not isinstance(ex, asyncssh.SFTPError):
+            # The cached connection is likely dead, open a new one on the next attempt
+            await self.host_manager.discard(self.hostname, self.port, self.username, self.password, None)
+
     async def is_dir_async(self):
+        return await self._cached_async("is_dir", self._is_dir_call)
+
+    @retryable
+    @host_limited
+    async def _is_dir_call(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            return await sftp.isdir(str(self.path))
+            return await sftp.isdir(self._path_str())
 
     async def is_file_async(self):
+        return await self._cached_async("is_file", self._is_file_call)
+
+    @retryable
+    @host_limited
+    async def _is_file_call(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            return await sftp.isfile(str(self.path))
+            return await sftp.isfile(self._path_str())
 
     async def list_async(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            async for sftp_name in sftp.scandir(str(self.path)):
-                yield self.child(sftp_name.filename)
+            async for sftp_name in sftp.scandir(self._path_str()):
+                if sftp_name.filename in (".", ".."):
+                    continue
+                yield self._listed_child(sftp_name, sftp.version)
+
+    def _listed_child(self, sftp_name, version):
+        # The listing already carries the attributes, so crawls don't need a stat per entry
+        child = self.child(sftp_name.filename)
+        child._cache_attrs(sftp_name.attrs, version)
+        return child
+
+    def _cache_attrs(self, attrs, version):
+        if attrs.type in (asyncssh.FILEXFER_TYPE_DIRECTORY, asyncssh.FILEXFER_TYPE_REGULAR):
+            self._set_cache("exists", True)
+            self._set_cache("is_dir", attrs.type == asyncssh.FILEXFER_TYPE_DIRECTORY)
+            self._set_cache("is_file", attrs.type == asyncssh.FILEXFER_TYPE_REGULAR)
+        if attrs.size is not None and attrs.mtime is not None:
+            self._set_cache("stat", (attrs, version))
+
+    async def stat_many_async(self, resources):
+        # All stats share one channel, with up to STAT_PIPELINE_DEPTH requests waiting on replies at once
+        conn = await self._connect()
+        async with self.concurrency.slot(self):
+            async with conn.start_sftp_client() as sftp:
+                stats = (self._pipelined_stat(sftp, r) for r in resources)
+                async for result in bounded_as_completed(stats, STAT_PIPELINE_DEPTH):
+                    yield result
+
+    async def _pipelined_stat(self, sftp, resource):
+        try:
+            attrs = await sftp.stat(resource._path_str())
+        except asyncssh.SFTPNoSuchFile:
+            resource._set_cache("exists", False)
+            return resource, None
+        resource._cache_attrs(attrs, sftp.version)
+        if attrs.type == asyncssh.FILEXFER_TYPE_DIRECTORY:
+            return resource, FileMetadata(is_dir=True)
+        return resource, FileMetadata(attrs.size, self._stat_datetime(attrs.mtime))
 
     async def exists_async(self):
+        return await self._cached_async("exists", self._exists_call)
+
+    @retryable
+    @host_limited
+    async def _exists_call(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            return await sftp.exists(str(self.path))
+            return await sftp.exists(self._path_str())
 
+    @host_limited
     async def remove_async(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            await sftp.remove(str(self.path))
+            await sftp.remove(self._path_str())
+        self.clear_cache()
+
+    async def _remove_batch_async(self, resources):
+        await self._remove_paths([r._path_str() for r in resources])
+        for r in resources:
+            r.clear_cache()
+
+    @retryable
+    @host_limited
+    async def _remove_paths(self, paths):
+        conn = await self._connect()
+        async with conn.start_sftp_client() as sftp:
+            # asyncssh doesn't wait for a reply before sending the next request, so the removes share round trips
+            results = await asyncio.gather(*(sftp.remove(p) for p in paths), return_exceptions=True)
+        for ex in results:
+            # Already gone is fine, it happens when a retry follows a partly applied batch
+            if isinstance(ex, Exception) and not isinstance(ex, asyncssh.SFTPNoSuchFile):
+                raise ex
 
     def _create_descriptor(self, *args, **kwargs):
         return SFTPDescriptor(*args, username=self.username, password=self.password, **kwargs)
 
     def reader(self, chunk_size=None):
-        return _SFTPReaderContextManager(self._connect(), self.path, chunk_size)
+        return self.concurrency.wrap(self, _SFTPReaderContextManager(self._connect(), self._path_str(), chunk_size))
 
     def writer(self):
         self.clear_cache()
-        return _SFTPWriterContextManager(self._connect(), self.path)
+        return self.concurrency.wrap(self, _SFTPWriterContextManager(self._connect(), self._path_str()))
+
+    def _range_reader(self):
+        return self.concurrency.wrap(self, _SFTPRangeReaderContextManager(self._connect(), self._path_str()))
+
+    async def _supports_range_write_async(self):
+        return True
+
+    def _range_writer(self):
+        self.clear_cache()
+        return self.concurrency.wrap(self, _SFTPRangeWriterContextManager(self._connect(), self._path_str()))
 
     async def is_local_to_async(self, target_resource):
         if not isinstance(target_resource, SFTPDescriptor):
             return False
         return target_resource.hostname == self.hostname and target_resource.port == self.port
 
+    @retryable
+    @host_limited
     async def _local_copy_async(self, target_resource, chunk_size=None, **kwargs):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            await sftp.copy(str(self.path), str(target_resource.path))
+            await sftp.copy(self._path_str(), target_resource._path_str())
 
+    @host_limited
     async def _local_move_file_async(self, target_resource, chunk_size=None, **kwargs):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            await sftp.rename(str(self.path), str(target_resource.path))
+            await sftp.rename(self._path_str(), target_resource._path_str())
 
+    @host_limited
     async def _do_rmdir_async(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            await sftp.rmdir(str(self.path))
+            await sftp.rmdir(self._path_str())
 
+    @host_limited
     async def _do_mkdir_async(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            await sftp.mkdir(str(self.path))
+            await sftp.mkdir(self._path_str())
 
+    @retryable
+    @host_limited
     async def _stat(self):
         conn = await self._connect()
         async with conn.start_sftp_client() as sftp:
-            st = await sftp.stat(str(self.path))
-            return st, sftp.version()
+            st = await sftp.stat(self._path_str())
+            return st, sftp.version
+
+    @staticmethod
+    def _stat_datetime(ts):
+        if ts is None:
+            return None
+        return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
 
     async def mtime_async(self):
         stat, ver = await self._cached_async("stat", self._stat)
-        return stat.mtime
+        return self._stat_datetime(stat.mtime)
 
     async def atime_async(self):
         stat, ver = await self._cached_async("stat", self._stat)
-        return stat.atime
+        return self._stat_datetime(stat.atime)
 
     async def crtime_async(self):
         stat, ver = await self._cached_async("stat", self._stat)
         if ver >= 4:
-            return stat.crtime
+            return self._stat_datetime(stat.crtime)
         return None
 
     async def size_async(self):
-        stat = await self._cached_async("stat", self._stat)
+        stat, ver = await self._cached_async("stat", self._stat)
         return stat.size
 
+    async def metadata_async(self):
+        stat, ver = await self._cached_async("stat", self._stat)
+        return FileMetadata(stat.size, self._stat_datetime(stat.mtime))
+
     async def _supports_fast_rename_async(self):
         return True
 
@@ -1,5 +1,12 @@
 from autoinject import injector
+from universalio import GlobalLoopContext
 from universalio.descriptors.base import ResourceDescriptor
+import asyncio
+import importlib
+import logging
+import re
+import weakref
+import zirconium as zr
 import universalio.descriptors as desc
 import sys
 
@@ -27,48 +34,183 @@ else:
     from importlib_metadata import entry_points
 
 
+_SCHEME_AND_HOST = re.compile(r"^([A-Za-z][A-Za-z0-9+.-]*)://(?:[^@/?#]*@)?([^:/?#]*)")
+
+_SCHEME_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9+.-]*$")
+
+# Queued by a stat group once all of its results are out
+_END_OF_GROUP = object()
+
+
 @injector.injectable
 class FileManager:
 
-    def __init__(self, include_entry_points=True):
+    loop: GlobalLoopContext = None
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self, include_entry_points=True, intern_descriptors=None):
         self.registry = {}
         self.registry_order = None
+        self._dispatch = None
+        self._fallback = None
+        if intern_descriptors is None:
+            intern_descriptors = self.config.as_bool(("universalio", "intern_descriptors"), default=False)
+        # Hands out the same descriptor, and so the same metadata cache, while anyone still holds it
+        self._interned = weakref.WeakValueDictionary() if intern_descriptors else None
+        self._include_entry_points = include_entry_points
         # Check local file system first
         self.register_descriptor_class(desc.LocalDescriptor, 0)
-        # Todo, move these to their own module eventually
-        if hasattr(desc, "SFTPDescriptor"):
-            self.register_descriptor_class(desc.SFTPDescriptor, 100)
-        if hasattr(desc, "AzureBlobDescriptor"):
-            self.register_descriptor_class(desc.AzureBlobDescriptor, 100)
-        if include_entry_points:
-            auto_register = entry_points(group="universalio.descriptors")
-            for ep in auto_register:
-                cls = ep.load()
-                weight = 100
-                if hasattr(cls, "weight"):
-                    weight = getattr(cls, "weight")
-                self.register_descriptor_class(cls, weight)
+        # Registered by name so their SDKs are only imported once a matching location shows up
+        self.register_lazy_descriptor_class("universalio.descriptors.sftp:SFTPDescriptor", ("sftp",), weight=100)
+        self.register_lazy_descriptor_class(
+            "universalio.descriptors.azure_blob:AzureBlobDescriptor",
+            ("https",),
+            (".blob.core.windows.net",),
+            weight=100
+        )
         # Fallback for HTTP
-        if hasattr(desc, "HttpDescriptor"):
-            self.register_descriptor_class(desc.HttpDescriptor, 10000)
+        self.register_lazy_descriptor_class("universalio.descriptors.http:HttpDescriptor", ("http", "https"), weight=10000)
 
     def register_descriptor_class(self, descriptor_class: type, weight: int=0):
         self.registry[descriptor_class.__name__] = (descriptor_class, weight)
         self.registry_order = None
+        self._dispatch = None
+
+    def register_lazy_descriptor_class(self, import_path: str, schemes, host_suffixes=None, weight: int=100):
+        # import_path is "module:ClassName", the module is imported when a location with one of the schemes (and one of
+        # the host suffixes, if given) is first resolved
+        self.register_descriptor_class(_LazyDescriptorClass(self, import_path, schemes, host_suffixes), weight)
+
+    def _load_entry_points(self):
+        self._include_entry_points = False
+        for ep in entry_points(group="universalio.descriptors"):
+            cls = ep.load()
+            weight = 100
+            if hasattr(cls, "weight"):
+                weight = getattr(cls, "weight")
+            self.register_descriptor_class(cls, weight)
+        # Plugins opt in to being imported on first use by registering here under the URL scheme they handle
+        for ep in entry_points(group="universalio.lazy_descriptors"):
+            if not _SCHEME_NAME.match(ep.name):
+                logging.getLogger(__name__).warning(
+                    "Ignoring lazy descriptor entry point {}, its name must be the URL scheme it handles".format(ep.name)
+                )
+                continue
+            self.register_lazy_descriptor_class(ep.value, (ep.name.lower(),), weight=100)
+
+    def _build_index(self):
+        if self._include_entry_points:
+            self._load_entry_points()
+        sort_me = [(key, self.registry[key][1]) for key in self.registry]
+        sort_me.sort(key=lambda x: x[1])
+        self.registry_order = [x[0] for x in sort_me]
+        classes = [self.registry[key][0] for key in self.registry_order]
+        # Classes that don't declare their schemes are asked about every location, in weight order
+        self._fallback = [cls for cls in classes if cls.schemes is None]
+        self._dispatch = {}
+        for scheme in set(s for cls in classes for s in (cls.schemes or ())):
+            self._dispatch[scheme] = [cls for cls in classes if cls.schemes is None or scheme in cls.schemes]
 
     def get_descriptor(self, location) -> ResourceDescriptor:
         if isinstance(location, ResourceDescriptor):
             return location
         location = str(location)
-        if self.registry_order is None:
-            sort_me = [(key, self.registry[key][1]) for key in self.registry]
-            sort_me.sort(key=lambda x: x[1])
-            self.registry_order = [x[0] for x in sort_me]
-        for key in self.registry_order:
-            if self.registry[key][0].match_location(location):
-                return self.registry[key][0].create_from_location(location)
+        if self._interned is None:
+            return self._create_descriptor(location)
+        descriptor = self._interned.get(location, None)
+        if descriptor is None:
+            descriptor = self._create_descriptor(location)
+            self._interned[location] = descriptor
+        elif descriptor.metadata_ttl is None:
+            # Without a TTL nothing would ever expire what it cached, so a new lookup starts from a clean cache as a
+            # new descriptor would
+            descriptor.clear_cache()
+        return descriptor
+
+    def _create_descriptor(self, location):
+        return self._find_class(location).create_from_location(location)
+
+    def _find_class(self, location):
+        if self._dispatch is None:
+            self._build_index()
+        m = _SCHEME_AND_HOST.match(location)
+        scheme = m.group(1).lower() if m else None
+        for cls in self._dispatch.get(scheme, self._fallback):
+            if cls.host_suffixes and not (m and m.group(2).lower().endswith(cls.host_suffixes)):
+                continue
+            if cls.match_location(location):
+                return cls
         raise ValueError("No descriptor class found for location {}".format(location))
 
+    def stat_many(self, locations):
+        return self.loop.run(self.stat_many_async(locations))
+
+    async def stat_many_async(self, locations, queue_size=1000):
+        # Yields (descriptor, FileMetadata or None) in the order results arrive. Locations are grouped by backend and
+        # host so each group can use that backend's bulk lookup.
+        groups = {}
+        for location in locations:
+            descriptor = self.get_descriptor(location)
+            groups.setdefault((descriptor.__class__, descriptor.host_key()), []).append(descriptor)
+        queue = asyncio.Queue(queue_size)
+        tasks = [asyncio.ensure_future(self._stat_group(group, queue)) for group in groups.values()]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                result = await queue.get()
+                if result is _END_OF_GROUP:
+                    remaining -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            for tsk in tasks:
+                tsk.cancel()
+
+    @staticmethod
+    async def _stat_group(group, queue):
+        try:
+            async for result in group[0].stat_many_async(group):
+                await queue.put(result)
+        except Exception as ex:
+            await queue.put(ex)
+        await queue.put(_END_OF_GROUP)
+
+
+class _LazyDescriptorClass:
+
+    def __init__(self, file_manager, import_path, schemes, host_suffixes=None):
+        self.file_manager = file_manager
+        self.import_path = import_path
+        self.schemes = tuple(schemes)
+        self.host_suffixes = tuple(host_suffixes) if host_suffixes else None
+        self.__name__ = import_path.rpartition(":")[2]
+        self._cls = None
+        self._unavailable = False
+
+    def load(self):
+        if self._cls is None and not self._unavailable:
+            module_name, _, class_name = self.import_path.partition(":")
+            try:
+                self._cls = getattr(importlib.import_module(module_name), class_name)
+            except ImportError as ex:
+                # Optional backends whose dependencies aren't installed just never match
+                logging.getLogger(__name__).debug("Descriptor class {} is not available: {}".format(self.import_path, ex))
+                self._unavailable = True
+                return None
+            if hasattr(self._cls, "weight"):
+                self.file_manager.register_descriptor_class(self._cls, getattr(self._cls, "weight"))
+        return self._cls
+
+    def match_location(self, location):
+        cls = self.load()
+        return cls is not None and cls.match_location(location)
+
+    def create_from_location(self, location):
+        return self.load().create_from_location(location)
+
 
 class _FileWrapper:
 
@@ -0,0 +1,97 @@
+from autoinject import injector
+import zirconium as zr
+import base64
+import binascii
+
+
+class FileMetadata:
+
+    def __init__(self, size=None, mtime=None, etag=None, checksum=None, is_dir=False):
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.etag = etag
+        # Server-computed content digest as (algorithm, hex digest), if the backend has one
+        self.checksum = checksum
+
+    def __repr__(self):
+        return "<FileMetadata size={} mtime={} etag={}>".format(self.size, self.mtime, self.etag)
+
+
+def encoded_checksum(algorithm, value):
+    # Services hand out digests as raw bytes or base64 (e.g. Content-MD5), normalize them to hex
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            return None
+    return algorithm, bytes(value).hex()
+
+
+async def _mtime_size(descriptor, metadata):
+    # Zero is a perfectly good size, only missing values mean the backend couldn't tell us
+    if metadata.mtime is None or metadata.size is None:
+        return None
+    return "{}_{}".format(metadata.mtime.strftime("%Y%m%d%H%M%S"), metadata.size)
+
+
+async def _etag(descriptor, metadata):
+    return metadata.etag or None
+
+
+async def _checksum(descriptor, metadata):
+    if not metadata.checksum:
+        return None
+    return "{}:{}".format(*metadata.checksum)
+
+
+async def _content_hash(descriptor, metadata):
+    return await descriptor.file_hash_async()
+
+
+FINGERPRINT_STRATEGIES = {
+    "mtime_size": _mtime_size,
+    "etag": _etag,
+    "checksum": _checksum,
+    "content_hash": _content_hash,
+}
+
+
+@injector.injectable
+class FingerprintManager:
+
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self):
+        self._strategies = {}
+
+    def strategies(self, descriptor_class):
+        if descriptor_class not in self._strategies:
+            names = self.config.get(
+                ("universalio", "fingerprint", descriptor_class.__name__, "strategies"),
+                default=None
+            )
+            if names is None:
+                names = descriptor_class.fingerprint_strategies
+            elif isinstance(names, str):
+                names = [n.strip() for n in names.split(",")]
+            unknown = [n for n in names if n not in FINGERPRINT_STRATEGIES]
+            if unknown:
+                raise ValueError("Unknown fingerprint strategies for {}: {}".format(descriptor_class.__name__, unknown))
+            self._strategies[descriptor_class] = [FINGERPRINT_STRATEGIES[n] for n in names]
+        return self._strategies[descriptor_class]
+
+    async def fingerprint(self, descriptor):
+        # One metadata fetch (usually answered from the listing cache) feeds every strategy, the first to produce a
+        # value wins
+        metadata = await descriptor.metadata_async()
+        if metadata is None:
+            return None
+        for strategy in self.strategies(descriptor.__class__):
+            fingerprint = await strategy(descriptor, metadata)
+            if fingerprint is not None:
+                return fingerprint
+        return None
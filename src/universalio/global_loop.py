@@ -49,7 +49,7 @@ class GlobalLoopContext:
         return values
 
     def exit(self):
-        if self.loop.is_running:
+        if self.loop.is_running():
             self.loop.stop()
 
     def __del__(self):
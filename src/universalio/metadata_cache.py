@@ -0,0 +1,83 @@
+from autoinject import injector
+import zirconium as zr
+import collections
+import threading
+import time
+
+
+DEFAULT_METADATA_CACHE_ENTRIES = 100000
+
+
+@injector.injectable
+class MetadataCache:
+
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self):
+        # Off by default, since changes made outside of universalio are only seen once entries expire
+        self.enabled = self.config.as_bool(("universalio", "metadata_cache", "enabled"), default=False)
+        self.max_entries = self.config.as_int(("universalio", "metadata_cache", "max_entries"), default=DEFAULT_METADATA_CACHE_ENTRIES)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._ttls = {}
+
+    def ttl(self, descriptor_class, negative=False):
+        key = (descriptor_class, negative)
+        if key not in self._ttls:
+            default = descriptor_class.metadata_negative_ttl if negative else descriptor_class.metadata_ttl
+            if default is None:
+                self._ttls[key] = None
+            else:
+                self._ttls[key] = self.config.as_float(
+                    ("universalio", "metadata_cache", descriptor_class.__name__, "negative_ttl" if negative else "ttl"),
+                    default=default
+                )
+        return self._ttls[key]
+
+    def get(self, location, cache_key):
+        with self._lock:
+            values = self._entries.get(location, None)
+            if values is None or cache_key not in values:
+                return False, None
+            value, expires = values[cache_key]
+            if expires < time.monotonic():
+                del values[cache_key]
+                if not values:
+                    del self._entries[location]
+                return False, None
+            self._entries.move_to_end(location)
+            return True, value
+
+    def put(self, location, cache_key, value, ttl):
+        if not ttl or ttl <= 0:
+            return
+        with self._lock:
+            if location not in self._entries:
+                self._entries[location] = {}
+            else:
+                self._entries.move_to_end(location)
+            self._entries[location][cache_key] = (value, time.monotonic() + ttl)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, location, cache_key=None, include_parents=False):
+        with self._lock:
+            if cache_key is None:
+                self._entries.pop(location, None)
+            elif location in self._entries:
+                self._entries[location].pop(cache_key, None)
+            if include_parents:
+                # Writes and removals change whether virtual directories exist and their timestamps
+                parent = location.rstrip("/\\")
+                while True:
+                    cut = max(parent.rfind("/"), parent.rfind("\\"))
+                    if cut <= 0:
+                        break
+                    parent = parent[:cut]
+                    self._entries.pop(parent, None)
+                    self._entries.pop(parent + "/", None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,119 @@
+from autoinject import injector
+import zirconium as zr
+import asyncio
+import functools
+import logging
+import random
+
+
+THROTTLE_STATUS_CODES = (429, 503)
+THROTTLE_ERROR_CODES = ("ServerBusy", "OperationTimedOut", "InternalError")
+TRANSIENT_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+def is_overload_error(ex):
+    if isinstance(ex, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    # aiohttp uses status, azure-core uses status_code
+    for attr in ("status", "status_code"):
+        if getattr(ex, attr, None) in THROTTLE_STATUS_CODES:
+            return True
+    return getattr(ex, "error_code", None) in THROTTLE_ERROR_CODES
+
+
+def is_transient_error(ex):
+    if is_overload_error(ex):
+        return True
+    if isinstance(ex, (ConnectionError, asyncio.IncompleteReadError)):
+        return True
+    for attr in ("status", "status_code"):
+        if getattr(ex, attr, None) in TRANSIENT_STATUS_CODES:
+            return True
+    return False
+
+
+class RetryBudget:
+
+    def __init__(self, max_tokens=10, success_credit=0.1):
+        self.max_tokens = max_tokens
+        self.success_credit = success_credit
+        self.tokens = float(max_tokens)
+
+    def can_retry(self):
+        # Once half the budget is spent, retries stop until successes refill it
+        return self.tokens > (self.max_tokens / 2)
+
+    def record_failure(self):
+        self.tokens = max(0.0, self.tokens - 1)
+
+    def record_success(self):
+        self.tokens = min(float(self.max_tokens), self.tokens + self.success_credit)
+
+
+@injector.injectable
+class RetryManager:
+
+    config: zr.ApplicationConfig = None
+
+    @injector.construct
+    def __init__(self):
+        self.max_attempts = self.config.as_int(("universalio", "retry", "max_attempts"), default=5)
+        self.base_delay = self.config.as_float(("universalio", "retry", "base_delay"), default=0.5)
+        self.max_delay = self.config.as_float(("universalio", "retry", "max_delay"), default=30.0)
+        self.budget_tokens = self.config.as_int(("universalio", "retry", "budget"), default=10)
+        self._budgets = {}
+
+    def budget(self, descriptor):
+        host_key = descriptor.host_key()
+        if host_key not in self._budgets:
+            self._budgets[host_key] = RetryBudget(self.budget_tokens)
+        return self._budgets[host_key]
+
+    def delay(self, attempt):
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def record_success(self, descriptor):
+        self.budget(descriptor).record_success()
+
+    async def backoff(self, attempt, ex, *descriptors):
+        if attempt >= self.max_attempts:
+            return False
+        if not any(d._is_retryable_error(ex) for d in descriptors):
+            return False
+        budget = self.budget(descriptors[0])
+        budget.record_failure()
+        if not budget.can_retry():
+            logging.getLogger(__name__).warning("Retry budget exhausted for {}".format(descriptors[0].host_key()))
+            return False
+        delay = self.delay(attempt)
+        logging.getLogger(__name__).info("Retrying operation on {} in {:.2f}s after error: {}".format(
+            descriptors[0], delay, ex
+        ))
+        for d in descriptors:
+            await d._prepare_retry_async(ex)
+        await asyncio.sleep(delay)
+        return True
+
+    async def call(self, descriptors, coro_func, *args, **kwargs):
+        if not isinstance(descriptors, (tuple, list)):
+            descriptors = (descriptors,)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = await coro_func(*args, **kwargs)
+                self.record_success(descriptors[0])
+                return result
+            except Exception as ex:
+                if not await self.backoff(attempt, ex, *descriptors):
+                    raise ex
+
+
+def retryable(func):
+
+    @functools.wraps(func)
+    async def _wrapped(self, *args, **kwargs):
+        return await self.retries.call(self, func, self, *args, **kwargs)
+
+    return _wrapped
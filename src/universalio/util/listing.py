@@ -0,0 +1,180 @@
+import datetime
+import json
+import re
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit, unquote
+
+
+_NGINX_DATE = re.compile(r"(\d{1,2}-[A-Za-z]{3}-\d{4} \d{1,2}:\d{2}(?::\d{2})?)")
+_ISO_DATE = re.compile(r"(\d{4}-\d{2}-\d{2}[ T]\d{1,2}:\d{2}(?::\d{2})?)")
+_DATE_FORMATS = (
+    "%d-%b-%Y %H:%M",
+    "%d-%b-%Y %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+)
+
+
+class ListingEntry:
+
+    def __init__(self, name, size=None, mtime=None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+    def is_dir(self):
+        return self.name.endswith("/")
+
+    def __repr__(self):
+        return "ListingEntry({}, {}, {})".format(self.name, self.size, self.mtime)
+
+
+def _parse_listing_date(s):
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(s, fmt).replace(tzinfo=datetime.timezone.utc)
+        except ValueError:
+            pass
+    return None
+
+
+class HtmlIndexParser(HTMLParser):
+
+    def __init__(self, base_uri):
+        super().__init__(convert_charrefs=True)
+        self.base_uri = base_uri if base_uri.endswith("/") else base_uri + "/"
+        self._base_path = urlsplit(self.base_uri).path
+        self._base_netloc = urlsplit(self.base_uri).netloc
+        self._seen = set()
+        self._current = None
+        self._in_anchor = False
+        self._tail = []
+        self._ready = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            self._finish_entry()
+            self._in_anchor = True
+            href = dict(attrs).get("href", None)
+            name = self._child_name(href) if href else None
+            if name is not None and name not in self._seen:
+                self._seen.add(name)
+                self._current = ListingEntry(name)
+                self._tail = []
+        elif tag == "tr":
+            self._finish_entry()
+
+    def handle_endtag(self, tag):
+        if tag == "a":
+            self._in_anchor = False
+        elif tag in ("tr", "pre", "table", "body"):
+            self._finish_entry()
+
+    def handle_data(self, data):
+        if self._current is not None and not self._in_anchor:
+            self._tail.append(data)
+
+    def _child_name(self, href):
+        if href.startswith("?") or href.startswith("#"):
+            return None
+        p = urlsplit(urljoin(self.base_uri, href))
+        if p.netloc != self._base_netloc or p.query or not p.path.startswith(self._base_path):
+            return None
+        name = p.path[len(self._base_path):]
+        stripped = name.rstrip("/")
+        if stripped == "" or "/" in stripped:
+            return None
+        return unquote(name)
+
+    def _finish_entry(self):
+        if self._current is None:
+            return
+        tail = "".join(self._tail)
+        for date_re in (_NGINX_DATE, _ISO_DATE):
+            m = date_re.search(tail)
+            if m:
+                self._current.mtime = _parse_listing_date(m.group(1))
+                # Only exact byte counts are kept, human-readable sizes like 1.2K are too imprecise
+                size = tail[m.end():].split()
+                if size and size[0].isdigit() and not self._current.is_dir():
+                    self._current.size = int(size[0])
+                break
+        self._ready.append(self._current)
+        self._current = None
+        self._tail = []
+
+    def feed(self, data):
+        super().feed(data)
+        ready = self._ready
+        self._ready = []
+        return ready
+
+    def close(self):
+        super().close()
+        self._finish_entry()
+        ready = self._ready
+        self._ready = []
+        return ready
+
+
+class JsonArrayParser:
+
+    def __init__(self):
+        self._decoder = json.JSONDecoder()
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+
+    def feed(self, data):
+        self._buffer += data
+        items = []
+        pos = 0
+        buf = self._buffer
+        while not self._finished:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not self._started:
+                if buf[pos] != "[":
+                    raise ValueError("Expected a JSON array")
+                self._started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                self._finished = True
+                pos += 1
+                break
+            try:
+                item, end = self._decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # Partial value, wait for the next chunk
+                break
+            # Numbers may be cut off at the chunk boundary
+            if end == len(buf) and not isinstance(item, (str, dict, list)):
+                break
+            items.append(item)
+            pos = end
+        self._buffer = buf[pos:]
+        return [self._to_entry(x) for x in items]
+
+    def close(self):
+        if not self._finished:
+            raise ValueError("Incomplete JSON array")
+        return []
+
+    @staticmethod
+    def _to_entry(item):
+        if isinstance(item, str):
+            return ListingEntry(item)
+        if isinstance(item, dict) and "name" in item:
+            mtime = item.get("mtime", None)
+            if isinstance(mtime, str):
+                mtime = _parse_listing_date(mtime[:19])
+            elif isinstance(mtime, (int, float)):
+                mtime = datetime.datetime.fromtimestamp(mtime, datetime.timezone.utc)
+            size = item.get("size", None)
+            return ListingEntry(item["name"], int(size) if size is not None else None, mtime)
+        raise ValueError("Invalid JSON directory entry: {}".format(item))
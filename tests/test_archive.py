@@ -0,0 +1,152 @@
+import unittest
+import tempfile
+import pathlib
+import tarfile
+import zipfile
+import io
+import os
+from universalio.descriptors import LocalDescriptor
+from universalio.descriptors.base import UNIOError
+from universalio.archive import create_archive, extract_archive, guess_format, TAR, ZIP
+
+
+class _UnsizedDescriptor(LocalDescriptor):
+
+    # Like an HTTP file served without a Content-Length
+
+    async def size_async(self):
+        return None
+
+
+class _ShrinkingDescriptor(LocalDescriptor):
+
+    # Reports more than it holds, as if the file was truncated while being archived
+
+    async def size_async(self):
+        return await super().size_async() + 1
+
+
+class _UnseekableBuffer(io.RawIOBase):
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def _make_tree(root):
+    (root / "sub" / "deep").mkdir(parents=True)
+    (root / "empty").mkdir()
+    with open(root / "a.txt", "wb") as h:
+        h.write(b"hello world")
+    with open(root / "zero.txt", "wb") as h:
+        pass
+    with open(root / "sub" / "random.bin", "wb") as h:
+        h.write(os.urandom(300000))
+    with open(root / "sub" / "deep" / ("ü" * 60 + ".txt"), "wb") as h:
+        h.write(b"\0" * 1000000)
+
+
+def _tree(root):
+    return {
+        str(p.relative_to(root)): None if p.is_dir() else p.read_bytes()
+        for p in root.rglob("*")
+    }
+
+
+class TestArchive(unittest.TestCase):
+
+    def test_guess_format(self):
+        self.assertEqual(guess_format("backup.tar.gz"), (TAR, "gz"))
+        self.assertEqual(guess_format("BACKUP.TXZ"), (TAR, "xz"))
+        self.assertEqual(guess_format("backup.zip"), (ZIP, None))
+        self.assertEqual(guess_format("backup.txt"), (None, None))
+
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            _make_tree(d / "src")
+            for name in ("out.tar", "out.tar.gz", "out.tar.bz2", "out.tar.xz", "out.zip"):
+                with self.subTest(name):
+                    archive = LocalDescriptor(d / name)
+                    # A small chunk size so files span several chunks
+                    self.assertEqual(create_archive(LocalDescriptor(d / "src"), archive, chunk_size=65536), 4)
+                    self.assertEqual(extract_archive(archive, LocalDescriptor(d / ("x" + name)), chunk_size=65536), 4)
+                    self.assertEqual(_tree(d / ("x" + name)), _tree(d / "src"))
+
+    def test_readable_by_stdlib(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            _make_tree(d / "src")
+            create_archive(LocalDescriptor(d / "src"), LocalDescriptor(d / "out.tgz"), prefix="root")
+            with tarfile.open(d / "out.tgz") as h:
+                self.assertEqual(h.extractfile("root/a.txt").read(), b"hello world")
+                self.assertTrue(h.getmember("root/empty").isdir())
+            create_archive(LocalDescriptor(d / "src"), LocalDescriptor(d / "out.zip"))
+            with zipfile.ZipFile(d / "out.zip") as h:
+                self.assertIsNone(h.testzip())
+                self.assertTrue(all(i.flag_bits & 0x08 for i in h.infolist()))
+                self.assertEqual(h.read("a.txt"), b"hello world")
+
+    def test_extract_stdlib_archives(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            buffer = _UnseekableBuffer()
+            with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as h:
+                h.writestr("dir/a.txt", b"abc" * 10000)
+                h.writestr("b.txt", b"")
+            with open(d / "in.zip", "wb") as h:
+                h.write(buffer.data)
+            self.assertEqual(extract_archive(LocalDescriptor(d / "in.zip"), LocalDescriptor(d / "zip")), 2)
+            self.assertEqual((d / "zip" / "dir" / "a.txt").read_bytes(), b"abc" * 10000)
+            with tarfile.open(d / "in.tar.bz2", "w:bz2", format=tarfile.GNU_FORMAT) as h:
+                info = tarfile.TarInfo("x" * 200 + ".txt")
+                info.size = 3
+                h.addfile(info, io.BytesIO(b"abc"))
+            self.assertEqual(extract_archive(LocalDescriptor(d / "in.tar.bz2"), LocalDescriptor(d / "tar")), 1)
+            self.assertEqual((d / "tar" / ("x" * 200 + ".txt")).read_bytes(), b"abc")
+
+    def test_unsafe_names_are_skipped(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            with tarfile.open(d / "in.tar", "w") as h:
+                for name in ("../evil.txt", "/abs.txt", "ok.txt"):
+                    info = tarfile.TarInfo(name)
+                    info.size = 1
+                    h.addfile(info, io.BytesIO(b"x"))
+            self.assertEqual(extract_archive(LocalDescriptor(d / "in.tar"), LocalDescriptor(d / "out")), 2)
+            self.assertFalse((d / "evil.txt").exists())
+            self.assertEqual(sorted(os.listdir(d / "out")), ["abs.txt", "ok.txt"])
+
+    def test_unknown_size(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            with open(d / "a.txt", "wb") as h:
+                h.write(b"hello world")
+            # zip writes the sizes after the data, tar needs them up front
+            create_archive(_UnsizedDescriptor(d / "a.txt"), LocalDescriptor(d / "out.zip"))
+            with zipfile.ZipFile(d / "out.zip") as h:
+                self.assertEqual(h.read("a.txt"), b"hello world")
+            with self.assertRaises(UNIOError):
+                create_archive(_UnsizedDescriptor(d / "a.txt"), LocalDescriptor(d / "out.tar"))
+
+    def test_failure_keeps_previous_archive(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            with open(d / "a.txt", "wb") as h:
+                h.write(b"hello world")
+            create_archive(LocalDescriptor(d / "a.txt"), LocalDescriptor(d / "out.tar"))
+            before = (d / "out.tar").read_bytes()
+            with self.assertRaises(UNIOError):
+                create_archive(_ShrinkingDescriptor(d / "a.txt"), LocalDescriptor(d / "out.tar"))
+            # Neither a truncated archive nor the partial one is left behind
+            self.assertEqual((d / "out.tar").read_bytes(), before)
+            self.assertEqual(sorted(os.listdir(d)), ["a.txt", "out.tar"])
+            with self.assertRaises(UNIOError):
+                create_archive(_ShrinkingDescriptor(d / "a.txt"), LocalDescriptor(d / "new.tar"))
+            self.assertFalse((d / "new.tar").exists())
@@ -2,7 +2,33 @@ import unittest
 import pathlib
 import os
 import toml
+import asyncio
+from azure.core.exceptions import HttpResponseError
 from universalio.descriptors import AzureBlobDescriptor
+from universalio.descriptors.azure_blob import _AzureBlobRangeReaderContextManager
+
+
+class _RangeStream:
+
+    def __init__(self, data):
+        self.data = data
+
+    async def readall(self):
+        return self.data
+
+
+class _RangeBlobClient:
+
+    def __init__(self, data):
+        self.data = data
+
+    async def download_blob(self, offset, length):
+        if offset >= len(self.data):
+            ex = HttpResponseError(message="The range specified is invalid for the current size of the resource.")
+            ex.status_code = 416
+            ex.error_code = "InvalidRange"
+            raise ex
+        return _RangeStream(self.data[offset:offset + length])
 
 
 class TestAzureBlobDescriptor(unittest.TestCase):
@@ -138,3 +164,12 @@ class TestAzureBlobDescriptor(unittest.TestCase):
         file.write("I am the very model of a modern major general".encode("utf-8"))
         self.assertTrue(file.exists())
         self.assertEqual("I am the very model of a modern major general", file.text("utf-8"))
+
+
+class TestAzureBlobRangeReader(unittest.TestCase):
+
+    def test_read_at_end(self):
+        # Resumed reads of a blob whose size is a multiple of the chunk size start exactly at the end
+        handle = _AzureBlobRangeReaderContextManager.RangeHandle(_RangeBlobClient(b"abcdefgh"))
+        self.assertEqual(asyncio.run(handle.read_range(4, 4)), b"efgh")
+        self.assertEqual(asyncio.run(handle.read_range(8, 4)), b"")
@@ -0,0 +1,393 @@
+import unittest
+import tempfile
+import pathlib
+import asyncio
+import time
+import threading
+import concurrent.futures
+import os
+from universalio.batch.batch import BatchFileCopy, AsynchronousThread
+from universalio.descriptors import LocalDescriptor
+from universalio.descriptors.base import UNIOError
+from universalio.batch.scheduler import FairShareScheduler
+from universalio.batch.adaptive import AdaptiveLimiter, AdaptiveConcurrencyController
+
+
+class TestAsynchronousThread(unittest.TestCase):
+
+    def test_job_future(self):
+        t = AsynchronousThread()
+        t.start()
+
+        async def _job(x):
+            return x * 2
+
+        fut = t.run_coro("double", _job, 21)
+        self.assertEqual(fut.result(5), 42)
+        self.assertTrue(t.is_completed("double"))
+        self.assertEqual(t.result(fut), 42)
+        t.wait_join()
+
+    def test_start_latency(self):
+        t = AsynchronousThread()
+        t.start()
+        started = []
+
+        async def _job():
+            started.append(time.perf_counter())
+
+        # Let the thread go idle before submitting
+        time.sleep(0.2)
+        submitted = time.perf_counter()
+        t.run_coro("latency", _job).result(5)
+        self.assertLess(started[0] - submitted, 0.1)
+        t.wait_join()
+
+    def test_failed_job(self):
+        t = AsynchronousThread()
+        t.start()
+
+        async def _job():
+            raise ValueError("oops")
+
+        fut = t.run_coro("fail", _job)
+        self.assertRaises(ValueError, fut.result, 5)
+        self.assertFalse(t.result("fail"))
+        t.wait_join()
+        self.assertTrue(t.run_coro("late", _job).cancelled())
+
+
+    def test_submit_during_halt(self):
+        async def _job(i):
+            return i
+
+        for attempt in range(0, 5):
+            t = AsynchronousThread()
+            t.start()
+            futures = []
+            submitter = threading.Thread(target=lambda: futures.extend(t.run_coro(i, _job, i) for i in range(0, 200)))
+            submitter.start()
+            t.wait_join()
+            submitter.join()
+            # Every job either ran or was refused, none is left waiting forever
+            concurrent.futures.wait(futures, 5)
+            self.assertTrue(all(f.done() for f in futures))
+
+    def test_history_is_bounded(self):
+        t = AsynchronousThread()
+        t.completed_history = 5
+        t.start()
+
+        async def _job(i):
+            return i
+
+        futures = [t.run_coro("job{}".format(i), _job, i) for i in range(0, 20)]
+        concurrent.futures.wait(futures, 5)
+        self.assertTrue(t.wait("job19"))
+        self.assertEqual(t.result("job19"), 19)
+        self.assertFalse(t.is_completed("job0"))
+        self.assertEqual(len(t._completed), 5)
+        self.assertEqual(len(t._futures), 0)
+        t.wait_join()
+
+
+class TestBatchFileCopy(unittest.TestCase):
+
+    def test_queue_copy(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            sources = []
+            for i in range(0, 10):
+                f = d / "test{}.txt".format(i)
+                with open(f, "w") as h:
+                    h.write("I am the very model of a modern major general {}".format(i))
+                sources.append(f)
+            target = d / "target"
+            target.mkdir()
+            batch = BatchFileCopy()
+            jobs = [batch.queue_copy(str(f), str(target / f.name)) for f in sources]
+            self.assertTrue(batch.wait_for_job(jobs[0]))
+            self.assertTrue(batch.wait_for_job(str(jobs[-1])))
+            batch.wait_for_all()
+            for job in jobs:
+                self.assertTrue(job.done())
+            for f in sources:
+                with open(target / f.name, "r") as h:
+                    self.assertEqual(h.read(), f.read_text())
+
+
+class TestFairShareScheduler(unittest.TestCase):
+
+    def test_priority_and_fair_share(self):
+        async def _run():
+            scheduler = FairShareScheduler(1)
+            order = []
+
+            async def _job(name, priority, tenant):
+                async with scheduler.slot(priority, tenant):
+                    order.append(name)
+                    await asyncio.sleep(0)
+
+            blocker = asyncio.get_running_loop().create_future()
+
+            async def _blocking():
+                async with scheduler.slot(0, "bulk"):
+                    await blocker
+
+            first = asyncio.create_task(_blocking())
+            await asyncio.sleep(0)
+            jobs = [asyncio.create_task(_job("bulk{}".format(i), 0, "bulk")) for i in range(0, 3)]
+            jobs.append(asyncio.create_task(_job("small", 0, "small")))
+            jobs.append(asyncio.create_task(_job("urgent", 10, "small")))
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.waiting(), 5)
+            blocker.set_result(True)
+            await asyncio.gather(first, *jobs)
+            self.assertEqual(scheduler.active, 0)
+            return order
+
+        order = asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(order[0], "urgent")
+        # The small tenant gets a turn before the bulk tenant's backlog is drained
+        self.assertLess(order.index("small"), order.index("bulk1"))
+
+    def test_cancel_waiting(self):
+        async def _run():
+            scheduler = FairShareScheduler(1)
+            await scheduler.acquire(0, "a")
+            waiter = asyncio.create_task(scheduler.acquire(0, "b"))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            self.assertEqual(scheduler.waiting(), 0)
+            scheduler.release("a")
+            self.assertEqual(scheduler.active, 0)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+
+
+class _RemoteDescriptor(LocalDescriptor):
+
+    # Copied file by file like a tree on another host
+
+    async def is_local_to_async(self, target_resource):
+        return False
+
+
+class TestBatchDirectoryCopy(unittest.TestCase):
+
+    def test_copy_directory(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            (src / "sub").mkdir(parents=True)
+            for f in (src / "a.txt", src / "sub" / "b.txt"):
+                with open(f, "w") as h:
+                    h.write(f.name)
+            batch = BatchFileCopy(max_concurrency=2)
+            job = batch.queue_copy(str(src), str(d / "dst"), priority=5, tenant="me")
+            batch.wait_for_job(job)
+            batch.wait_for_all()
+            job.result()
+            self.assertEqual((d / "dst" / "a.txt").read_text(), "a.txt")
+            self.assertEqual((d / "dst" / "sub" / "b.txt").read_text(), "b.txt")
+
+    def _copy_remote(self, src, dst, **kwargs):
+        batch = BatchFileCopy(max_concurrency=2)
+        job = batch.queue_copy(_RemoteDescriptor(src), LocalDescriptor(dst), **kwargs)
+        batch.wait_for_job(job)
+        batch.wait_for_all()
+        return job
+
+    def test_copy_directory_options(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            (src / "sub").mkdir(parents=True)
+            for f in (src / "a.txt", src / "b.txt", src / "sub" / "c.txt"):
+                with open(f, "w") as h:
+                    h.write(f.name)
+            self._copy_remote(src, d / "flat", recursive=False).result()
+            self.assertEqual(sorted(os.listdir(d / "flat")), ["a.txt", "b.txt"])
+            self._copy_remote(src, d / "stubs", recursive=False, make_stub_dirs=True).result()
+            self.assertEqual(sorted(os.listdir(d / "stubs")), ["a.txt", "b.txt", "sub"])
+            self.assertEqual(os.listdir(d / "stubs" / "sub"), [])
+            # Nothing is copied when any of the files is already there
+            (d / "checked").mkdir()
+            with open(d / "checked" / "b.txt", "w") as h:
+                h.write("old")
+            job = self._copy_remote(src, d / "checked", require_not_exists=False, preliminary_check=True)
+            with self.assertRaises(UNIOError):
+                job.result()
+            self.assertEqual(os.listdir(d / "checked"), ["b.txt"])
+
+
+    def test_urgent_copy_skips_host_backlog(self):
+        class _Endpoint:
+
+            def host_key(self):
+                return "test://busy-host"
+
+            async def size_async(self):
+                return 1
+
+        batch = BatchFileCopy(max_concurrency=2)
+        batch.adaptive = AdaptiveConcurrencyController()
+        endpoint = _Endpoint()
+        order = []
+
+        async def _copy(name):
+            order.append(name)
+            await asyncio.sleep(0.001)
+
+        async def _run():
+            jobs = [
+                asyncio.create_task(batch._copy_one(endpoint, endpoint, 0, "bulk", _copy, "bulk{}".format(i)))
+                for i in range(0, 20)
+            ]
+            await asyncio.sleep(0)
+            jobs.append(asyncio.create_task(batch._copy_one(endpoint, endpoint, 10, "urgent", _copy, "urgent")))
+            await asyncio.gather(*jobs)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        batch.wait_for_all()
+        # Only the copies that already held the host's slots go first
+        self.assertLess(order.index("urgent"), 5)
+
+    def test_host_limit_not_capped(self):
+        class _Endpoint:
+
+            def host_key(self):
+                return "test://fast-host"
+
+            async def size_async(self):
+                return 1
+
+        batch = BatchFileCopy()
+        batch.adaptive = AdaptiveConcurrencyController()
+        endpoint = _Endpoint()
+        # As if the host had already shown it copes with twelve at once
+        batch.adaptive.limiter(endpoint).limit = 12
+        running = [0, 0]
+
+        async def _copy():
+            running[0] += 1
+            running[1] = max(running)
+            await asyncio.sleep(0.01)
+            running[0] -= 1
+
+        async def _run():
+            await asyncio.gather(*[batch._copy_one(endpoint, endpoint, 0, None, _copy) for i in range(0, 30)])
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        batch.wait_for_all()
+        self.assertEqual(running[1], 12)
+
+
+class _ThrottledError(Exception):
+
+    status = 503
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+
+    def test_additive_increase(self):
+        limiter = AdaptiveLimiter("test", initial_limit=2, max_limit=4)
+
+        async def _run():
+            for i in range(0, 50):
+                held = int(limiter.limit)
+                for j in range(0, held):
+                    await limiter.acquire()
+                for j in range(0, held):
+                    limiter.release_success(0.1, 1000)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_no_increase_below_limit(self):
+        limiter = AdaptiveLimiter("test", initial_limit=4)
+
+        async def _run():
+            # Never more than two at once, so nothing says the host could take more than four
+            for i in range(0, 50):
+                await limiter.acquire()
+                await limiter.acquire()
+                limiter.release_success(0.1, 1000)
+                limiter.release_success(0.1, 1000)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(limiter.limit, 4)
+
+    def test_backoff_on_latency(self):
+        limiter = AdaptiveLimiter("test", initial_limit=8)
+
+        async def _run():
+            for i in range(0, 5):
+                await limiter.acquire()
+                limiter.release_success(0.1, 10000000)
+            await limiter.acquire()
+            limiter.release_success(5, 10000000)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertLess(limiter.limit, 8)
+
+    def test_backoff_on_throttling(self):
+        limiter = AdaptiveLimiter("test", initial_limit=8)
+
+        async def _run():
+            with self.assertRaises(_ThrottledError):
+                async with limiter.slot():
+                    raise _ThrottledError()
+            # A second failure in the same window isn't counted twice
+            with self.assertRaises(_ThrottledError):
+                async with limiter.slot():
+                    raise _ThrottledError()
+            # Errors that aren't about load don't change the limit
+            with self.assertRaises(ValueError):
+                async with limiter.slot():
+                    raise ValueError()
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_limit_enforced(self):
+        limiter = AdaptiveLimiter("test", initial_limit=2, max_limit=2)
+        peak = [0]
+
+        async def _job():
+            async with limiter.slot():
+                peak[0] = max(peak[0], limiter.in_flight)
+                await asyncio.sleep(0.001)
+
+        async def _run():
+            await asyncio.gather(*[_job() for i in range(0, 10)])
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(peak[0], 2)
+
+    def test_priority_order(self):
+        limiter = AdaptiveLimiter("test", initial_limit=1, max_limit=1)
+        order = []
+
+        async def _job(name, priority):
+            async with limiter.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0)
+
+        async def _run():
+            await limiter.acquire()
+            jobs = [asyncio.create_task(_job("bulk{}".format(i), 0)) for i in range(0, 3)]
+            jobs.append(asyncio.create_task(_job("urgent", 10)))
+            cancelled = asyncio.create_task(_job("cancelled", 20))
+            await asyncio.sleep(0)
+            cancelled.cancel()
+            await asyncio.gather(cancelled, return_exceptions=True)
+            limiter.release_success(0.1)
+            await asyncio.gather(*jobs)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(order, ["urgent", "bulk0", "bulk1", "bulk2"])
+        self.assertEqual(limiter.in_flight, 0)
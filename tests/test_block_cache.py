@@ -0,0 +1,95 @@
+import unittest
+import tempfile
+import pathlib
+import os
+import time
+from universalio.block_cache import DiskBlockCache
+from universalio.descriptors import LocalDescriptor
+from universalio import GlobalLoopContext
+from autoinject import injector
+
+
+class _CountingLocalDescriptor(LocalDescriptor):
+
+    range_reads = 0
+
+    def _range_reader(self):
+        cm = super()._range_reader()
+        parent = self
+
+        class _Counter:
+
+            async def __aenter__(self):
+                handle = await cm.__aenter__()
+                original = handle.read_range
+
+                async def read_range(offset, length):
+                    parent.range_reads += 1
+                    return await original(offset, length)
+
+                handle.read_range = read_range
+                return handle
+
+            async def __aexit__(self, exc_type, exc_val, exc_tb):
+                await cm.__aexit__(exc_type, exc_val, exc_tb)
+
+        return _Counter()
+
+
+class TestDiskBlockCache(unittest.TestCase):
+
+    @injector.inject
+    def setUp(self, loop: GlobalLoopContext):
+        self.loop = loop
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache = DiskBlockCache()
+        self.cache.path = pathlib.Path(self._dir.name)
+        self.cache.max_size = 1000
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_get_put(self):
+        key = self.cache.make_key("sftp://host/file", "fp1", 100)
+        self.assertIsNone(self.cache.get(key, 0))
+        self.cache.put(key, 0, b"hello")
+        self.assertEqual(self.cache.get(key, 0), b"hello")
+        self.assertIsNone(self.cache.get(key, 1))
+        self.assertNotEqual(key, self.cache.make_key("sftp://host/file", "fp2", 100))
+
+    def test_lru_eviction(self):
+        key = self.cache.make_key("sftp://host/file", "fp1", 400)
+        self.cache.put(key, 0, b"0" * 400)
+        self.cache.put(key, 1, b"1" * 400)
+        # Make block 0 the oldest, then use block 1 so block 0 stays least recently used
+        past = time.time() - 100
+        os.utime(self.cache._block_path(key, 0), (past, past))
+        os.utime(self.cache._block_path(key, 1), (past, past))
+        self.cache.get(key, 1)
+        self.cache.put(key, 2, b"2" * 400)
+        self.assertIsNone(self.cache.get(key, 0))
+        self.assertEqual(self.cache.get(key, 1), b"1" * 400)
+        self.assertEqual(self.cache.get(key, 2), b"2" * 400)
+
+    def test_random_reader_uses_cache(self):
+        self.cache.max_size = 1024 * 1024
+        content = bytes(range(256)) * 20
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.bin"
+            with open(f, "wb") as h:
+                h.write(content)
+            fd = _CountingLocalDescriptor(f)
+
+            async def _read(start, length):
+                cm = fd.random_reader(block_size=512, use_cache=True)
+                cm.block_cache = self.cache
+                async with cm as r:
+                    r.seek(start)
+                    return await r.read(length)
+
+            self.assertEqual(self.loop.run(_read(1000, 2000)), content[1000:3000])
+            first_pass = fd.range_reads
+            self.assertGreater(first_pass, 0)
+            self.assertEqual(self.loop.run(_read(1000, 2000)), content[1000:3000])
+            self.assertEqual(fd.range_reads, first_pass)
+            self.assertEqual(self.loop.run(_read(4800, 1000)), content[4800:])
@@ -0,0 +1,124 @@
+import unittest
+import asyncio
+import tempfile
+import pathlib
+from universalio.concurrency import HostConcurrencyGovernor, BoundedTaskGroup, host_limited, bounded_as_completed
+from universalio.descriptors import LocalDescriptor
+
+
+class _LimitedDescriptor(LocalDescriptor):
+
+    max_host_concurrency = 2
+    running = 0
+    peak = 0
+
+    def host_key(self):
+        return "test://limited"
+
+    @host_limited
+    async def slow_call(self):
+        _LimitedDescriptor.running += 1
+        _LimitedDescriptor.peak = max(_LimitedDescriptor.peak, _LimitedDescriptor.running)
+        await asyncio.sleep(0.01)
+        # Nested calls against the same host reuse the slot instead of deadlocking
+        await self.nested_call()
+        _LimitedDescriptor.running -= 1
+
+    @host_limited
+    async def nested_call(self):
+        await asyncio.sleep(0)
+
+
+class TestHostConcurrencyGovernor(unittest.TestCase):
+
+    def test_limit_enforced(self):
+        governor = HostConcurrencyGovernor()
+
+        async def _run():
+            descs = [_LimitedDescriptor("/tmp/{}".format(i)) for i in range(0, 10)]
+            for d in descs:
+                d.concurrency = governor
+            await asyncio.wait_for(asyncio.gather(*[d.slow_call() for d in descs]), 5)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(_LimitedDescriptor.peak, 2)
+        self.assertEqual(_LimitedDescriptor.running, 0)
+
+    def test_spawned_tasks_take_their_own_slots(self):
+        governor = HostConcurrencyGovernor()
+        _LimitedDescriptor.peak = 0
+
+        async def _run():
+            holder = _LimitedDescriptor("/tmp/holder")
+            holder.concurrency = governor
+            # Like a listing that holds a slot while the crawl consuming it spawns work on the same host
+            async with governor.slot(holder):
+                group = BoundedTaskGroup()
+                for i in range(0, 20):
+                    desc = _LimitedDescriptor("/tmp/{}".format(i))
+                    desc.concurrency = governor
+                    await group.spawn(desc.slow_call())
+                await asyncio.sleep(0.05)
+                self.assertEqual(_LimitedDescriptor.peak, 1)
+            await asyncio.wait_for(group.join(), 5)
+
+        asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(_LimitedDescriptor.peak, 2)
+        self.assertEqual(_LimitedDescriptor.running, 0)
+
+    def test_configured_limits(self):
+        governor = HostConcurrencyGovernor()
+        self.assertEqual(governor.limit(_LimitedDescriptor("/tmp")), 2)
+        self.assertIsNone(governor.limit(LocalDescriptor("/tmp")))
+        governor.set_limit("test://limited", 5)
+        self.assertEqual(governor.limit(_LimitedDescriptor("/tmp")), 5)
+
+    def test_bounded_task_group(self):
+        async def _run():
+            running = [0, 0]
+
+            async def _job(i):
+                running[0] += 1
+                running[1] = max(running)
+                await asyncio.sleep(0.001)
+                running[0] -= 1
+                if i == 7:
+                    raise ValueError("bad job")
+
+            group = BoundedTaskGroup(3)
+            for i in range(0, 20):
+                await group.spawn(_job(i))
+            with self.assertRaises(ValueError):
+                await group.join()
+            return running[1]
+
+        self.assertEqual(asyncio.new_event_loop().run_until_complete(_run()), 3)
+
+    def test_recursive_rmdir(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d) / "tree"
+            for i in range(0, 5):
+                sub = d / "sub{}".format(i)
+                sub.mkdir(parents=True)
+                for j in range(0, 5):
+                    with open(sub / "file{}.txt".format(j), "w") as h:
+                        h.write("I am the very model of a modern major general")
+            LocalDescriptor(d).rmdir(True)
+            self.assertFalse(d.exists())
+
+    def test_bounded_as_completed(self):
+        running = [0, 0]
+
+        async def _work(i):
+            running[0] += 1
+            running[1] = max(running[0], running[1])
+            await asyncio.sleep(0.01 * (5 - i % 5))
+            running[0] -= 1
+            return i
+
+        async def _run():
+            return [x async for x in bounded_as_completed((_work(i) for i in range(0, 20)), 4)]
+
+        results = asyncio.new_event_loop().run_until_complete(_run())
+        self.assertEqual(sorted(results), list(range(0, 20)))
+        self.assertEqual(running[1], 4)
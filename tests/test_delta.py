@@ -0,0 +1,109 @@
+import unittest
+import tempfile
+import pathlib
+import os
+import struct
+from universalio.delta import delta_copy_async, unpack_signatures, block_digest
+from universalio.descriptors import LocalDescriptor
+
+
+class TestDeltaCopy(unittest.TestCase):
+
+    def _files(self, d, old, new):
+        src_path = pathlib.Path(d) / "src.bin"
+        dst_path = pathlib.Path(d) / "dst.bin"
+        with open(src_path, "wb") as h:
+            h.write(new)
+        with open(dst_path, "wb") as h:
+            h.write(old)
+        return LocalDescriptor(src_path), LocalDescriptor(dst_path), dst_path
+
+    def test_changed_block(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 16
+            new = old[:1000] + b"changed" + old[1007:]
+            src, dst, dst_path = self._files(d, old, new)
+            result = src.loop.run(delta_copy_async(src, dst, block_size=512))
+            self.assertEqual(result.mode, "delta")
+            self.assertEqual(result.bytes_written, 512)
+            self.assertEqual(dst_path.read_bytes(), new)
+            block_size, digests = unpack_signatures(result.signatures)
+            self.assertEqual(block_size, 512)
+            self.assertEqual(len(digests), 8)
+
+    def test_append(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 10
+            src, dst, dst_path = self._files(d, old, old)
+            signatures = src.loop.run(delta_copy_async(src, dst, block_size=1000)).signatures
+            new = old + b"more log lines"
+            with open(pathlib.Path(d) / "src.bin", "wb") as h:
+                h.write(new)
+            src.clear_cache()
+            result = src.loop.run(delta_copy_async(src, dst, signatures))
+            self.assertEqual(result.mode, "append")
+            # Only the partial last block and the new data are written
+            self.assertEqual(result.bytes_written, len(new) - 2000)
+            self.assertEqual(dst_path.read_bytes(), new)
+
+    def test_grown_with_changed_middle(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 10
+            src, dst, dst_path = self._files(d, old, old)
+            signatures = src.loop.run(delta_copy_async(src, dst, block_size=512)).signatures
+            new = old[:1100] + b"changed" + old[1107:] + b"more log lines"
+            with open(pathlib.Path(d) / "src.bin", "wb") as h:
+                h.write(new)
+            for sigs in (signatures, None):
+                with open(dst_path, "wb") as h:
+                    h.write(old)
+                src.clear_cache()
+                result = src.loop.run(delta_copy_async(src, dst, sigs, block_size=512))
+                self.assertEqual(result.mode, "delta")
+                self.assertEqual(dst_path.read_bytes(), new)
+
+    def test_target_changed_elsewhere(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 8
+            src, dst, dst_path = self._files(d, old, old)
+            signatures = src.loop.run(delta_copy_async(src, dst, block_size=256)).signatures
+            # Same size, but not what the digests describe any more
+            with open(dst_path, "wb") as h:
+                h.write(b"x" * len(old))
+            stat = os.stat(dst_path)
+            os.utime(dst_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+            dst.clear_cache()
+            result = src.loop.run(delta_copy_async(src, dst, signatures))
+            self.assertEqual(result.bytes_written, len(old))
+            self.assertEqual(dst_path.read_bytes(), old)
+
+    def test_unstamped_signatures(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 8
+            src, dst, dst_path = self._files(d, b"x" * len(old), old)
+            # Signatures stored before the target was recorded with them can't vouch for it
+            signatures = struct.pack(">I", 256) + b"".join(block_digest(old[i:i + 256]) for i in range(0, len(old), 256))
+            src.loop.run(delta_copy_async(src, dst, signatures))
+            self.assertEqual(dst_path.read_bytes(), old)
+
+    def test_shrink(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 10
+            new = old[:1500]
+            src, dst, dst_path = self._files(d, old, new)
+            result = src.loop.run(delta_copy_async(src, dst, block_size=512))
+            self.assertEqual(result.bytes_written, 0)
+            self.assertEqual(dst_path.read_bytes(), new)
+
+    def test_with_signatures(self):
+        with tempfile.TemporaryDirectory() as d:
+            old = bytes(range(0, 256)) * 8
+            src, dst, dst_path = self._files(d, old, old)
+            signatures = src.loop.run(delta_copy_async(src, dst, block_size=256)).signatures
+            new = old[:300] + b"x" + old[301:]
+            with open(pathlib.Path(d) / "src.bin", "wb") as h:
+                h.write(new)
+            src.clear_cache()
+            result = src.loop.run(delta_copy_async(src, dst, signatures))
+            self.assertEqual(result.bytes_written, 256)
+            self.assertEqual(dst_path.read_bytes(), new)
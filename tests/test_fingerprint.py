@@ -0,0 +1,55 @@
+import unittest
+import tempfile
+import pathlib
+import hashlib
+from universalio.descriptors import LocalDescriptor
+from universalio.fingerprint import FileMetadata, FingerprintManager, encoded_checksum
+
+
+class _HashingDescriptor(LocalDescriptor):
+
+    fingerprint_strategies = ("content_hash",)
+
+
+class _ChecksumDescriptor(LocalDescriptor):
+
+    fingerprint_strategies = ("etag", "checksum", "mtime_size")
+
+    def metadata(self):
+        return FileMetadata(0, None, None, encoded_checksum("md5", "1B2M2Y8AsgTpgAmY7PhCfg=="))
+
+
+class TestFingerprint(unittest.TestCase):
+
+    def test_empty_file_is_not_hashed(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = pathlib.Path(d) / "empty.txt"
+            path.touch()
+            desc = _HashingDescriptor(path)
+            self.assertEqual(desc.fingerprint(), hashlib.sha256(b"").hexdigest())
+            desc = LocalDescriptor(path)
+            self.assertTrue(desc.fingerprint().endswith("_0"))
+
+    def test_content_hash(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = pathlib.Path(d) / "a.txt"
+            with open(path, "wb") as h:
+                h.write(b"hello world")
+            self.assertEqual(_HashingDescriptor(path).fingerprint(), hashlib.sha256(b"hello world").hexdigest())
+
+    def test_checksum(self):
+        with tempfile.TemporaryDirectory() as d:
+            desc = _ChecksumDescriptor(pathlib.Path(d) / "a.txt")
+            self.assertEqual(desc.fingerprint(), "md5:d41d8cd98f00b204e9800998ecf8427e")
+
+    def test_unknown_strategy(self):
+        class _Bad(LocalDescriptor):
+            fingerprint_strategies = ("mtime_size", "nope")
+        with self.assertRaises(ValueError):
+            FingerprintManager().strategies(_Bad)
+
+    def test_listing_reuses_entry_type(self):
+        with tempfile.TemporaryDirectory() as d:
+            (pathlib.Path(d) / "sub").mkdir()
+            children = {c.basename(): c for c in LocalDescriptor(d).list()}
+            self.assertEqual(children["sub"]._get_cache("is_dir"), (True, True))
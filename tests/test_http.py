@@ -5,9 +5,15 @@ import subprocess
 import shutil
 import os
 import time
+import socket
+import tempfile
 from universalio.descriptors import HttpDescriptor, LocalDescriptor
 from universalio import GlobalLoopContext
 from autoinject import injector
+from universalio.batch.diff import diff_trees, ADDED, DELETED
+from universalio.archive import create_archive, extract_archive
+from universalio.retry import RetryManager
+import aiohttp
 from .helpers import recursive_rmdir
 
 
@@ -29,7 +35,13 @@ class TestHttpDescriptor(unittest.TestCase):
         ]
         # Of note, if you want to see the errors from Flask here, you can change stdout/stderr
         cls.proc = subprocess.Popen(cmd, cwd=str(p), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        time.sleep(0.1)
+        # Wait for the server to come up, the first test otherwise races it
+        for _ in range(0, 100):
+            try:
+                socket.create_connection(("localhost", 5000), 1).close()
+                break
+            except OSError:
+                time.sleep(0.1)
         cls.server_root = p / "content"
 
     @classmethod
@@ -127,3 +139,72 @@ class TestHttpDescriptor(unittest.TestCase):
         file.write("I am the very model of a modern major general".encode("utf-8"))
         self.assertTrue(file.exists())
         self.assertEqual("I am the very model of a modern major general", file.text("utf-8"))
+
+    def test_server_errors_raise(self):
+        file = self._wrap("/_error/503/file.txt")
+        file.retries = RetryManager()
+        file.retries.base_delay = 0
+        file.retries.max_attempts = 2
+        # Not mistaken for a missing file, or read as if the error page were its content
+        with self.assertRaises(aiohttp.ClientResponseError):
+            file.exists()
+        with self.assertRaises(aiohttp.ClientResponseError):
+            file.read()
+        self.assertFalse(file._get_cache("head")[0])
+
+    def test_list(self):
+        root = TestHttpDescriptor.server_root
+        f = root / "foo"
+        f.mkdir()
+        (f / "bar").mkdir()
+        with open(f / "test.txt", "w") as h:
+            h.write("I am the very model of a modern major general")
+        names = [x.basename() for x in self._wrap("/foo/").list()]
+        self.assertIn("bar/", names)
+        self.assertIn("test.txt", names)
+        self.assertEqual(len(names), 2)
+
+    def test_diff_to_local(self):
+        root = TestHttpDescriptor.server_root
+        (root / "sub").mkdir()
+        for name in ("top.txt", "sub/a.txt"):
+            with open(root / name, "w") as h:
+                h.write(name)
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "sub").mkdir()
+            with open(d / "sub" / "a.txt", "w") as h:
+                h.write("sub/a.txt")
+
+            async def _run():
+                return {e.rel_path: e.status async for e in diff_trees(self._wrap("/"), LocalDescriptor(d))}
+
+            # Listed as "sub/" over HTTP and "sub" locally, but it's the same directory
+            diff = self.loop.run(_run())
+            self.assertNotIn(DELETED, diff.values())
+            self.assertEqual(sorted(diff), ["README.md", "sub/a.txt", "top.txt"])
+            self.assertEqual(diff["top.txt"], ADDED)
+
+    def test_archive_round_trip(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "src" / "sub").mkdir(parents=True)
+            for name in ("top.txt", "sub/a.txt"):
+                with open(d / "src" / name, "w") as h:
+                    h.write(name * 1000)
+            for name in ("out.tar.gz", "out.zip"):
+                with self.subTest(name):
+                    # Written straight into an upload to the server, then extracted from its download
+                    create_archive(LocalDescriptor(d / "src"), self._wrap("/" + name), chunk_size=1024)
+                    self.assertEqual(extract_archive(self._wrap("/" + name), LocalDescriptor(d / name), chunk_size=1024), 2)
+                    with open(d / name / "sub" / "a.txt", "r") as h:
+                        self.assertEqual(h.read(), "sub/a.txt" * 1000)
+            # The test server leaves sizes out, which zip only needs once each file has been read
+            root = TestHttpDescriptor.server_root
+            (root / "served").mkdir()
+            with open(root / "served" / "b.txt", "w") as h:
+                h.write("b" * 5000)
+            create_archive(self._wrap("/served/"), LocalDescriptor(d / "served.zip"), chunk_size=1024)
+            self.assertEqual(extract_archive(LocalDescriptor(d / "served.zip"), LocalDescriptor(d / "served")), 1)
+            with open(d / "served" / "b.txt", "r") as h:
+                self.assertEqual(h.read(), "b" * 5000)
@@ -0,0 +1,77 @@
+import unittest
+import datetime
+from universalio.util.listing import HtmlIndexParser, JsonArrayParser
+
+
+NGINX_INDEX = """<html>
+<head><title>Index of /files/</title></head>
+<body>
+<h1>Index of /files/</h1><hr><pre><a href="../">../</a>
+<a href="sub%20dir/">sub dir/</a>                                           19-Oct-2026 10:01       -
+<a href="test.txt">test.txt</a>                                           18-Oct-2026 09:30:15    1234
+<a href="2026-01-01%2010:00.log">2026-01-01 10:00.log</a>                 17-Oct-2026 08:00       42
+</pre><hr></body>
+</html>
+"""
+
+APACHE_INDEX = """<html><body><h1>Index of /files</h1>
+<table>
+<tr><th><a href="?C=N;O=D">Name</a></th><th><a href="?C=M;O=A">Last modified</a></th><th><a href="?C=S;O=A">Size</a></th></tr>
+<tr><td><a href="/">Parent Directory</a></td><td>&nbsp;</td><td align="right">  - </td></tr>
+<tr><td><a href="sub/">sub/</a></td><td align="right">2026-10-19 10:01  </td><td align="right">  - </td></tr>
+<tr><td><a href="big.bin">big.bin</a></td><td align="right">2026-10-18 09:30  </td><td align="right">1.2K</td></tr>
+<tr><td><a href="http://example.com/other">elsewhere</a></td><td></td><td></td></tr>
+</table></body></html>
+"""
+
+
+def _chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+class TestListingParsers(unittest.TestCase):
+
+    def _parse(self, parser, text, size):
+        entries = []
+        for chunk in _chunked(text, size):
+            entries.extend(parser.feed(chunk))
+        entries.extend(parser.close())
+        return entries
+
+    def test_nginx_index(self):
+        for size in (7, 64, len(NGINX_INDEX)):
+            entries = self._parse(HtmlIndexParser("http://localhost/files/"), NGINX_INDEX, size)
+            self.assertEqual([x.name for x in entries], ["sub dir/", "test.txt", "2026-01-01 10:00.log"])
+            self.assertIsNone(entries[0].size)
+            self.assertEqual(entries[0].mtime, datetime.datetime(2026, 10, 19, 10, 1, tzinfo=datetime.timezone.utc))
+            self.assertEqual(entries[1].size, 1234)
+            self.assertEqual(entries[1].mtime, datetime.datetime(2026, 10, 18, 9, 30, 15, tzinfo=datetime.timezone.utc))
+            self.assertEqual(entries[2].size, 42)
+            self.assertEqual(entries[2].mtime, datetime.datetime(2026, 10, 17, 8, 0, tzinfo=datetime.timezone.utc))
+
+    def test_apache_index(self):
+        entries = self._parse(HtmlIndexParser("http://localhost/files"), APACHE_INDEX, 13)
+        self.assertEqual([x.name for x in entries], ["sub/", "big.bin"])
+        self.assertTrue(entries[0].is_dir())
+        self.assertIsNone(entries[1].size)
+        self.assertEqual(entries[1].mtime, datetime.datetime(2026, 10, 18, 9, 30, tzinfo=datetime.timezone.utc))
+
+    def test_entries_yielded_incrementally(self):
+        parser = HtmlIndexParser("http://localhost/files/")
+        lines = NGINX_INDEX.split("\n")
+        self.assertEqual(parser.feed("\n".join(lines[:5]) + "\n"), [])
+        self.assertEqual([x.name for x in parser.feed(lines[5] + "\n")], ["sub dir/"])
+
+    def test_json_array(self):
+        text = '[ "a.txt", "sub/", {"name": "b.bin", "size": 12345, "mtime": "2026-10-18T09:30:15Z"}, "c" ]'
+        for size in (1, 5, len(text)):
+            entries = self._parse(JsonArrayParser(), text, size)
+            self.assertEqual([x.name for x in entries], ["a.txt", "sub/", "b.bin", "c"])
+            self.assertEqual(entries[2].size, 12345)
+            self.assertEqual(entries[2].mtime, datetime.datetime(2026, 10, 18, 9, 30, 15, tzinfo=datetime.timezone.utc))
+
+    def test_json_invalid(self):
+        self.assertRaises(ValueError, JsonArrayParser().feed, '{"name": "a"}')
+        parser = JsonArrayParser()
+        parser.feed('["a", "b"')
+        self.assertRaises(ValueError, parser.close)
@@ -7,6 +7,16 @@ from universalio import GlobalLoopContext
 from autoinject import injector
 
 
+class _BatchingDescriptor(LocalDescriptor):
+
+    remove_batch_size = 3
+    batches = []
+
+    async def _remove_batch_async(self, resources):
+        _BatchingDescriptor.batches.append(len(resources))
+        await super()._remove_batch_async(resources)
+
+
 class TestLocalDescriptor(unittest.TestCase):
 
     @injector.inject
@@ -265,3 +275,100 @@ class TestLocalDescriptor(unittest.TestCase):
             fd.remove()
             self.assertFalse(fd.exists())
             self.assertFalse(f1.exists())
+
+    def test_remove_many(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            files = []
+            for i in range(0, 7):
+                files.append(LocalDescriptor(d / "file{}.txt".format(i)))
+                (d / "file{}.txt".format(i)).touch()
+            _BatchingDescriptor.batches = []
+            self.assertEqual(_BatchingDescriptor(d).remove_many(files), 7)
+            self.assertEqual(sorted(_BatchingDescriptor.batches), [1, 3, 3])
+            self.assertEqual(list(d.iterdir()), [])
+
+    def test_rmdir_recursive(self):
+        with tempfile.TemporaryDirectory() as d:
+            root = pathlib.Path(d) / "root"
+            (root / "a" / "b").mkdir(parents=True)
+            for name in ("x.txt", "a/y.txt", "a/b/z.txt", "a/b/w.txt"):
+                (root / name).touch()
+            LocalDescriptor(root).rmdir(True)
+            self.assertFalse(root.exists())
+
+    def test_lazy_path(self):
+        with tempfile.TemporaryDirectory() as d:
+            desc = LocalDescriptor(d + "/file.txt")
+            self.assertIsNone(desc._cache)
+            self.assertIsInstance(desc._path, str)
+            self.assertEqual(desc.path, pathlib.Path(d) / "file.txt")
+            self.assertFalse(desc.exists())
+            self.assertEqual(desc._cache, {"exists": False})
+
+    def test_str_is_kept(self):
+        with tempfile.TemporaryDirectory() as d:
+            desc = LocalDescriptor(d + "//file.txt")
+            self.assertEqual(str(desc), str(pathlib.Path(d) / "file.txt"))
+            self.assertIs(str(desc), str(desc))
+            desc.path = pathlib.Path(d) / "other.txt"
+            self.assertEqual(str(desc), str(pathlib.Path(d) / "other.txt"))
+
+    def test_read_empty(self):
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.txt"
+            f.touch()
+            self.assertEqual(LocalDescriptor(f).read(), b"")
+
+    def test_readinto(self):
+        pirate_king = """I am the very model of a modern major general\nI've information vegetable, animal, and mineral"""
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.txt"
+            with open(f, "wb") as h:
+                h.write(pirate_king.encode("utf-8"))
+            fd = LocalDescriptor(f)
+            buffer = bytearray(fd.size())
+            self.assertEqual(fd.readinto(buffer), len(buffer))
+            self.assertEqual(buffer.decode("utf-8"), pirate_king)
+            small = bytearray(10)
+            self.assertEqual(fd.readinto(small), 10)
+            self.assertEqual(bytes(small), pirate_king[:10].encode("utf-8"))
+
+    def test_random_reader(self):
+        content = bytes(range(256)) * 40
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.bin"
+            with open(f, "wb") as h:
+                h.write(content)
+            fd = LocalDescriptor(f)
+
+            async def _check():
+                async with fd.random_reader(block_size=1000, max_blocks=4) as r:
+                    self.assertEqual(await r.read(10), content[:10])
+                    r.seek(-8, 2)
+                    self.assertEqual(r.tell(), len(content) - 8)
+                    self.assertEqual(await r.read(), content[-8:])
+                    self.assertEqual(await r.read(5), b"")
+                    r.seek(1995)
+                    self.assertEqual(await r.read(2500), content[1995:4495])
+                    r.seek(-100, 1)
+                    self.assertEqual(await r.read(10), content[4395:4405])
+                    self.assertLessEqual(len(r._blocks), 4)
+
+            self.loop.run(_check())
+
+    def test_random_access_file(self):
+        content = bytes(range(256)) * 40
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.bin"
+            with open(f, "wb") as h:
+                h.write(content)
+            with LocalDescriptor(f).random_access_file(block_size=512) as h:
+                self.assertTrue(h.seekable())
+                h.seek(-4, 2)
+                self.assertEqual(h.read(), content[-4:])
+                h.seek(600)
+                buffer = bytearray(100)
+                self.assertEqual(h.readinto(buffer), 100)
+                self.assertEqual(bytes(buffer), content[600:700])
+                self.assertEqual(h.tell(), 700)
@@ -0,0 +1,116 @@
+import unittest
+import tempfile
+import pathlib
+import gc
+import subprocess
+import sys
+from importlib.metadata import EntryPoint
+from unittest import mock
+from universalio.fileman import FileManager
+from universalio.descriptors import LocalDescriptor
+
+
+class _CustomDescriptor(LocalDescriptor):
+
+    # Doesn't declare its schemes, so it is asked about everything
+    schemes = None
+
+    @staticmethod
+    def match_location(location):
+        return location.startswith("custom:")
+
+    @staticmethod
+    def create_from_location(location):
+        return _CustomDescriptor(location[7:])
+
+
+class _SchemeDescriptor(LocalDescriptor):
+
+    schemes = ("plugin",)
+
+    @staticmethod
+    def match_location(location):
+        return location.startswith("plugin://")
+
+    @staticmethod
+    def create_from_location(location):
+        return _SchemeDescriptor(location[9:])
+
+
+class TestFileManager(unittest.TestCase):
+
+    def test_dispatch(self):
+        fm = FileManager(False)
+        fm.register_descriptor_class(_CustomDescriptor, 50)
+        self.assertIsInstance(fm.get_descriptor("/tmp/file.txt"), LocalDescriptor)
+        self.assertIsInstance(fm.get_descriptor("/tmp/odd://name"), LocalDescriptor)
+        self.assertIsInstance(fm.get_descriptor("custom:/tmp/file.txt"), _CustomDescriptor)
+        with self.assertRaises(ValueError):
+            fm.get_descriptor("ftp://server/file.txt")
+
+    def test_entry_points(self):
+        groups = {
+            "universalio.descriptors": [
+                EntryPoint("CustomDescriptor", "tests.test_manager:_CustomDescriptor", "universalio.descriptors"),
+            ],
+            "universalio.lazy_descriptors": [
+                EntryPoint("plugin", "tests.test_manager:_SchemeDescriptor", "universalio.lazy_descriptors"),
+            ],
+        }
+        with mock.patch("universalio.fileman.entry_points", lambda group: groups.get(group, [])):
+            fm = FileManager()
+            # Plugins not named after a scheme are loaded as they always were and asked about every location
+            self.assertIsInstance(fm.get_descriptor("custom:/tmp/file.txt"), _CustomDescriptor)
+            self.assertIsInstance(fm.get_descriptor("plugin:///tmp/file.txt"), _SchemeDescriptor)
+            self.assertIsInstance(fm.get_descriptor("/tmp/file.txt"), LocalDescriptor)
+
+    def test_interning(self):
+        fm = FileManager(False, intern_descriptors=True)
+        first = fm.get_descriptor("/tmp/file.txt")
+        self.assertIs(fm.get_descriptor("/tmp/file.txt"), first)
+        self.assertIsNot(FileManager(False).get_descriptor("/tmp/file.txt"), first)
+        del first
+        gc.collect()
+        self.assertEqual(len(fm._interned), 0)
+
+    def test_interned_local_not_stale(self):
+        with tempfile.TemporaryDirectory() as d:
+            fm = FileManager(False, intern_descriptors=True)
+            path = str(pathlib.Path(d) / "a.txt")
+            held = fm.get_descriptor(path)
+            self.assertFalse(held.exists())
+            # Made by someone else after the first lookup cached that it was missing
+            with open(path, "w") as h:
+                h.write("a")
+            self.assertIs(fm.get_descriptor(path), held)
+            self.assertTrue(held.exists())
+
+    def test_import_is_lazy(self):
+        # Backend SDKs are slow to import, so only resolving a location of theirs should load them
+        script = "\n".join([
+            "import sys",
+            "sys.path.insert(0, {!r})".format(str(pathlib.Path(__file__).parent.parent / "src")),
+            "import universalio",
+            "from universalio.fileman import FileManager",
+            "FileManager().get_descriptor('/tmp/file.txt')",
+            "print(','.join(m for m in ('aiohttp', 'asyncssh', 'azure.storage.blob') if m in sys.modules))",
+        ])
+        out = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip(), "")
+
+    def test_stat_many(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "sub").mkdir()
+            for i in range(0, 300):
+                with open(d / "file{}.txt".format(i), "w") as h:
+                    h.write("x" * i)
+            locations = [str(d / "file{}.txt".format(i)) for i in range(0, 300)]
+            locations.extend([str(d / "sub"), str(d / "missing.txt")])
+            results = {str(desc): stat for desc, stat in FileManager(False).stat_many(locations)}
+            self.assertEqual(len(results), 302)
+            self.assertEqual(results[str(d / "file0.txt")].size, 0)
+            self.assertEqual(results[str(d / "file42.txt")].size, 42)
+            self.assertIsNotNone(results[str(d / "file42.txt")].mtime)
+            self.assertTrue(results[str(d / "sub")].is_dir)
+            self.assertIsNone(results[str(d / "missing.txt")])
@@ -0,0 +1,84 @@
+import unittest
+import tempfile
+import pathlib
+import time
+from universalio.metadata_cache import MetadataCache
+from universalio.descriptors import LocalDescriptor
+
+
+class _SharedLocalDescriptor(LocalDescriptor):
+
+    metadata_ttl = 60
+    metadata_negative_ttl = 60
+
+
+class TestMetadataCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = MetadataCache()
+        self.cache.enabled = True
+
+    def test_expiry(self):
+        self.cache.put("sftp://host/a", "exists", True, 0.05)
+        self.assertEqual(self.cache.get("sftp://host/a", "exists"), (True, True))
+        time.sleep(0.1)
+        self.assertEqual(self.cache.get("sftp://host/a", "exists"), (False, None))
+        self.cache.put("sftp://host/a", "exists", True, 0)
+        self.assertEqual(self.cache.get("sftp://host/a", "exists"), (False, None))
+
+    def test_lru_limit(self):
+        self.cache.max_entries = 2
+        self.cache.put("sftp://host/a", "exists", True, 60)
+        self.cache.put("sftp://host/b", "exists", True, 60)
+        self.cache.get("sftp://host/a", "exists")
+        self.cache.put("sftp://host/c", "exists", True, 60)
+        self.assertTrue(self.cache.get("sftp://host/a", "exists")[0])
+        self.assertFalse(self.cache.get("sftp://host/b", "exists")[0])
+        self.assertTrue(self.cache.get("sftp://host/c", "exists")[0])
+
+    def test_invalidate_parents(self):
+        self.cache.put("sftp://host/a", "exists", False, 60)
+        self.cache.put("sftp://host/a/b", "exists", False, 60)
+        self.cache.put("sftp://host/a/b/c.txt", "exists", False, 60)
+        self.cache.put("sftp://host/other", "exists", True, 60)
+        self.cache.invalidate("sftp://host/a/b/c.txt", include_parents=True)
+        self.assertFalse(self.cache.get("sftp://host/a", "exists")[0])
+        self.assertFalse(self.cache.get("sftp://host/a/b", "exists")[0])
+        self.assertFalse(self.cache.get("sftp://host/a/b/c.txt", "exists")[0])
+        self.assertTrue(self.cache.get("sftp://host/other", "exists")[0])
+
+    def test_shared_between_descriptors(self):
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.txt"
+            first = _SharedLocalDescriptor(f)
+            first.metadata_cache = self.cache
+            self.assertFalse(first.exists())
+            with open(f, "w") as h:
+                h.write("I am the very model of a modern major general")
+            second = _SharedLocalDescriptor(f)
+            second.metadata_cache = self.cache
+            # Negative result is shared until it expires or is invalidated
+            self.assertFalse(second.exists())
+            second.write(b"I am the very model of a modern major general")
+            self.assertTrue(first.exists())
+            self.assertEqual(first.size(), 45)
+            second.remove()
+            self.assertFalse(first.exists())
+
+    def test_instance_cache_expires(self):
+        class _ShortLivedDescriptor(LocalDescriptor):
+            metadata_ttl = 0.05
+            metadata_negative_ttl = 0.05
+
+        with tempfile.TemporaryDirectory() as d:
+            f = pathlib.Path(d) / "test.txt"
+            desc = _ShortLivedDescriptor(f)
+            desc.metadata_cache = MetadataCache()
+            desc.metadata_cache.enabled = False
+            self.assertFalse(desc.exists())
+            with open(f, "w") as h:
+                h.write("changed elsewhere")
+            # Answered from the descriptor's own cache until the backend's TTL runs out
+            self.assertFalse(desc.exists())
+            time.sleep(0.1)
+            self.assertTrue(desc.exists())
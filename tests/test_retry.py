@@ -0,0 +1,121 @@
+import unittest
+import asyncio
+import tempfile
+import pathlib
+from universalio.retry import RetryBudget, RetryManager, is_transient_error, retryable
+from universalio.descriptors import LocalDescriptor
+
+
+class _StatusError(Exception):
+
+    def __init__(self, status):
+        super().__init__("status {}".format(status))
+        self.status = status
+
+
+class _FlakyReaderContextManager:
+
+    class Reader:
+
+        def __init__(self, reader):
+            self.reader = reader
+
+        async def read(self, chunk_size=None):
+            sent = 0
+            async for chunk in self.reader.read(chunk_size):
+                if sent > 0:
+                    raise ConnectionResetError("connection reset")
+                sent += 1
+                yield chunk
+
+    def __init__(self, context_manager):
+        self.context_manager = context_manager
+
+    async def __aenter__(self):
+        return _FlakyReaderContextManager.Reader(await self.context_manager.__aenter__())
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self.context_manager.__aexit__(exc_type, exc_val, exc_tb)
+
+
+class _FlakyDescriptor(LocalDescriptor):
+
+    calls = 0
+
+    def reader(self, chunk_size=None):
+        return _FlakyReaderContextManager(super().reader(chunk_size))
+
+    @retryable
+    async def flaky_call(self, fail_times):
+        _FlakyDescriptor.calls += 1
+        if _FlakyDescriptor.calls <= fail_times:
+            raise _StatusError(503)
+        return _FlakyDescriptor.calls
+
+
+class TestRetry(unittest.TestCase):
+
+    def setUp(self):
+        _FlakyDescriptor.calls = 0
+
+    def _manager(self):
+        retries = RetryManager()
+        retries.base_delay = 0
+        return retries
+
+    def test_classification(self):
+        self.assertTrue(is_transient_error(_StatusError(503)))
+        self.assertTrue(is_transient_error(_StatusError(429)))
+        self.assertTrue(is_transient_error(ConnectionResetError()))
+        self.assertTrue(is_transient_error(asyncio.TimeoutError()))
+        self.assertFalse(is_transient_error(_StatusError(404)))
+        self.assertFalse(is_transient_error(ValueError()))
+
+    def test_budget(self):
+        budget = RetryBudget(4)
+        self.assertTrue(budget.can_retry())
+        budget.record_failure()
+        self.assertTrue(budget.can_retry())
+        budget.record_failure()
+        self.assertFalse(budget.can_retry())
+        for i in range(0, 10):
+            budget.record_success()
+        self.assertTrue(budget.can_retry())
+
+    def test_retry_call(self):
+        d = _FlakyDescriptor(tempfile.gettempdir())
+        d.retries = self._manager()
+        self.assertEqual(asyncio.run(d.flaky_call(2)), 3)
+
+    def test_no_retry_past_max_attempts(self):
+        d = _FlakyDescriptor(tempfile.gettempdir())
+        d.retries = self._manager()
+        d.retries.max_attempts = 2
+        with self.assertRaises(_StatusError):
+            asyncio.run(d.flaky_call(3))
+        self.assertEqual(_FlakyDescriptor.calls, 2)
+
+    def test_no_retry_permanent_error(self):
+        d = _FlakyDescriptor(tempfile.gettempdir())
+        d.retries = self._manager()
+
+        async def _fail():
+            _FlakyDescriptor.calls += 1
+            raise ValueError("bad")
+
+        with self.assertRaises(ValueError):
+            asyncio.run(d.retries.call(d, _fail))
+        self.assertEqual(_FlakyDescriptor.calls, 1)
+
+    def test_resumed_copy(self):
+        with tempfile.TemporaryDirectory() as td:
+            data = bytes(range(0, 256)) * 40
+            src_path = pathlib.Path(td) / "src.bin"
+            dst_path = pathlib.Path(td) / "dst.bin"
+            with open(src_path, "wb") as h:
+                h.write(data)
+            src = _FlakyDescriptor(src_path)
+            src.retries = self._manager()
+            asyncio.run(src._do_copy_async(LocalDescriptor(dst_path), chunk_size=1000))
+            with open(dst_path, "rb") as h:
+                self.assertEqual(h.read(), data)
@@ -0,0 +1,463 @@
+import unittest
+import tempfile
+import pathlib
+import asyncio
+import time
+import os
+import sqlite3
+import threading
+from universalio.batch.sync import SqliteSyncManager, DirectorySync, DirectorySynchronizer, InMemoryChecker
+from universalio.batch.watch import create_watcher, _InotifyWatcher, _load_libc, RESCAN
+from universalio.batch.diff import diff_trees, ADDED, CHANGED, DELETED, UNCHANGED
+from universalio.descriptors import LocalDescriptor
+from universalio.descriptors.base import UNIOError
+
+
+class TestSqliteSyncManager(unittest.TestCase):
+
+    def test_save_and_reload(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _save():
+                mgr = SqliteSyncManager(db, batch_size=10)
+                for i in range(0, 25):
+                    await mgr.save_fingerprint("/src", "/dst", "file{}".format(i), "fp{}".format(i), i, 1000.0)
+                # Visible before the writer thread has committed them
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "file24"), "fp24")
+                await mgr.flush()
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "file3"), "fp3")
+                self.assertIsNone(await mgr.get_last_fingerprint("/src", "/dst", "missing"))
+                mgr.close()
+
+            async def _load():
+                mgr = SqliteSyncManager(db)
+                await mgr.preload("/src", "/dst")
+                self.assertEqual(len(mgr._preloaded[("/src", "/dst")]), 25)
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "file7"), "fp7")
+                self.assertIsNone(await mgr.get_last_fingerprint("/src", "/dst", "missing"))
+                await mgr.save_fingerprint("/src", "/dst", "file7", "changed")
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "file7"), "changed")
+                mgr.close()
+
+            asyncio.run(_save())
+            asyncio.run(_load())
+
+    def test_scoped_by_target(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                await mgr.save_fingerprint("/src", "/dst1", "a.txt", "fp")
+                await mgr.flush()
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst1", "a.txt"), "fp")
+                # Syncing the same source somewhere else doesn't see the first target's state
+                self.assertIsNone(await mgr.get_last_fingerprint("/src", "/dst2", "a.txt"))
+                mgr.close()
+
+            asyncio.run(_run())
+
+    def test_write_error(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                mgr.conn.execute(
+                    "CREATE TRIGGER refuse BEFORE INSERT ON sync_state BEGIN SELECT RAISE(ABORT, 'refused'); END"
+                )
+                mgr.conn.commit()
+                await mgr.save_fingerprint("/src", "/dst", "a.txt", "fp")
+                with self.assertRaises(UNIOError):
+                    await mgr.flush()
+                # Reported once, later batches are unaffected
+                await mgr.flush()
+                await mgr.save_fingerprint("/src", "/dst", "b.txt", "fp")
+                with self.assertRaises(UNIOError):
+                    mgr.close()
+
+            asyncio.run(_run())
+
+    def test_write_error_preloaded(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                mgr.conn.execute(
+                    "CREATE TRIGGER refuse BEFORE INSERT ON sync_state BEGIN SELECT RAISE(ABORT, 'refused'); END"
+                )
+                mgr.conn.commit()
+                await mgr.preload("/src", "/dst")
+                await mgr.save_fingerprint("/src", "/dst", "a.txt", "fp")
+                with self.assertRaises(UNIOError):
+                    await mgr.flush()
+                # Not stored, so the file isn't skipped next time
+                self.assertIsNone(await mgr.get_last_fingerprint("/src", "/dst", "a.txt"))
+                await mgr.release("/src", "/dst")
+                mgr.close()
+
+            asyncio.run(_run())
+
+    def test_release(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                await mgr.preload("/src", "/dst")
+                await mgr.preload("/src", "/dst")
+                await mgr.release("/src", "/dst")
+                # Still in use by the other pass
+                self.assertIn(("/src", "/dst"), mgr._preloaded)
+                await mgr.release("/src", "/dst")
+                self.assertEqual(mgr._preloaded, {})
+                mgr.close()
+
+            asyncio.run(_run())
+
+    def test_legacy_records(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+            conn = sqlite3.connect(db)
+            conn.execute("CREATE TABLE fingerprint_records (filepath text UNIQUE, fingerprint text)")
+            conn.executemany("INSERT INTO fingerprint_records VALUES (?, ?)", [
+                ("/src/a.txt", "fp_a"), ("/src/sub/b.txt", "fp_b"), ("/src2/c.txt", "fp_c"),
+            ])
+            conn.commit()
+            conn.close()
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                await mgr.preload("/src", "/dst")
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "a.txt"), "fp_a")
+                self.assertEqual(await mgr.get_last_fingerprint("/src", "/dst", "sub/b.txt"), "fp_b")
+                self.assertEqual(await mgr.get_last_fingerprint("/src2", "/dst", "c.txt"), "fp_c")
+                rows = mgr.conn.execute("SELECT COUNT(*) FROM fingerprint_records").fetchone()
+                self.assertEqual(rows[0], 0)
+                # Moved by the writer thread, the lookup connection never writes
+                self.assertEqual(mgr.conn.total_changes, 0)
+                mgr.close()
+
+            asyncio.run(_run())
+
+    def test_prune(self):
+        with tempfile.TemporaryDirectory() as d:
+            db = str(pathlib.Path(d) / "sync.db")
+
+            async def _run():
+                mgr = SqliteSyncManager(db)
+                for name in ("a.txt", "b.txt", "c.txt"):
+                    await mgr.save_fingerprint("/src", "/dst", name, "fp")
+                await mgr.save_fingerprint("/src", "/other", "a.txt", "fp")
+                await mgr.flush()
+                await mgr.prune("/src", "/dst", {"b.txt"})
+                await mgr.flush()
+                rows = mgr.conn.execute("SELECT target_root, rel_path FROM sync_state ORDER BY target_root").fetchall()
+                self.assertEqual(rows, [("/dst", "b.txt"), ("/other", "a.txt")])
+                mgr.close()
+
+            asyncio.run(_run())
+
+
+class _UnclosableChecker(InMemoryChecker):
+
+    def close(self):
+        raise UNIOError("Failed to save sync state")
+
+
+class TestDirectorySync(unittest.TestCase):
+
+    def test_close_error(self):
+        sync = DirectorySync(in_memory_checker=True)
+        sync.checker = _UnclosableChecker()
+        with self.assertRaises(UNIOError):
+            sync.wait_for_all()
+
+    def test_scope_released(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "src").mkdir()
+            (d / "dst").mkdir()
+            with open(d / "src" / "a.txt", "w") as h:
+                h.write("a")
+
+            mgr = SqliteSyncManager(str(d / "sync.db"))
+            synchronizer = DirectorySynchronizer(str(d / "src"), str(d / "dst"), mgr, None)
+            synchronizer.source.loop.run(synchronizer.sync_all())
+            self.assertEqual((d / "dst" / "a.txt").read_text(), "a")
+            self.assertEqual(mgr._preloaded, {})
+            mgr.close()
+
+    def test_sync_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            dst = d / "dst"
+            (src / "sub").mkdir(parents=True)
+            (dst / "sub").mkdir(parents=True)
+            for i in range(0, 20):
+                with open(src / "sub" / "file{}.txt".format(i), "w") as h:
+                    h.write("file {}".format(i))
+            with open(src / "top.txt", "w") as h:
+                h.write("top")
+            sync = DirectorySync(in_memory_checker=True)
+            self.assertEqual(sync.sync_dir(str(src), str(dst)).result(10), 21)
+            self.assertEqual((dst / "sub" / "file7.txt").read_text(), "file 7")
+            self.assertEqual((dst / "top.txt").read_text(), "top")
+            # Nothing changed, so nothing is copied the second time
+            self.assertEqual(sync.sync_dir(str(src), str(dst), name="again").result(10), 0)
+            sync.wait_for_all()
+
+    def test_mirror(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            dst = d / "dst"
+            (src / "sub").mkdir(parents=True)
+            (dst / "gone").mkdir(parents=True)
+            for name in ("a.txt", "sub/b.txt"):
+                with open(src / name, "w") as h:
+                    h.write(name)
+            with open(dst / "old.txt", "w") as h:
+                h.write("old")
+            with open(dst / "gone" / "c.txt", "w") as h:
+                h.write("c")
+            sync = DirectorySync(in_memory_checker=True)
+            self.assertEqual(sync.sync_dir(str(src), str(dst), two_sided=True).result(10), 2)
+            # Without mirroring, files only in the target are left alone
+            self.assertTrue((dst / "old.txt").exists())
+            self.assertEqual((dst / "sub" / "b.txt").read_text(), "sub/b.txt")
+            with open(src / "a.txt", "w") as h:
+                h.write("a.txt has changed")
+            self.assertEqual(sync.sync_dir(str(src), str(dst), name="mirror", mirror=True).result(10), 1)
+            self.assertEqual((dst / "a.txt").read_text(), "a.txt has changed")
+            self.assertFalse((dst / "old.txt").exists())
+            self.assertFalse((dst / "gone").exists())
+            sync.wait_for_all()
+
+
+    def test_transfers_follow_host_limit(self):
+        class _Endpoint:
+
+            running = [0, 0]
+
+            def host_key(self):
+                return "test://sync-host"
+
+            async def size_async(self):
+                return 1
+
+            async def copy_async(self, target, **kwargs):
+                self.running[0] += 1
+                self.running[1] = max(self.running)
+                await asyncio.sleep(0.01)
+                self.running[0] -= 1
+
+        endpoint = _Endpoint()
+        with tempfile.TemporaryDirectory() as d:
+
+            async def _run():
+                synchronizer = DirectorySynchronizer(d, d, InMemoryChecker(), None)
+                # As if the host had already shown it copes with twelve at once
+                synchronizer.adaptive.limiter(endpoint).limit = 12
+                await asyncio.gather(*[synchronizer._copy_file_once(endpoint, endpoint) for i in range(0, 30)])
+
+            LocalDescriptor(d).loop.run(_run())
+        self.assertEqual(endpoint.running[1], 12)
+
+
+class TestDiffTrees(unittest.TestCase):
+
+    def test_diff(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "src" / "sub").mkdir(parents=True)
+            (d / "dst" / "sub").mkdir(parents=True)
+            for name, content in (("src/same.txt", "x"), ("dst/same.txt", "x"), ("src/sub/new.txt", "new"),
+                                  ("src/size.txt", "longer"), ("dst/size.txt", "short"), ("dst/extra.txt", "")):
+                with open(d / name, "w") as h:
+                    h.write(content)
+
+            src = LocalDescriptor(d / "src")
+
+            async def _run():
+                return [(e.status, e.rel_path) async for e in diff_trees(src, LocalDescriptor(d / "dst"))]
+
+            self.assertEqual(src.loop.run(_run()), [
+                (DELETED, "extra.txt"),
+                (UNCHANGED, "same.txt"),
+                (CHANGED, "size.txt"),
+                (ADDED, "sub/new.txt"),
+            ])
+
+    def test_same_size_edit_behind_target_clock(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            (d / "src").mkdir()
+            (d / "dst").mkdir()
+            with open(d / "src" / "a.txt", "w") as h:
+                h.write("aaaa")
+            checker = InMemoryChecker()
+
+            async def _sync():
+                synchronizer = DirectorySynchronizer(str(d / "src"), str(d / "dst"), checker, asyncio.Semaphore(5),
+                                                     two_sided=True)
+                await synchronizer.sync_all()
+                return synchronizer.file_updates
+
+            loop = LocalDescriptor(d).loop
+            self.assertEqual(loop.run(_sync()), 1)
+            with open(d / "src" / "a.txt", "w") as h:
+                h.write("bbbb")
+            # The source host's clock is behind, so its edit looks older than the copy
+            past = time.time() - 3600
+            os.utime(d / "src" / "a.txt", (past, past))
+            self.assertEqual(loop.run(_sync()), 1)
+            self.assertEqual((d / "dst" / "a.txt").read_text(), "bbbb")
+            self.assertEqual(loop.run(_sync()), 0)
+
+
+class TestWatch(unittest.TestCase):
+
+    def _wait_for(self, path, content, timeout=10):
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            if path.exists() and path.read_text() == content:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def test_watch_dir(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            dst = d / "dst"
+            src.mkdir()
+            dst.mkdir()
+            with open(src / "before.txt", "w") as h:
+                h.write("before")
+            sync = DirectorySync(in_memory_checker=True)
+            job = sync.watch_dir(str(src), str(dst), mirror=True, debounce=0.2)
+            try:
+                self.assertTrue(self._wait_for(dst / "before.txt", "before"))
+                # Written elsewhere and moved in, so the watcher never sees it half written
+                with open(d / "new.txt", "w") as h:
+                    h.write("new")
+                (src / "sub").mkdir()
+                (d / "new.txt").rename(src / "sub" / "new.txt")
+                self.assertTrue(self._wait_for(dst / "sub" / "new.txt", "new"))
+                (src / "before.txt").unlink()
+                end = time.monotonic() + 10
+                while (dst / "before.txt").exists() and time.monotonic() < end:
+                    time.sleep(0.1)
+                self.assertFalse((dst / "before.txt").exists())
+                sync.stop_watch(job)
+                self.assertEqual(job.result(10), 2)
+            finally:
+                # A watch left running holds the global loop and stalls every later test
+                sync.wait_for_all()
+
+    def test_polling_watcher(self):
+        with tempfile.TemporaryDirectory() as d:
+            changes = []
+
+            async def _run():
+                watcher = create_watcher(d, changes.append, 0.1, use_inotify=False)
+                await watcher.start()
+                with open(pathlib.Path(d) / "a.txt", "w") as h:
+                    h.write("a")
+                await asyncio.sleep(0.5)
+                await watcher.stop()
+
+            asyncio.run(_run())
+            self.assertEqual(changes, ["a.txt"])
+
+    def test_inotify_callbacks_on_loop(self):
+        libc = _load_libc()
+        if libc is None:
+            self.skipTest("inotify is not available")
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            changes = []
+
+            class _RefusingLibc:
+
+                inotify_init1 = libc.inotify_init1
+
+                def inotify_add_watch(self, fd, path, mask):
+                    return -1 if path.endswith(b"refused") else libc.inotify_add_watch(fd, path, mask)
+
+            def _on_change(rel_path):
+                changes.append((rel_path, threading.current_thread()))
+
+            async def _run():
+                (d / "old" / "refused").mkdir(parents=True)
+                watcher = _InotifyWatcher(d, _on_change, _RefusingLibc())
+                await watcher.start()
+                self.assertEqual(changes, [(RESCAN, threading.main_thread())])
+                changes.clear()
+                (d / "sub" / "deep").mkdir(parents=True)
+                (d / "new" / "refused").mkdir(parents=True)
+                await asyncio.sleep(0.5)
+                # Directories inside the new one are watched as well
+                with open(d / "sub" / "deep" / "a.txt", "w") as h:
+                    h.write("a")
+                await asyncio.sleep(0.5)
+                await watcher.stop()
+
+            asyncio.run(_run())
+            paths = [rel_path for rel_path, _ in changes]
+            self.assertIn("sub", paths)
+            self.assertIn(RESCAN, paths)
+            self.assertIn(os.path.join("sub", "deep", "a.txt"), paths)
+            self.assertTrue(all(thread is threading.main_thread() for _, thread in changes))
+
+
+class _ChangeListingDescriptor(LocalDescriptor):
+
+    listed = None
+
+    async def changes_checkpoint_async(self):
+        return "1"
+
+    async def list_changes_async(self, checkpoint):
+        if checkpoint is None:
+            return None, None
+        return [(name, self.child(name)) for name in _ChangeListingDescriptor.listed], str(int(checkpoint) + 1)
+
+
+class TestIncrementalSync(unittest.TestCase):
+
+    def test_incremental(self):
+        with tempfile.TemporaryDirectory() as d:
+            d = pathlib.Path(d)
+            src = d / "src"
+            dst = d / "dst"
+            src.mkdir()
+            dst.mkdir()
+            for name in ("a.txt", "b.txt"):
+                with open(src / name, "w") as h:
+                    h.write(name)
+            mgr = SqliteSyncManager(str(d / "sync.db"))
+
+            async def _sync():
+                synchronizer = DirectorySynchronizer(
+                    str(src), str(dst), mgr, asyncio.Semaphore(5)
+                )
+                synchronizer.source = _ChangeListingDescriptor(src)
+                await synchronizer.sync_incremental()
+                return synchronizer.file_updates
+
+            loop = LocalDescriptor(src).loop
+            # No checkpoint yet, so everything is crawled
+            self.assertEqual(loop.run(_sync()), 2)
+            self.assertEqual(loop.run(mgr.get_checkpoint(str(src), str(dst))), "1")
+            with open(src / "b.txt", "w") as h:
+                h.write("b.txt changed")
+            _ChangeListingDescriptor.listed = ["b.txt"]
+            self.assertEqual(loop.run(_sync()), 1)
+            self.assertEqual((dst / "b.txt").read_text(), "b.txt changed")
+            self.assertEqual(loop.run(mgr.get_checkpoint(str(src), str(dst))), "2")
+            mgr.close()
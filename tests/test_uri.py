@@ -0,0 +1,77 @@
+import unittest
+import pathlib
+from universalio.descriptors import HttpDescriptor, SFTPDescriptor, AzureBlobDescriptor
+
+
+class TestUriChildren(unittest.TestCase):
+
+    def _parents(self):
+        return [
+            HttpDescriptor("https://example.com/data/dir/"),
+            HttpDescriptor("http://localhost:8080/"),
+            HttpDescriptor("https://example.com/my%20data/a+b/"),
+            SFTPDescriptor("sftp://sftp.example.com:2222/home/user", "user", None),
+            AzureBlobDescriptor("https://account.blob.core.windows.net/container/dir", "https://account.blob.core.windows.net"),
+            AzureBlobDescriptor("https://account.blob.core.windows.net/container", "https://account.blob.core.windows.net"),
+            AzureBlobDescriptor("https://account.blob.core.windows.net/container/my%20dir", "https://account.blob.core.windows.net"),
+        ]
+
+    def assertSameDescriptor(self, fast, slow):
+        self.assertIs(fast.__class__, slow.__class__)
+        self.assertEqual(fast.uri, slow.uri)
+        self.assertEqual(fast.path, slow.path)
+        self.assertEqual(fast.container, slow.container)
+        self.assertEqual(fast.basename(), slow.basename())
+        self.assertEqual(fast._is_dir, slow._is_dir)
+        self.assertEqual(fast.parent().uri, slow.parent().uri)
+
+    def test_matches_joinpath(self):
+        for parent in self._parents():
+            for name in ("file.txt", "a b&c=d.txt", "100%.csv", "café", "sub/"):
+                with self.subTest(parent=str(parent), name=name):
+                    self.assertSameDescriptor(parent.child(name), parent.joinpath(name))
+                    self.assertSameDescriptor(parent.child(name).child("x.txt"), parent.joinpath(name, "x.txt"))
+
+    def test_segment_quoting(self):
+        parent = HttpDescriptor("https://example.com/data/")
+        child = parent.child("a b/")
+        self.assertEqual(child.uri, "https://example.com/data/a+b/")
+        self.assertEqual(child.child("c&d.txt").uri, "https://example.com/data/a+b/c%26d.txt")
+
+    def test_escaped_parent(self):
+        # The parent's segments are already quoted, so they are kept as they are rather than quoted again
+        parent = HttpDescriptor("https://example.com/my%20data/")
+        self.assertEqual(parent.child("a b.txt").uri, "https://example.com/my%20data/a+b.txt")
+        self.assertEqual(parent.joinpath("a b.txt").uri, "https://example.com/my%20data/a+b.txt")
+        self.assertEqual(parent.joinpath("sub", "c.txt").uri, "https://example.com/my%20data/sub/c.txt")
+        self.assertEqual(parent.with_name("x y").uri, "https://example.com/x+y")
+        self.assertEqual(parent.child("a b.txt").parent().uri, "https://example.com/my%20data/")
+
+    def test_trailing_slashes(self):
+        http = HttpDescriptor("https://example.com/data/")
+        self.assertTrue(http.child("sub/")._is_dir)
+        self.assertEqual(http.child("sub/").basename(), "sub/")
+        self.assertFalse(http.child("sub")._is_dir)
+        self.assertEqual(http.child("sub").uri, "https://example.com/data/sub")
+        sftp = SFTPDescriptor("sftp://sftp.example.com/home", "user", None)
+        self.assertEqual(sftp.child("sub/").uri, "sftp://sftp.example.com/home/sub")
+        self.assertEqual(sftp.child("sub/").path, pathlib.PurePosixPath("/home/sub"))
+
+    def test_unusual_names_use_joinpath(self):
+        parent = HttpDescriptor("https://example.com/data/dir/")
+        for name in ("a/b.txt", "..", "."):
+            with self.subTest(name=name):
+                self.assertSameDescriptor(parent.child(name), parent.joinpath(name))
+
+    def test_state_is_not_shared(self):
+        parent = HttpDescriptor("https://example.com/data/")
+        parent._is_canonical = True
+        parent._set_cache("exists", True)
+        child = parent.child("file.txt")
+        self.assertIsNone(child._is_canonical)
+        self.assertEqual(child._get_cache("exists"), (False, None))
+        child._set_cache("exists", False)
+        self.assertEqual(parent._get_cache("exists"), (True, True))
+        self.assertIs(child.loop, parent.loop)
+        sftp = SFTPDescriptor("sftp://sftp.example.com/home", "user", "secret")
+        self.assertEqual(sftp.child("a.txt").password, "secret")
@@ -47,6 +47,9 @@ def select_content_type(server_options, accept_header):
 
 
 def _handle_request(content):
+    if content.startswith("_error/"):
+        # Answers with the given status, for testing how clients handle server errors
+        return abort(int(content.split("/")[1]))
     full_path = base / content
     # Don't let them outside of the content directory
     full_path = full_path.absolute()